@@ -0,0 +1,487 @@
+import asyncio
+import json
+import pandas as pd
+import trading_ig_config
+import IgAsyncApiHandler
+import IgRateLimiter
+import IgResponseCache
+import IgInstrumentation
+import IgSingleFlight
+import IgPriceCache
+import IgPriceDecoder
+import IgOutput
+import IgResample
+from datetime import datetime, timedelta
+from decimal import Decimal
+from IGCustomPlatform import IGException, DATE_FORMAT
+
+# columns of the markets table returned for a navigation node which lists no markets
+NAVIGATION_MARKET_COLUMNS = ["bid",
+                             "delayTime",
+                             "epic",
+                             "expiry",
+                             "high",
+                             "instrumentName",
+                             "instrumentType",
+                             "lotSize",
+                             "low",
+                             "marketStatus",
+                             "netChange",
+                             "offer",
+                             "otcTradeable",
+                             "percentageChange",
+                             "scalingFactor",
+                             "streamingPricesAvailable",
+                             "updateTime"]
+
+
+
+# asyncio twin of IGREST. the classes below mirror IGMarketData, IGAccountData and IGDealer method for method, returning the same
+# types, but every call is a coroutine sharing one pooled connection, and there is no session argument.
+# use as 'async with AsyncIGDealer() as ig:' or call close() when done
+class AsyncIGREST:
+    def __init__(self, base_url: str = None, output: IgOutput.OutputBackend = None, scheduler: IgRateLimiter.RequestScheduler = None, response_cache: IgResponseCache.ResponseCache = None, instrumentation: IgInstrumentation.Instrumentation = None, single_flight: IgSingleFlight.SingleFlight = None):
+        self.config = trading_ig_config.api_config()
+        self.api_handler = IgAsyncApiHandler.AsyncApiHandler(self.config.api_key, self.config.acc_type, scheduler = scheduler, response_cache = response_cache, base_url = base_url, instrumentation = instrumentation, single_flight = single_flight)
+        self.output = IgOutput.PANDAS if output is None else output
+
+    async def __aenter__(self):
+        await self.api_handler.open()
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.close()
+
+    async def close(self):
+        await self.api_handler.close()
+
+    async def create_session(self):
+        version = '2'
+        endpoint = '/session'
+        params = {'identifier': self.config.username,
+                  'password': self.config.password}
+        response = await self.api_handler.post(version = version, endpoint = endpoint, params = params)
+        if response.status_code == 200:
+            self.set_security_headers(response)
+        else:
+            raise IGException(response.text)
+
+    def set_security_headers(self, response: IgAsyncApiHandler.ApiResponse):
+        if 'CST' in response.headers:
+            self.api_handler.headers['CST'] = response.headers['CST']
+        if 'X-SECURITY-TOKEN' in response.headers:
+            self.api_handler.headers['X-SECURITY-TOKEN'] = response.headers['X-SECURITY-TOKEN']
+
+
+
+class AsyncIGMarketData(AsyncIGREST):
+    def __init__(self, price_cache: IgPriceCache.PriceCache = None, base_url: str = None, output: IgOutput.OutputBackend = None, derive: bool = True, session_offset: timedelta = timedelta(0), scheduler: IgRateLimiter.RequestScheduler = None, response_cache: IgResponseCache.ResponseCache = None, instrumentation: IgInstrumentation.Instrumentation = None, single_flight: IgSingleFlight.SingleFlight = None):
+        super().__init__(base_url, output, scheduler, response_cache, instrumentation, single_flight)
+        self.price_cache = price_cache
+        self.derive = derive
+        self.session_offset = session_offset
+
+    async def get_historical_data_daterange(self, epic: str, resolution: str, start_date: datetime, end_date: datetime = datetime.now(), output: IgOutput.OutputBackend = None):
+        output = output or self.output
+        if self.price_cache is None:
+            return await self.fetch_historical_data_daterange(epic, resolution, start_date, end_date, output)
+        missing = self.price_cache.missing_intervals(epic, resolution, start_date, end_date)
+        if len(missing) > 0 and self.derive:
+            derived = IgResample.derive(self.price_cache, epic, resolution, start_date, end_date, self.session_offset)
+            if derived is not None:
+                return output.prices_from_arrays(*derived)
+        for gap_start, gap_end in missing:
+            times, values = await self.fetch_historical_arrays(epic, resolution, gap_start, gap_end)
+            self.price_cache.store_arrays(epic, resolution, times, values, gap_start, gap_end)
+        return output.prices_from_arrays(*self.price_cache.load_arrays(epic, resolution, start_date, end_date))
+
+    async def get_historical_data_many(self, epics: list, resolution: str, start_date: datetime, end_date: datetime = datetime.now(), output: IgOutput.OutputBackend = None):
+        output = output or self.output
+        epics = list(dict.fromkeys(epics))
+        results = await asyncio.gather(*[self.get_historical_data_daterange(epic, resolution, start_date, end_date, output) for epic in epics], return_exceptions = True)
+        prices = {}
+        failures = []
+        for epic, result in zip(epics, results):
+            if isinstance(result, Exception):
+                failures.append({'epic': epic, 'error': str(result)})
+            else:
+                prices[epic] = result
+        return output.concat_prices(prices), pd.DataFrame(failures, columns = ['epic', 'error'])
+
+    async def fetch_historical_data_daterange(self, epic: str, resolution: str, start_date: datetime, end_date: datetime, output: IgOutput.OutputBackend = None):
+        return (output or self.output).prices_from_arrays(*await self.fetch_historical_arrays(epic, resolution, start_date, end_date))
+
+    async def fetch_historical_arrays(self, epic: str, resolution: str, start_date: datetime, end_date: datetime):
+        version = '2'
+        endpoint = '/prices/{epic}/{resolution}/{start_date}/{end_date}'.format(epic = epic, resolution = resolution, start_date = start_date.strftime(DATE_FORMAT), end_date = end_date.strftime(DATE_FORMAT))
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            if 'allowance' in data:
+                self.api_handler.scheduler.record_allowance(data['allowance'])
+            return self.api_handler.build(response, IgPriceDecoder.decode_prices, data['prices'])
+        else:
+            raise IGException(data)
+
+    async def get_historical_data_numpoints(self, epic: str, resolution: str, numpoints: int, output: IgOutput.OutputBackend = None):
+        version = '2'
+        endpoint = '/prices/{epic}/{resolution}/{numpoints}'.format(epic = epic, resolution = resolution, numpoints = numpoints)
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            if 'allowance' in data:
+                self.api_handler.scheduler.record_allowance(data['allowance'])
+            times, values = self.api_handler.build(response, IgPriceDecoder.decode_prices, data['prices'])
+            if self.price_cache is not None and len(times) > 0:
+                self.price_cache.store_arrays(epic, resolution, times, values, pd.Timestamp(times[0]).to_pydatetime(), pd.Timestamp(times[-1]).to_pydatetime())
+            return (output or self.output).prices_from_arrays(times, values)
+        else:
+            raise IGException(data)
+
+    def prices_as_dataframe(self, data: json):
+        return self.output.prices(data)
+
+    def navigation_as_dataframes(self, data: dict):
+        if data['nodes'] is None:
+            data['nodes'] = pd.DataFrame(columns = ['id', 'name'])
+        else:
+            data['nodes'] = pd.json_normalize(data['nodes'])
+        if data['markets'] is None:
+            data['markets'] = pd.DataFrame(columns = NAVIGATION_MARKET_COLUMNS)
+        else:
+            data['markets'] = pd.json_normalize(data['markets'])
+        return data
+
+    async def market_navigation(self):
+        version = '1'
+        endpoint = '/marketnavigation'
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            data = self.api_handler.build(response, self.navigation_as_dataframes, data)
+            return {'nodes': data['nodes'],
+                    'markets': data['markets']}
+        else:
+            raise IGException(data)
+
+    async def market_node(self, nodeId: str):
+        version = '1'
+        endpoint = '/marketnavigation/{nodeId}'.format(nodeId = nodeId)
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return self.api_handler.build(response, self.navigation_as_dataframes, data)
+        else:
+            raise IGException(data)
+
+    async def market_details(self, epics: str, filter: str = 'ALL'):
+        version = '2'
+        endpoint = '/markets'
+        params = {'epics': epics,
+                  'filter': filter}
+        response = await self.api_handler.get(version = version, endpoint = endpoint, params = params)
+        if response.status_code == 200:
+            return self.api_handler.decode(response)
+        else:
+            raise IGException(response.text)
+
+    async def market_details_many(self, epics: list, filter: str = 'ALL', chunk_size: int = 50):
+        epics = list(dict.fromkeys(epics))
+        chunks = [epics[start:start + chunk_size] for start in range(0, len(epics), chunk_size)]
+        async def download(chunk: list):
+            details = (await self.market_details(','.join(chunk), filter))['marketDetails']
+            for epic, detail in zip(chunk, details):
+                detail.setdefault('instrument', {}).setdefault('epic', epic)
+            return details
+        details = [detail for chunk in await asyncio.gather(*[download(chunk) for chunk in chunks]) for detail in chunk]
+        if len(details) == 0:
+            return pd.DataFrame(index = pd.Index(epics, name = 'epic'))
+        details = pd.json_normalize(details)
+        details.index = pd.Index(details['instrument.epic'], name = 'epic')
+        return details.reindex(epics)
+
+    async def search_markets(self, searchTerm: str, output: IgOutput.OutputBackend = None):
+        version = '1'
+        endpoint = '/markets?searchTerm={searchTerm}'.format(searchTerm = searchTerm)
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return self.api_handler.build(response, (output or self.output).records, data['markets'])
+        else:
+            raise IGException(data)
+
+
+
+class AsyncIGAccountData(AsyncIGREST):
+    async def list_accounts(self, output: IgOutput.OutputBackend = None):
+        version = '1'
+        endpoint = '/accounts'
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return self.api_handler.build(response, (output or self.output).records, data['accounts'], rename = {'balance.balance': 'balance',
+                                                                                                                 'balance.deposit': 'deposit',
+                                                                                                                 'balance.profitLoss': 'profitLoss',
+                                                                                                                 'balance.available': 'availableBalance'})
+        else:
+            raise IGException(data)
+
+    async def account_preferences(self):
+        version = '1'
+        endpoint = '/accounts/preferences'
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        preference = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return dict(preference)
+        else:
+            raise IGException(preference)
+
+    async def update_account_preferences(self, trailingStopsEnabled: str = 'false'):
+        version = '1'
+        endpoint = '/accounts/preferences'
+        params = {'trailingStopsEnabled': trailingStopsEnabled}
+        response = await self.api_handler.put(version = version, endpoint = endpoint, params = params)
+        data = dict(self.api_handler.decode(response))
+        if response.status_code == 200:
+            return data
+        else:
+            raise IGException(data)
+
+    async def account_history(self, maxSpanSeconds: int, pageSize: int, dateFrom: datetime, dateTo: datetime = datetime.now(), output: IgOutput.OutputBackend = None, max_workers: int = 1):
+        params = {'from': dateFrom,
+                  'to': dateTo,
+                  'maxSpanSeconds': maxSpanSeconds,
+                  'pageSize': pageSize,
+                  'pageNumber': 1}
+        return (output or self.output).records(await self.history_pages('/history/activity', 'activities', params, max_workers), normalize = False)
+
+    async def transaction_history(self, maxSpanSeconds: int, pageSize: int, dateFrom: datetime, dateTo: datetime = datetime.now(), transactionType: str = 'ALL', output: IgOutput.OutputBackend = None, max_workers: int = 1):
+        params = {'transactionType': transactionType,
+                  'from': dateFrom,
+                  'to': dateTo,
+                  'maxSpanSeconds': maxSpanSeconds,
+                  'pageSize': pageSize,
+                  'pageNumber': 1}
+        return (output or self.output).records(await self.history_pages('/history/transactions', 'transactions', params, max_workers), normalize = False)
+
+    # downloads the first page, then the rest either one after another or, with max_workers above 1, that many at a time
+    async def history_pages(self, endpoint: str, key: str, params: dict, max_workers: int):
+        version = '2'
+        limit = asyncio.Semaphore(max_workers)
+        async def download(pageNumber: int):
+            async with limit:
+                response = await self.api_handler.get(endpoint = endpoint, version = version, params = dict(params, pageNumber = pageNumber))
+            data = self.api_handler.decode(response)
+            if response.status_code == 200:
+                return data
+            else:
+                raise IGException(data)
+        first = await download(1)
+        history = list(first[key])
+        for page in await asyncio.gather(*[download(pageNumber) for pageNumber in range(2, first['metadata']['pageData']['totalPages'] + 1)]):
+            history.extend(page[key])
+        return history
+
+    async def list_watchlists(self, output: IgOutput.OutputBackend = None):
+        version = '1'
+        endpoint = '/watchlists'
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return self.api_handler.build(response, (output or self.output).records, data['watchlists'])
+        else:
+            raise IGException(data)
+
+    async def create_watchlist(self, name: str, epics: list):
+        version = '1'
+        endpoint = '/watchlists'
+        params = {'name': name,
+                  'epics': epics}
+        response = await self.api_handler.post(version = version, endpoint = endpoint, params = params)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return data
+        else:
+            raise IGException(data)
+
+    async def add_to_watchlist(self, watchlistId: str, epic: str):
+        version = '1'
+        endpoint = '/watchlists/{watchlistId}'.format(watchlistId = watchlistId)
+        params = {'epic': epic}
+        response = await self.api_handler.put(version = version, endpoint = endpoint, params = params)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return data['status']
+        else:
+            raise IGException(data)
+
+    async def remove_from_watchlist(self, watchlistId: str, epic: str):
+        version = '1'
+        endpoint = '/watchlists/{watchlistId}/{epic}'.format(watchlistId = watchlistId, epic = epic)
+        response = await self.api_handler.delete(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return data['status']
+        else:
+            raise IGException(data)
+
+    async def get_watchlist(self, watchlistId: str, output: IgOutput.OutputBackend = None):
+        version = '1'
+        endpoint = '/watchlists/{watchlistId}'.format(watchlistId = watchlistId)
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return self.api_handler.build(response, (output or self.output).records, data['markets'])
+        else:
+            raise IGException(data)
+
+    async def delete_watchlist(self, watchlistId: str):
+        version = '1'
+        endpoint = '/watchlists/{watchlistId}'.format(watchlistId = watchlistId)
+        response = await self.api_handler.delete(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return data['status']
+        else:
+            raise IGException(data)
+
+
+
+class AsyncIGDealer(AsyncIGAccountData):
+    async def deal(self, method: str, endpoint: str, version: str, params: dict = None):
+        response = await self.api_handler.send(method, endpoint, version, params, None)
+        deal = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return await self.get_deal_confirmation(dealId = deal['dealReference'])
+        else:
+            raise IGException(deal)
+
+    async def open_position(self, currencyCode: str, direction: str, epic: str, level: Decimal, orderType: str, size: Decimal, expiry: str = None, forceOpen: bool = False, guaranteedStop: bool = False, limitDistance: Decimal = None, limitLevel: Decimal = None, quoteId: str = None, stopDistance: Decimal = None, stopLevel: Decimal = None, timeInForce: str = None, trailingStop: Decimal = None, trailingStopIncrement: int = None, dealReference: str = datetime.now().strftime(format = '%Y/%m/%d %H:%M:%S')):
+        params = {'currencyCode': currencyCode,
+                  'dealReference': dealReference,
+                  'direction': direction,
+                  'epic': epic,
+                  'expiry': expiry,
+                  'forceOpen': forceOpen,
+                  'guaranteedStop': guaranteedStop,
+                  'level': level,
+                  'limitDistance': limitDistance,
+                  'limitLevel': limitLevel,
+                  'orderType': orderType,
+                  'quoteId': quoteId,
+                  'size': size,
+                  'stopDistance': stopDistance,
+                  'stopLevel': stopLevel,
+                  'timeInForce': timeInForce,
+                  'trailingStop': trailingStop,
+                  'trailingStopIncrement': trailingStopIncrement}
+        return await self.deal('POST', '/positions/otc', '2', params)
+
+    async def close_position(self, dealId: str, direction: str, epic: str, expiry: str, level: Decimal, orderType: str, size: Decimal, timeInForce: str, quoteId: str = None):
+        params = {'dealId': dealId,
+                  'direction': direction,
+                  'epic': epic,
+                  'expiry': expiry,
+                  'level': level,
+                  'orderType': orderType,
+                  'quoteId': quoteId,
+                  'size': size,
+                  'timeInForce': timeInForce}
+        return await self.deal('DELETE', '/positions/otc', '1', params)
+
+    async def update_position(self, dealId: str, guaranteedStop: bool = False, limitLevel: Decimal = None, stopLevel: Decimal = None, trailingStop: bool = False, trailingStopDistance: Decimal = None, trailingStopIncrement: Decimal = None):
+        params = {'guaranteedStop': guaranteedStop,
+                  'limitLevel': limitLevel,
+                  'stopLevel': stopLevel,
+                  'trailingStop': trailingStop,
+                  'trailingStopDistance': trailingStopDistance,
+                  'trailingStopIncrement': trailingStopIncrement}
+        return await self.deal('PUT', '/positions/otc/{dealId}'.format(dealId = dealId), '2', params)
+
+    async def list_positions(self, output: IgOutput.OutputBackend = None):
+        output = output or self.output
+        version = '2'
+        endpoint = '/positions'
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            markets = self.api_handler.build(response, output.records, [position['market'] for position in data['positions']])
+            positions = self.api_handler.build(response, output.records, [position['position'] for position in data['positions']])
+            return (markets, positions)
+        else:
+            raise IGException(data)
+
+    async def list_working_orders(self, output: IgOutput.OutputBackend = None):
+        output = output or self.output
+        version = '2'
+        endpoint = '/workingorders'
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            marketData = self.api_handler.build(response, output.records, [order['marketData'] for order in data['workingOrders']])
+            workingOrderData = self.api_handler.build(response, output.records, [order['workingOrderData'] for order in data['workingOrders']])
+            return (marketData, workingOrderData)
+        else:
+            raise IGException(data)
+
+    async def create_working_order(self, currencyCode: str, dealReference: str, direction: str, epic: str, expiry: str, forceOpen: bool, goodTillDate: datetime, guaranteedStop: str, level: Decimal, limitDistance: Decimal, limitLevel: Decimal, size: Decimal, stopDistance: Decimal, stopLevel: Decimal, timeInForce: str, type: str):
+        params = {'currencyCode': currencyCode,
+                  'dealReference': dealReference,
+                  'direction': direction,
+                  'epic': epic,
+                  'expiry': expiry,
+                  'forceOpen': forceOpen,
+                  'goodTillDate': goodTillDate,
+                  'guaranteedStop': guaranteedStop,
+                  'level': level,
+                  'limitDistance': limitDistance,
+                  'limitLevel': limitLevel,
+                  'type': type,
+                  'size': size,
+                  'stopDistance': stopDistance,
+                  'stopLevel': stopLevel,
+                  'timeInForce': timeInForce}
+        return await self.deal('POST', '/workingorders/otc', '2', params)
+
+    async def delete_working_order(self, dealId: str):
+        return await self.deal('DELETE', '/workingorders/otc/{dealId}'.format(dealId = dealId), '2')
+
+    async def update_working_order(self, goodTillDate: datetime, guaranteedStop: bool, level: Decimal, limitDistance: Decimal, limitLevel: Decimal, stopDistance: Decimal, stopLevel: Decimal, timeInForce: str, type: str):
+        params = {'goodTillDate': goodTillDate,
+                  'guaranteedStop': guaranteedStop,
+                  'level': level,
+                  'limitDistance': limitDistance,
+                  'limitLevel': limitLevel,
+                  'type': type,
+                  'stopDistance': stopDistance,
+                  'stopLevel': stopLevel,
+                  'timeInForce': timeInForce}
+        return await self.deal('POST', '/workingorders/otc', '2', params)
+
+    async def open_sprint_market_position(self, dealReference: str, direction: str, epic: str, expiryPeriod: str, size: Decimal):
+        params = {'dealReference': dealReference,
+                  'direction': direction,
+                  'epic': epic,
+                  'expiryPeriod': expiryPeriod,
+                  'size': size}
+        return await self.deal('POST', '/positions/sprintmarkets', '1', params)
+
+    async def list_sprint_market_positions(self, output: IgOutput.OutputBackend = None):
+        version = '2'
+        endpoint = '/positions/sprintmarkets'
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return self.api_handler.build(response, (output or self.output).records, data['sprintMarketPositions'])
+        else:
+            raise IGException(data)
+
+    async def get_deal_confirmation(self, dealId: str):
+        version = '2'
+        endpoint = '/confirms/{dealId}'.format(dealId = dealId)
+        response = await self.api_handler.get(version = version, endpoint = endpoint)
+        data = self.api_handler.decode(response)
+        if response.status_code == 200:
+            return self.api_handler.build(response, pd.json_normalize, data)
+        else:
+            raise IGException(data)
@@ -1,11 +1,30 @@
 import pandas as pd
 import trading_ig_config
 import IgApiHandler
-from datetime import datetime
-from requests import Session, Response
+import IgRateLimiter
+import IgResponseCache
+import IgInstrumentation
+import IgSingleFlight
+import IgPriceCache
+import IgPriceDecoder
+import IgOutput
+import IgResample
+from datetime import datetime, timedelta
+from requests import Session, Response, RequestException
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import queue
+import time
 import json
+import uuid
+import logging
 from decimal import Decimal
 
+logger = logging.getLogger(__name__)
+
+# the form IG takes dates in the /prices/{epic}/{resolution}/{start_date}/{end_date} path, to the whole second
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
 # exception handling class, for when the IG API returns an unsuccessful response code
 class IGException(Exception):
     print('IG has raised an exception')
@@ -13,9 +32,11 @@ class IGException(Exception):
 
 
 
-# base class for establishing a connection to the IG service
+# base class for establishing a connection to the IG service. output chooses the container the data methods return their
+# tables in (see IgOutput), and each of those methods takes an output of its own to override it for one call.
+# scheduler, response_cache, instrumentation and single_flight are handed to the api handler, so platforms can share them
 class IGREST:
-    def __init__(self, session: Session = None):
+    def __init__(self, session: Session = None, base_url: str = None, output: IgOutput.OutputBackend = None, scheduler: IgRateLimiter.RequestScheduler = None, response_cache: IgResponseCache.ResponseCache = None, instrumentation: IgInstrumentation.Instrumentation = None, single_flight: IgSingleFlight.SingleFlight = None):
         self.config = trading_ig_config.api_config()
         self.CST = None
         self.XST = None
@@ -23,7 +44,8 @@ class IGREST:
             self.session = Session()
         else:
             self.session = session
-        self.api_handler = IgApiHandler.ApiHandler(self.session, self.config.api_key, self.config.acc_type)
+        self.api_handler = IgApiHandler.ApiHandler(self.session, self.config.api_key, self.config.acc_type, scheduler = scheduler, response_cache = response_cache, base_url = base_url, instrumentation = instrumentation, single_flight = single_flight)
+        self.output = IgOutput.PANDAS if output is None else output
         
     def create_session(self, session: Session = None):
         session = self.api_handler.ensure_session(session)
@@ -45,60 +67,108 @@ class IGREST:
             session.headers.update({'X-SECURITY-TOKEN': response.headers['X-SECURITY-TOKEN']})
             print('X Security Token set')
 
+    # new connection pool carrying the authenticated headers, for worker threads which must not share self.session
+    def worker_session(self):
+        session = Session()
+        session.headers.update(self.session.headers)
+        return session
+
 
 
-# class for pulling data from the IG APIs. Data is returned in pandas dataframes
+# class for pulling data from the IG APIs. Data is returned in pandas dataframes.
+# historical prices are read through the price cache when one is given, so only the missing time ranges are downloaded.
+# with derive, a resolution the cache does not hold is first derived from a finer one it holds for the whole range, which
+# costs none of the historical data allowance. session_offset is where derived bars start, e.g. 22 hours for daily bars
+# running from 22:00 to 22:00 like IG's FX days
 class IGMarketData(IGREST):
-    def get_historical_data_daterange(self, epic: str, resolution: str, start_date: datetime, end_date: datetime = datetime.now(), session: Session = None):
+    def __init__(self, session: Session = None, price_cache: IgPriceCache.PriceCache = None, base_url: str = None, output: IgOutput.OutputBackend = None, derive: bool = True, session_offset: timedelta = timedelta(0), scheduler: IgRateLimiter.RequestScheduler = None, response_cache: IgResponseCache.ResponseCache = None, instrumentation: IgInstrumentation.Instrumentation = None, single_flight: IgSingleFlight.SingleFlight = None):
+        super().__init__(session, base_url, output, scheduler, response_cache, instrumentation, single_flight)
+        self.price_cache = price_cache
+        self.derive = derive
+        self.session_offset = session_offset
+
+    def get_historical_data_daterange(self, epic: str, resolution: str, start_date: datetime, end_date: datetime = datetime.now(), session: Session = None, output: IgOutput.OutputBackend = None):
+        output = output or self.output
+        if self.price_cache is None:
+            return self.fetch_historical_data_daterange(epic, resolution, start_date, end_date, session, output)
+        missing = self.price_cache.missing_intervals(epic, resolution, start_date, end_date)
+        if len(missing) > 0 and self.derive:
+            derived = IgResample.derive(self.price_cache, epic, resolution, start_date, end_date, self.session_offset)
+            if derived is not None:
+                return output.prices_from_arrays(*derived)
+        for gap_start, gap_end in missing:
+            times, values = self.fetch_historical_arrays(epic, resolution, gap_start, gap_end, session)
+            self.price_cache.store_arrays(epic, resolution, times, values, gap_start, gap_end)
+        return output.prices_from_arrays(*self.price_cache.load_arrays(epic, resolution, start_date, end_date))
+
+    # downloads many epics concurrently, returning a (prices, failures) tuple. prices is indexed by (epic, DateTime), and
+    # failures holds the error for each epic which could not be downloaded. requests are queued by the api handler's scheduler.
+    # the arrow and numpy outputs add an epic column instead of the index
+    def get_historical_data_many(self, epics: list, resolution: str, start_date: datetime, end_date: datetime = datetime.now(), max_workers: int = 8, output: IgOutput.OutputBackend = None):
+        output = output or self.output
+        epics = list(dict.fromkeys(epics))
+        sessions = threading.local()
+        def download(epic: str):
+            if not hasattr(sessions, 'session'):
+                sessions.session = self.worker_session()
+            return self.get_historical_data_daterange(epic, resolution, start_date, end_date, session = sessions.session, output = output)
+        prices = {}
+        failures = []
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            futures = {executor.submit(download, epic): epic for epic in epics}
+            for future in as_completed(futures):
+                try:
+                    prices[futures[future]] = future.result()
+                except Exception as e:
+                    failures.append({'epic': futures[future], 'error': str(e)})
+        prices = output.concat_prices({epic: prices[epic] for epic in epics if epic in prices})
+        return prices, pd.DataFrame(failures, columns = ['epic', 'error'])
+
+    def fetch_historical_data_daterange(self, epic: str, resolution: str, start_date: datetime, end_date: datetime, session: Session = None, output: IgOutput.OutputBackend = None):
+        return (output or self.output).prices_from_arrays(*self.fetch_historical_arrays(epic, resolution, start_date, end_date, session))
+
+    # the (times, values) arrays IgPriceDecoder.decode_prices makes of the prices, which the price cache stores as they are
+    def fetch_historical_arrays(self, epic: str, resolution: str, start_date: datetime, end_date: datetime, session: Session = None):
         version = '2'
-        endpoint = '/prices/{epic}/{resolution}/{start_date}/{end_date}'.format(epic = epic, resolution = resolution, start_date = start_date, end_date = end_date)
+        endpoint = '/prices/{epic}/{resolution}/{start_date}/{end_date}'.format(epic = epic, resolution = resolution, start_date = start_date.strftime(DATE_FORMAT), end_date = end_date.strftime(DATE_FORMAT))
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
-            return self.prices_as_dataframe(data['prices'])
+            if 'allowance' in data:
+                self.api_handler.scheduler.record_allowance(data['allowance'])
+            return self.api_handler.build(response, IgPriceDecoder.decode_prices, data['prices'])
         else:
             raise IGException(data)
     
-    def get_historical_data_numpoints(self, epic: str, resolution: str, numpoints: int, session: Session = None):
+    def get_historical_data_numpoints(self, epic: str, resolution: str, numpoints: int, session: Session = None, output: IgOutput.OutputBackend = None):
         version = '2'
         endpoint = '/prices/{epic}/{resolution}/{numpoints}'.format(epic = epic, resolution = resolution, numpoints = numpoints)
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
-            return self.prices_as_dataframe(data['prices'])
+            if 'allowance' in data:
+                self.api_handler.scheduler.record_allowance(data['allowance'])
+            times, values = self.api_handler.build(response, IgPriceDecoder.decode_prices, data['prices'])
+            if self.price_cache is not None and len(times) > 0:
+                # the points returned are consecutive bars, so everything between the first and last of them is held
+                self.price_cache.store_arrays(epic, resolution, times, values, pd.Timestamp(times[0]).to_pydatetime(), pd.Timestamp(times[-1]).to_pydatetime())
+            return (output or self.output).prices_from_arrays(times, values)
         else:
             raise IGException(data)
 
     def prices_as_dataframe(self, data: json):
-        df = pd.json_normalize(data)
-        df = df.set_index('snapshotTime')
-        df.index = pd.to_datetime(df.index)
-        df.index.name = "DateTime"
-        df.drop(columns = ['openPrice.lastTraded',
-                           'highPrice.lastTraded',
-                           'lowPrice.lastTraded',
-                           'closePrice.lastTraded'], inplace = True)
-        df.rename(columns = {'openPrice.ask': 'open_ask',
-                             'openPrice.bid': 'open_bid',
-                             'highPrice.ask': 'high_ask',
-                             'highPrice.bid': 'high_bid',
-                             'lowPrice.ask': 'low_ask',
-                             'lowPrice.bid': 'low_bid',
-                             'closePrice.ask': 'close_ask',
-                             'closePrice.bid': 'close_bid',
-                             'lastTradedVolume': 'volume'}, inplace = True)
-        return df
+        return self.output.prices(data)
     
     def market_navigation(self, session: Session = None):
         version = '1'
         endpoint = '/marketnavigation'
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
             if data['nodes'] is None:
                 data['nodes'] = pd.DataFrame(columns = ['id', 'name'])
             else:
-                data['nodes'] = pd.json_normalize(data['nodes'])
+                data['nodes'] = self.api_handler.build(response, pd.json_normalize, data['nodes'])
             if data['markets'] is None:
                 data['markets'] = pd.DataFrame(columns = [  "bid",
                                                             "delayTime",
@@ -118,8 +188,8 @@ class IGMarketData(IGREST):
                                                             "streamingPricesAvailable",
                                                             "updateTime"])
             else:
-                data['markets'] = pd.json_normalize(data['markets'])
-                return {'nodes': data['nodes'],
+                data['markets'] = self.api_handler.build(response, pd.json_normalize, data['markets'])
+            return {'nodes': data['nodes'],
                     'markets': data['markets']}
         else:
             raise IGException(data)
@@ -128,12 +198,12 @@ class IGMarketData(IGREST):
         version = '1'
         endpoint = '/marketnavigation/{nodeId}'.format(nodeId = nodeId)
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
             if data['nodes'] is None:
                 data['nodes'] = pd.DataFrame(columns = ['id', 'name'])
             else:
-                data['nodes'] = pd.json_normalize(data['nodes'])
+                data['nodes'] = self.api_handler.build(response, pd.json_normalize, data['nodes'])
             if data['markets'] is None:
                 data['markets'] = pd.DataFrame(columns = [  "bid",
                                                             "delayTime",
@@ -153,29 +223,51 @@ class IGMarketData(IGREST):
                                                             "streamingPricesAvailable",
                                                             "updateTime"])
             else:
-                data['markets'] = pd.json_normalize(data['markets'])
+                data['markets'] = self.api_handler.build(response, pd.json_normalize, data['markets'])
             return data
         else:
             raise IGException(data)
 
-    def market_details(self, epics: str, filter: str = 'ALL', session: Session = None):
+    # without cache the details are always fetched from IG, rather than from the api handler's response cache or single flight
+    def market_details(self, epics: str, filter: str = 'ALL', session: Session = None, cache: bool = True):
         version = '2'
         endpoint = '/markets'
         params = {'epics': epics,
                   'filter': filter}
-        response = self.api_handler.get(session = session, version = version, endpoint = endpoint, params = params)
+        response = self.api_handler.get(session = session, version = version, endpoint = endpoint, params = params, cache = cache)
         if response.status_code == 200:    
-            return json.loads(response.text)
+            return self.api_handler.decode(response)
         else:
             raise IGException(response.text)
 
-    def search_markets(self, searchTerm: str, session: Session = None):
+    # market details for any number of epics, fetched concurrently in requests of at most chunk_size epics (IG's limit is 50).
+    # repeated epics are fetched once, and the result has one row per epic, indexed by epic in the caller's order
+    def market_details_many(self, epics: list, filter: str = 'ALL', chunk_size: int = 50, max_workers: int = 4):
+        epics = list(dict.fromkeys(epics))
+        chunks = [epics[start:start + chunk_size] for start in range(0, len(epics), chunk_size)]
+        sessions = threading.local()
+        def download(chunk: list):
+            if not hasattr(sessions, 'session'):
+                sessions.session = self.worker_session()
+            details = self.market_details(','.join(chunk), filter, session = sessions.session)['marketDetails']
+            for epic, detail in zip(chunk, details):
+                detail.setdefault('instrument', {}).setdefault('epic', epic)
+            return details
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            details = [detail for chunk in executor.map(download, chunks) for detail in chunk]
+        if len(details) == 0:
+            return pd.DataFrame(index = pd.Index(epics, name = 'epic'))
+        details = pd.json_normalize(details)
+        details.index = pd.Index(details['instrument.epic'], name = 'epic')
+        return details.reindex(epics)
+
+    def search_markets(self, searchTerm: str, session: Session = None, output: IgOutput.OutputBackend = None):
         version = '1'
         endpoint = '/markets?searchTerm={searchTerm}'.format(searchTerm = searchTerm)
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
-            return pd.json_normalize(data['markets'])
+            return self.api_handler.build(response, (output or self.output).records, data['markets'])
         else:
             raise IGException(data)
 
@@ -183,18 +275,16 @@ class IGMarketData(IGREST):
 
 # class for interacting with the IG account, for reading transaction history, account balances, etc
 class IGAccountData(IGREST):
-    def list_accounts(self, session: Session = None):
+    def list_accounts(self, session: Session = None, output: IgOutput.OutputBackend = None):
         version = '1'
         endpoint = '/accounts'
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
-            accounts = pd.json_normalize(data['accounts'])
-            accounts.rename(columns={'balance.balance': 'balance',
-                                     'balance.deposit': 'deposit',
-                                     'balance.profitLoss': 'profitLoss',
-                                     'balance.available': 'availableBalance'}, inplace=True)
-            return accounts
+            return self.api_handler.build(response, (output or self.output).records, data['accounts'], rename = {'balance.balance': 'balance',
+                                                                                                                 'balance.deposit': 'deposit',
+                                                                                                                 'balance.profitLoss': 'profitLoss',
+                                                                                                                 'balance.available': 'availableBalance'})
         else:
             raise IGException(data)
     
@@ -202,7 +292,7 @@ class IGAccountData(IGREST):
         version = '1'
         endpoint = '/accounts/preferences'
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        preference = json.loads(response.text)
+        preference = self.api_handler.decode(response)
         if response.status_code == 200:
             return dict(preference)
         else:
@@ -213,13 +303,16 @@ class IGAccountData(IGREST):
         endpoint = '/accounts/preferences'
         params = {'trailingStopsEnabled': trailingStopsEnabled}
         response = self.api_handler.put(session = session, version = version, endpoint = endpoint, params = params)
-        data = dict(json.loads(response.text))
+        data = dict(self.api_handler.decode(response))
         if response.status_code == 200:
             return data
         else:
             raise IGException(data)
 
-    def account_history(self, maxSpanSeconds: int, pageSize: int, dateFrom: datetime, dateTo: datetime = datetime.now(), session: Session = None):
+    # with max_workers above 1, the pages after the first are downloaded concurrently once the number of pages is known.
+    # max_workers and page_retries come last, after the session and output existing callers may pass by position
+    def account_history(self, maxSpanSeconds: int, pageSize: int, dateFrom: datetime, dateTo: datetime = datetime.now(), session: Session = None, output: IgOutput.OutputBackend = None, max_workers: int = 1, page_retries: int = 2):
+        output = output or self.output
         version = '2'
         endpoint = '/history/activity'
         params = {'from': dateFrom,
@@ -227,11 +320,13 @@ class IGAccountData(IGREST):
                   'maxSpanSeconds': maxSpanSeconds,
                   'pageSize': pageSize,
                   'pageNumber': 1}
+        if max_workers > 1:
+            return output.records(self.history_pages_concurrently(endpoint, 'activities', params, max_workers, page_retries, session), normalize = False)
         has_more = True
         history = []
         while has_more:
             response = self.api_handler.get(session = session, endpoint = endpoint, version = version, params = params)
-            data = json.loads(response.text)
+            data = self.api_handler.decode(response)
             if response.status_code == 200:
                 history.extend(data['activities'])
                 if data['metadata']['pageData']['totalPages'] == 0 or data['metadata']['pageData']['pageNumber'] == data['metadata']['pageData']['totalPages']:
@@ -240,11 +335,12 @@ class IGAccountData(IGREST):
                     params['pageNumber'] += 1
             else:
                 raise IGException(data)
-        history = pd.DataFrame(history)
+        history = self.api_handler.build(response, output.records, history, normalize = False)
         return history
         
     
-    def transaction_history(self, maxSpanSeconds: int, pageSize: int, dateFrom: datetime, dateTo: datetime = datetime.now(), transactionType: str = 'ALL', session: Session = None):
+    def transaction_history(self, maxSpanSeconds: int, pageSize: int, dateFrom: datetime, dateTo: datetime = datetime.now(), transactionType: str = 'ALL', session: Session = None, output: IgOutput.OutputBackend = None, max_workers: int = 1, page_retries: int = 2):
+        output = output or self.output
         version = '2'
         endpoint = '/history/transactions'
         params = {'transactionType': transactionType,
@@ -253,11 +349,13 @@ class IGAccountData(IGREST):
                   'maxSpanSeconds': maxSpanSeconds,
                   'pageSize': pageSize,
                   'pageNumber': 1}
+        if max_workers > 1:
+            return output.records(self.history_pages_concurrently(endpoint, 'transactions', params, max_workers, page_retries, session), normalize = False)
         has_more = True
         history = []
         while has_more:
             response = self.api_handler.get(session = session, endpoint = endpoint, version = version, params = params)
-            data = json.loads(response.text)
+            data = self.api_handler.decode(response)
             if response.status_code == 200:
                 history.extend(data['transactions'])
                 if data['metadata']['pageData']['totalPages'] == 0 or data['metadata']['pageData']['pageNumber'] == data['metadata']['pageData']['totalPages']:
@@ -266,15 +364,108 @@ class IGAccountData(IGREST):
                     params['pageNumber'] += 1
             else:
                 raise IGException(data)
-        return pd.DataFrame(history)
+        return self.api_handler.build(response, output.records, history, normalize = False)
+
+    # downloads the first page to learn the number of pages, then the remaining pages over a pool of worker threads.
+    # each page is retried on its own up to page_retries times, and the records are returned in page order
+    def history_pages_concurrently(self, endpoint: str, key: str, params: dict, max_workers: int, page_retries: int, session: Session = None):
+        version = '2'
+        sessions = threading.local()
+        def download(pageNumber: int, session: Session):
+            page_params = dict(params, pageNumber = pageNumber)
+            for attempt in range(page_retries + 1):
+                try:
+                    response = self.api_handler.get(session = session, endpoint = endpoint, version = version, params = page_params)
+                    data = self.api_handler.decode(response)
+                    if response.status_code == 200:
+                        return data
+                    error = IGException(data)
+                except (RequestException, ValueError) as e:
+                    error = e
+                if attempt < page_retries:
+                    time.sleep(0.5 * 2 ** attempt)
+            raise error
+        def download_page(pageNumber: int):
+            if not hasattr(sessions, 'session'):
+                sessions.session = self.worker_session()
+            return download(pageNumber, sessions.session)[key]
+        first = download(1, session)
+        history = list(first[key])
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            for page in executor.map(download_page, range(2, first['metadata']['pageData']['totalPages'] + 1)):
+                history.extend(page)
+        return history
+
+    # yields the account history one dataframe per page, downloading the next pages in the background while the current one
+    # is processed. at most pages_in_flight downloaded pages are held waiting to be consumed. the pages are downloaded on a
+    # session of the background thread's own, as a requests Session is not safe to share between threads
+    def iter_account_history(self, maxSpanSeconds: int, pageSize: int, dateFrom: datetime, dateTo: datetime = datetime.now(), pages_in_flight: int = 2, output: IgOutput.OutputBackend = None):
+        params = {'from': dateFrom,
+                  'to': dateTo,
+                  'maxSpanSeconds': maxSpanSeconds,
+                  'pageSize': pageSize,
+                  'pageNumber': 1}
+        return self.iter_history_pages('/history/activity', 'activities', params, pages_in_flight, output)
 
-    def list_watchlists(self, session: Session = None):
+    def iter_transaction_history(self, maxSpanSeconds: int, pageSize: int, dateFrom: datetime, dateTo: datetime = datetime.now(), transactionType: str = 'ALL', pages_in_flight: int = 2, output: IgOutput.OutputBackend = None):
+        params = {'transactionType': transactionType,
+                  'from': dateFrom,
+                  'to': dateTo,
+                  'maxSpanSeconds': maxSpanSeconds,
+                  'pageSize': pageSize,
+                  'pageNumber': 1}
+        return self.iter_history_pages('/history/transactions', 'transactions', params, pages_in_flight, output)
+
+    def iter_history_pages(self, endpoint: str, key: str, params: dict, pages_in_flight: int, output: IgOutput.OutputBackend = None):
+        output = output or self.output
+        version = '2'
+        pages = queue.Queue(maxsize = pages_in_flight)
+        stop = threading.Event()
+        def put(page):
+            while not stop.is_set():
+                try:
+                    pages.put(page, timeout = 0.1)
+                    return
+                except queue.Full:
+                    pass
+        def download():
+            page_params = dict(params)
+            session = self.worker_session()
+            try:
+                while not stop.is_set():
+                    response = self.api_handler.get(session = session, endpoint = endpoint, version = version, params = page_params)
+                    data = self.api_handler.decode(response)
+                    if response.status_code != 200:
+                        raise IGException(data)
+                    put(self.api_handler.build(response, output.records, data[key], normalize = False))
+                    if data['metadata']['pageData']['totalPages'] == 0 or data['metadata']['pageData']['pageNumber'] == data['metadata']['pageData']['totalPages']:
+                        break
+                    page_params['pageNumber'] += 1
+            except Exception as e:
+                put(e)
+            finally:
+                session.close()
+            put(None)
+        downloader = threading.Thread(target = download, daemon = True)
+        downloader.start()
+        try:
+            while True:
+                page = pages.get()
+                if page is None:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            stop.set()
+
+    def list_watchlists(self, session: Session = None, output: IgOutput.OutputBackend = None):
         version = '1'
         endpoint = '/watchlists'
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response)['watchlists']
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
-            return pd.json_normalize(data)
+            return self.api_handler.build(response, (output or self.output).records, data['watchlists'])
         else:
             raise IGException(data)
     
@@ -284,7 +475,7 @@ class IGAccountData(IGREST):
         params = {'name': name,
                   'epics': epics}
         response = self.api_handler.post(session = session, version = version, endpoint = endpoint, params = params)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
             return data
         else:
@@ -295,7 +486,7 @@ class IGAccountData(IGREST):
         endpoint = '/watchlists/{watchlistId}'.format(watchlistId = watchlistId)
         params = {'epic': epic}
         response = self.api_handler.put(session = session, version = version, endpoint = endpoint, params = params)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
             return data['status']
         else:
@@ -305,19 +496,19 @@ class IGAccountData(IGREST):
         version = '1'
         endpoint = '/watchlists/{watchlistId}/{epic}'.format(watchlistId = watchlistId, epic = epic)
         response = self.api_handler.delete(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
             return data['status']
         else:
             raise IGException(data)
 
-    def get_watchlist(self, watchlistId: str, session: Session = None):
+    def get_watchlist(self, watchlistId: str, session: Session = None, output: IgOutput.OutputBackend = None):
         version = '1'
         endpoint = '/watchlists/{watchlistId}'.format(watchlistId = watchlistId)
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
-            return pd.json_normalize(data['markets'])
+            return self.api_handler.build(response, (output or self.output).records, data['markets'])
         else:
             raise IGException(data)
         
@@ -325,7 +516,7 @@ class IGAccountData(IGREST):
         version = '1'
         endpoint = '/watchlists/{watchlistId}'.format(watchlistId = watchlistId)
         response = self.api_handler.delete(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
             return data['status']
         else:
@@ -333,8 +524,18 @@ class IGAccountData(IGREST):
 
 
 
+# the fields read from each order given to IGDealer.submit_orders. orders carrying a dealId close that position, the rest open new ones
+OPEN_ORDER_FIELDS = ['currencyCode', 'dealReference', 'direction', 'epic', 'expiry', 'forceOpen', 'guaranteedStop', 'level', 'limitDistance', 'limitLevel', 'orderType', 'quoteId', 'size', 'stopDistance', 'stopLevel', 'timeInForce', 'trailingStop', 'trailingStopIncrement']
+CLOSE_ORDER_FIELDS = ['dealId', 'direction', 'level', 'orderType', 'quoteId', 'size', 'timeInForce']
+ORDER_RESULT_COLUMNS = ['dealId', 'epic', 'direction', 'size', 'dealReference', 'dealStatus', 'reason', 'level', 'confirm_attempts', 'error']
+
 # class for placing orders and opening positions on the IG markets, as well as altering, deleting and closing them
 class IGDealer(IGAccountData):
+    def __init__(self, session: Session = None, base_url: str = None, output: IgOutput.OutputBackend = None, scheduler: IgRateLimiter.RequestScheduler = None, response_cache: IgResponseCache.ResponseCache = None, instrumentation: IgInstrumentation.Instrumentation = None, single_flight: IgSingleFlight.SingleFlight = None):
+        super().__init__(session, base_url, output, scheduler, response_cache, instrumentation, single_flight)
+        self.deal_listeners = []
+        self.listener_failures = 0
+
     def open_position(self, currencyCode: str, direction: str, epic: str, level: Decimal, orderType: str, size: Decimal, expiry: str = None, forceOpen: bool = False, guaranteedStop: bool = False, limitDistance: Decimal = None, limitLevel: Decimal = None, quoteId: str = None, stopDistance: Decimal = None, stopLevel: Decimal = None, timeInForce: str = None, trailingStop: Decimal = None, trailingStopIncrement: int = None, dealReference: str = datetime.now().strftime(format = '%Y/%m/%d %H:%M:%S'), session: Session = None):
         version = '2'
         endpoint = '/positions/otc'
@@ -357,9 +558,9 @@ class IGDealer(IGAccountData):
                   'trailingStop': trailingStop,
                   'trailingStopIncrement': trailingStopIncrement}
         response = self.api_handler.post(session = session, version = version, endpoint = endpoint, params = params)
-        deal = json.loads(response.text)
+        deal = self.api_handler.decode(response)
         if response.status_code == 200:
-            return self.get_deal_confirmation(dealId = deal['dealReference'])
+            return self.notify_deal_listeners('position', self.get_deal_confirmation(dealId = deal['dealReference']))
         else:
             raise IGException(deal)
     
@@ -376,9 +577,9 @@ class IGDealer(IGAccountData):
                   'size': size,
                   'timeInForce': timeInForce}
         response = self.api_handler.delete(session = session, version = version, endpoint = endpoint, params = params)
-        deal = json.loads(response.text)
+        deal = self.api_handler.decode(response)
         if response.status_code == 200:
-            return self.get_deal_confirmation(dealId = deal['dealReference'])
+            return self.notify_deal_listeners('position', self.get_deal_confirmation(dealId = deal['dealReference']))
         else:
             raise IGException(deal)
     
@@ -392,32 +593,34 @@ class IGDealer(IGAccountData):
                   'trailingStopDistance': trailingStopDistance,
                   'trailingStopIncrement': trailingStopIncrement}
         response = self.api_handler.put(session = session, version = version, endpoint = endpoint, params = params)
-        deal = json.loads(response.text)
+        deal = self.api_handler.decode(response)
         if response.status_code == 200:
-            return self.get_deal_confirmation(dealId = deal['dealReference'])
+            return self.notify_deal_listeners('position', self.get_deal_confirmation(dealId = deal['dealReference']))
         else:
             raise IGException(deal)
     
-    def list_positions(self, session: Session = None):
+    def list_positions(self, session: Session = None, output: IgOutput.OutputBackend = None):
+        output = output or self.output
         version = '2'
         endpoint = '/positions'
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
-            markets = pd.json_normalize(data['positions']['market'])
-            positions = pd.json_normalize(data['positions']['position'])
+            markets = self.api_handler.build(response, output.records, [position['market'] for position in data['positions']])
+            positions = self.api_handler.build(response, output.records, [position['position'] for position in data['positions']])
             return (markets, positions)
         else:
             raise IGException(data)
     
-    def list_working_orders(self, session: Session = None):
+    def list_working_orders(self, session: Session = None, output: IgOutput.OutputBackend = None):
+        output = output or self.output
         version = '2'
         endpoint = '/workingorders'
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
-            marketData = pd.json_normalize(data['workingOrders']['marketData'])
-            workingOrderData = pd.json_normalize(data['workingOrders']['workingOrderData'])
+            marketData = self.api_handler.build(response, output.records, [order['marketData'] for order in data['workingOrders']])
+            workingOrderData = self.api_handler.build(response, output.records, [order['workingOrderData'] for order in data['workingOrders']])
             return (marketData, workingOrderData)
         else:
             raise IGException(data)
@@ -442,9 +645,9 @@ class IGDealer(IGAccountData):
                   'stopLevel': stopLevel,
                   'timeInForce': timeInForce}
         response = self.api_handler.post(session = session, version = version, endpoint = endpoint, params = params)
-        deal = json.loads(response.text)
+        deal = self.api_handler.decode(response)
         if response.status_code == 200:
-            return self.get_deal_confirmation(dealId = deal['dealReference'])
+            return self.notify_deal_listeners('workingorder', self.get_deal_confirmation(dealId = deal['dealReference']))
         else:
             raise IGException(deal)
     
@@ -452,9 +655,9 @@ class IGDealer(IGAccountData):
         version = '2'
         endpoint = '/workingorders/otc/{dealId}'.format(dealId = dealId)
         response = self.api_handler.delete(session = session, version = version, endpoint = endpoint)
-        deal = json.loads(response.text)
+        deal = self.api_handler.decode(response)
         if response.status_code == 200:
-            return self.get_deal_confirmation(dealId = deal['dealReference'])
+            return self.notify_deal_listeners('workingorder', self.get_deal_confirmation(dealId = deal['dealReference']))
         else:
             raise IGException(deal)
 
@@ -471,9 +674,9 @@ class IGDealer(IGAccountData):
                   'stopLevel': stopLevel,
                   'timeInForce': timeInForce}
         response = self.api_handler.post(session = session, version = version, endpoint = endpoint, params = params)
-        deal = json.loads(response.text)
+        deal = self.api_handler.decode(response)
         if response.status_code == 200:
-            return self.get_deal_confirmation(dealId = deal['dealReference'])
+            return self.notify_deal_listeners('workingorder', self.get_deal_confirmation(dealId = deal['dealReference']))
         else:
             raise IGException(deal)
     
@@ -486,28 +689,107 @@ class IGDealer(IGAccountData):
                   'expiryPeriod': expiryPeriod,
                   'size': size}
         response = self.api_handler.post(session = session, version = version, endpoint = endpoint, params = params)
-        deal = json.loads(response.text)
+        deal = self.api_handler.decode(response)
         if response.status_code == 200:
-            return self.get_deal_confirmation(dealId = deal['dealReference'])
+            return self.notify_deal_listeners('sprint', self.get_deal_confirmation(dealId = deal['dealReference']))
         else:
             raise IGException(deal)
     
-    def list_sprint_market_positions(self, session: Session = None):
+    def list_sprint_market_positions(self, session: Session = None, output: IgOutput.OutputBackend = None):
         version = '2'
         endpoint = '/positions/sprintmarkets'
         response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
-            return pd.json_normalize(data['sprintMarketPositions'])
+            return self.api_handler.build(response, (output or self.output).records, data['sprintMarketPositions'])
         else:
             raise IGException(data)
 
-    def get_deal_confirmation(self, dealId: str, session: Session = None):
+    def get_deal_confirmation(self, dealId: str, session: Session = None, headers: dict = None):
         version = '2'
         endpoint = '/confirms/{dealId}'.format(dealId = dealId)
-        response = self.api_handler.get(session = session, version = version, endpoint = endpoint)
-        data = json.loads(response.text)
+        response = self.api_handler.get(session = session, version = version, endpoint = endpoint, headers = headers)
+        data = self.api_handler.decode(response)
         if response.status_code == 200:
-            return pd.json_normalize(data)
+            return self.api_handler.build(response, pd.json_normalize, data)
         else:
             raise IGException(data)
+
+    # passes a deal confirmation to every listener added to deal_listeners, as listener(kind, confirmation) where kind is
+    # 'position', 'workingorder' or 'sprint'. a failing listener is logged and counted in listener_failures, and does not stop
+    # the deal from returning
+    def notify_deal_listeners(self, kind: str, confirmation: pd.DataFrame):
+        for listener in list(self.deal_listeners):
+            try:
+                listener(kind, confirmation)
+            except Exception:
+                self.listener_failures += 1
+                logger.exception('deal listener failed')
+        return confirmation
+
+    # the confirmation of a deal IG has acknowledged, asked for again while IG does not know the deal yet or the request fails.
+    # returns the confirmation and the number of attempts it took. headers go with each request, as with ApiHandler.get
+    def confirm_deal(self, dealReference: str, attempts: int = 10, interval: float = 0.1, kind: str = 'position', session: Session = None, headers: dict = None):
+        for attempt in range(1, attempts + 1):
+            try:
+                return (self.notify_deal_listeners(kind, self.get_deal_confirmation(dealReference, session = session, headers = headers)), attempt)
+            except (IGException, RequestException) as e:
+                if (isinstance(e, IGException) and 'deal-not-found' not in str(e)) or attempt == attempts:
+                    raise
+                time.sleep(interval)
+
+    # sends a batch of orders over a pool of worker threads, queued within the trading allowance by the api handler, and confirms
+    # each deal as soon as it is acknowledged. orders are dicts or the rows of a dataframe holding the arguments of open_position,
+    # or of close_position for rows with a dealId. returns one row per order, in order, with IG's dealStatus and reason, or the
+    # error that stopped the order from being sent or confirmed
+    def submit_orders(self, orders, max_workers: int = 8, confirm_attempts: int = 10, confirm_interval: float = 0.1):
+        if isinstance(orders, pd.DataFrame):
+            orders = orders.astype(object).where(orders.notna(), None).to_dict('records')
+        sessions = threading.local()
+        def submit(order: dict):
+            if not hasattr(sessions, 'session'):
+                sessions.session = self.worker_session()
+            result = {'dealId': order.get('dealId'), 'epic': order.get('epic'), 'direction': order.get('direction'), 'size': order.get('size'), 'confirm_attempts': 0}
+            try:
+                if order.get('dealId') is not None:
+                    params = {field: order.get(field) for field in CLOSE_ORDER_FIELDS}
+                    response = self.api_handler.delete(session = sessions.session, version = '1', endpoint = '/positions/otc', params = params)
+                else:
+                    params = {field: order.get(field) for field in OPEN_ORDER_FIELDS}
+                    params['dealReference'] = params['dealReference'] or uuid.uuid4().hex[:30]
+                    response = self.api_handler.post(session = sessions.session, version = '2', endpoint = '/positions/otc', params = params)
+                deal = self.api_handler.decode(response)
+                if response.status_code != 200:
+                    raise IGException(deal)
+                result['dealReference'] = deal['dealReference']
+                confirmation, result['confirm_attempts'] = self.confirm_deal(deal['dealReference'], confirm_attempts, confirm_interval, session = sessions.session)
+                confirmation = confirmation.iloc[0]
+                result['dealId'] = confirmation.get('dealId') or result['dealId']
+                result['dealStatus'] = confirmation.get('dealStatus')
+                result['reason'] = confirmation.get('reason')
+                result['level'] = confirmation.get('level')
+            # any failure stays with its own order, so that it neither loses the results of the others nor hides which order failed
+            except Exception as e:
+                result['error'] = '{kind}: {error}'.format(kind = type(e).__name__, error = e)
+            return result
+        if len(orders) == 0:
+            return pd.DataFrame(columns = ORDER_RESULT_COLUMNS)
+        with ThreadPoolExecutor(max_workers = min(max_workers, len(orders))) as executor:
+            results = list(executor.map(submit, orders))
+        return pd.DataFrame(results, columns = ORDER_RESULT_COLUMNS)
+
+    # closes every open position, or the positions given as the (markets, positions) pair list_positions returns with any output
+    # backend, with an opposing order for the full size of each deal. returns the submit_orders result frame
+    def close_all_positions(self, positions: tuple = None, orderType: str = 'MARKET', timeInForce: str = None, max_workers: int = 8, confirm_attempts: int = 10, confirm_interval: float = 0.1, session: Session = None):
+        if positions is None:
+            positions = self.list_positions(session = session, output = IgOutput.PANDAS)
+        markets, positions = IgOutput.to_pandas(positions[0]), IgOutput.to_pandas(positions[1])
+        if len(positions) == 0:
+            return self.submit_orders([])
+        orders = pd.DataFrame({'dealId': positions['dealId'].values,
+                               'epic': markets['epic'].values,
+                               'direction': positions['direction'].map({'BUY': 'SELL', 'SELL': 'BUY'}).values,
+                               'size': positions['size'].values,
+                               'orderType': orderType,
+                               'timeInForce': timeInForce})
+        return self.submit_orders(orders, max_workers, confirm_attempts, confirm_interval)
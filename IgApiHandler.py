@@ -1,11 +1,33 @@
 import json
+import time
+from datetime import datetime
+import IgRateLimiter
+import IgResponseCache
+import IgInstrumentation
+import IgSingleFlight
 from requests import Session
 
+# IG error codes returned when a request has been throttled, and can be sent again once the allowance has refilled
+THROTTLED_ERRORS = ['error.public-api.exceeded-api-key-allowance',
+                    'error.public-api.exceeded-account-allowance',
+                    'error.public-api.exceeded-account-trading-allowance']
+
 class ApiHandler:
-    def __init__(self, session: Session, api_key: str, environment: str):
+    def __init__(self, session: Session, api_key: str, environment: str, scheduler: IgRateLimiter.RequestScheduler = None, max_retries: int = 3, response_cache: IgResponseCache.ResponseCache = None, base_url: str = None, instrumentation: IgInstrumentation.Instrumentation = None, single_flight: IgSingleFlight.SingleFlight = None):
         self.session = session
+        self.response_cache = response_cache
+        self.single_flight = single_flight
+        self.instrumentation = instrumentation
+        self.session_manager = None
+        if scheduler is None:
+            self.scheduler = IgRateLimiter.RequestScheduler()
+        else:
+            self.scheduler = scheduler
+        self.max_retries = max_retries
         self.API_KEY = api_key
-        if str.lower(environment) == 'live':
+        if base_url is not None:
+            self.base_url = base_url
+        elif str.lower(environment) == 'live':
             self.base_url = 'https://api.ig.com/gateway/deal'
         else:
             self.base_url = 'https://demo-api.ig.com/gateway/deal'
@@ -27,29 +49,153 @@ class ApiHandler:
             session = session
         return session
 
+    # the VERSION header is sent with each request rather than set on the session, so threads can share a session
     def prepare_call(self, endpoint: str, session: Session, version: str):
         url = self.make_url(endpoint)
         session = self.ensure_session(session)
-        session.headers.update({'VERSION': version})
         return url, session
     
 
-    def post(self, session: Session, endpoint: str, version: str, params: dict = None):
-        url, session = self.prepare_session(endpoint, session, version)
-        response = session.post(url, params = json.dumps(params))
-        return response
+    # the allowance a request counts against, and the priority it is queued with
+    def classify(self, method: str, endpoint: str):
+        if endpoint.startswith(('/positions', '/workingorders')) and method != 'GET':
+            return 'trading', IgRateLimiter.DEALING
+        if endpoint.startswith(('/confirms', '/session')):
+            return 'non_trading', IgRateLimiter.DEALING
+        if endpoint.startswith('/prices'):
+            return 'historical', IgRateLimiter.DATA
+        if endpoint.startswith(('/accounts', '/positions', '/workingorders')):
+            return 'non_trading', IgRateLimiter.ACCOUNT
+        return 'non_trading', IgRateLimiter.DATA
 
-    def get(self, session: Session, endpoint: str, version: str, params: dict = None):
-        url, session = self.prepare_session(endpoint, session, version)
-        response = session.get(url, params = json.dumps(params))
-        return response
+    # identical GETs made while one is in flight wait for its response when a single flight is given. headers are sent with
+    # this request only, over the session's own, and the session manager's tokens go over both. a GET without cache is
+    # always sent, neither answered from the response cache nor joined to one in flight, for callers which need live data
+    def send(self, method: str, request, url: str, endpoint: str, version: str, params: dict, priority: int, headers: dict = None, cache: bool = True):
+        if method == 'GET' and cache and self.single_flight is not None:
+            return self.single_flight.do(self.single_flight.key(url, version, params), lambda: self.dispatch(method, request, url, endpoint, version, params, priority, headers))
+        return self.dispatch(method, request, url, endpoint, version, params, priority, headers, cache)
 
-    def put(self, session: Session, endpoint: str, version: str, params: dict = None):
-        url, session = self.prepare_session(endpoint, session, version)
-        response = session.put(url, params = json.dumps(params))
+    def dispatch(self, method: str, request, url: str, endpoint: str, version: str, params: dict, priority: int, headers: dict = None, cache: bool = True):
+        if method == 'GET' and cache and self.response_cache is not None:
+            response = self.response_cache.get(endpoint, version, params)
+            if response is not None:
+                return response
+        budget, default_priority = self.classify(method, endpoint)
+        if priority is None:
+            priority = default_priority
+        manager = self.manager_for(method, endpoint)
+        reauthenticated = False
+        queue = 0
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            self.scheduler.acquire(budget, priority)
+            sent = time.perf_counter()
+            queue += sent - queued
+            generation, tokens = manager.credentials if manager is not None else (None, {})
+            response = self.request(method, request, url, version, params, dict(headers or {}, **tokens))
+            if response.status_code == 403 and any(error in response.text for error in THROTTLED_ERRORS):
+                self.scheduler.record_throttled(budget)
+                if attempt < self.max_retries:
+                    attempt += 1
+                    continue
+            # expired tokens are renewed once for every caller that saw them fail, and only GETs are sent again
+            if response.status_code == 401 and manager is not None and not reauthenticated:
+                reauthenticated = True
+                if manager.reauthenticate(response, generation) and method == 'GET':
+                    continue
+            break
+        response.endpoint = endpoint
+        response.version = version
+        if self.instrumentation is not None:
+            # requests times a response up to its headers, the rest of the call went on reading the body
+            total = time.perf_counter() - sent
+            send = min(response.elapsed.total_seconds(), total)
+            body = response.request.body if response.request is not None else None
+            self.record_request(method, endpoint, version, budget, response.status_code, queue, send, total - send, len(body or ''), len(response.content), attempt)
+        if self.response_cache is not None:
+            if method != 'GET':
+                self.response_cache.invalidate(endpoint)
+            elif response.status_code == 200 and cache:
+                self.response_cache.put(endpoint, version, params, response)
         return response
+
+    # the session manager's tokens go with every request except the logins and token refreshes it makes itself
+    def manager_for(self, method: str, endpoint: str):
+        if self.session_manager is None or (method == 'POST' and endpoint.startswith('/session')):
+            return None
+        return self.session_manager
+
+    # GET parameters go in the query string, other methods send them as a JSON body. IG takes deletes with a body
+    # as a POST carrying the _method header. headers, when given, go over the session's own for this request only
+    def request(self, method: str, request, url: str, version: str, params: dict, headers: dict = None):
+        headers = dict(headers or {}, VERSION = version)
+        if method == 'GET':
+            return request(url, params = self.query(params), headers = headers)
+        if method == 'DELETE':
+            headers['_method'] = 'DELETE'
+        return request(url, data = json.dumps(params, default = str), headers = headers)
+
+    def record_request(self, method: str, endpoint: str, version: str, budget: str, status: int, queue: float, send: float, read: float, request_bytes: int, response_bytes: int, retries: int):
+        bucket = 'non_trading' if budget == 'historical' else budget
+        headroom = {bucket: round(self.scheduler.buckets[bucket].tokens, 2)}
+        if budget == 'historical' and self.scheduler.historical_allowance is not None:
+            headroom['historical'] = self.scheduler.historical_allowance.get('remainingAllowance')
+        self.instrumentation.record_request(method, endpoint, version, status, queue, send, read, request_bytes, response_bytes, retries, headroom)
+
+    # the JSON body of a response, timed as the decode phase of its endpoint when instrumentation is on. a response shared
+    # by coalesced callers is parsed once for all of them
+    def decode(self, response):
+        shared = getattr(response, 'shared', None)
+        if shared is not None:
+            return shared.decode(lambda: self.parse(response))
+        return self.parse(response)
+
+    def parse(self, response):
+        if self.instrumentation is None:
+            return json.loads(response.text)
+        start = time.perf_counter()
+        data = json.loads(response.text)
+        self.instrumentation.record_phase(getattr(response, 'endpoint', ''), getattr(response, 'version', ''), 'decode', time.perf_counter() - start)
+        return data
+
+    # calls function to turn the decoded body of a response into a DataFrame, timed as the build phase of its endpoint.
+    # the tables of a response shared by coalesced callers are built once, and each caller gets a shallow copy
+    def build(self, response, function, *args, **kwargs):
+        shared = getattr(response, 'shared', None)
+        if shared is not None:
+            return shared.build(function, lambda: self.make(response, function, *args, **kwargs))
+        return self.make(response, function, *args, **kwargs)
+
+    def make(self, response, function, *args, **kwargs):
+        if self.instrumentation is None:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        frame = function(*args, **kwargs)
+        self.instrumentation.record_phase(getattr(response, 'endpoint', ''), getattr(response, 'version', ''), 'build', time.perf_counter() - start)
+        return frame
+
+    def query(self, params: dict):
+        if params is None:
+            return None
+        return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in params.items() if value is not None}
+
+    def budget_usage(self):
+        return self.scheduler.usage()
+
+    def post(self, session: Session, endpoint: str, version: str, params: dict = None, priority: int = None, headers: dict = None):
+        url, session = self.prepare_call(endpoint, session, version)
+        return self.send('POST', session.post, url, endpoint, version, params, priority, headers)
+
+    def get(self, session: Session, endpoint: str, version: str, params: dict = None, priority: int = None, headers: dict = None, cache: bool = True):
+        url, session = self.prepare_call(endpoint, session, version)
+        return self.send('GET', session.get, url, endpoint, version, params, priority, headers, cache)
+
+    def put(self, session: Session, endpoint: str, version: str, params: dict = None, priority: int = None, headers: dict = None):
+        url, session = self.prepare_call(endpoint, session, version)
+        return self.send('PUT', session.put, url, endpoint, version, params, priority, headers)
     
-    def delete(self, session: Session, endpoint: str, version: str, params: dict = None):
-        url, session = self.prepare_session(endpoint, session, version)
-        response = session.post(url, params = json.dumps(params))
-        return response
+    def delete(self, session: Session, endpoint: str, version: str, params: dict = None, priority: int = None, headers: dict = None):
+        url, session = self.prepare_call(endpoint, session, version)
+        return self.send('DELETE', session.post, url, endpoint, version, params, priority, headers)
@@ -0,0 +1,137 @@
+import json
+import time
+import asyncio
+import aiohttp
+import IgRateLimiter
+import IgResponseCache
+import IgInstrumentation
+import IgSingleFlight
+from IgApiHandler import ApiHandler, THROTTLED_ERRORS
+
+# a response read in full, carrying the status_code, text and headers attributes the platform reads from requests responses
+class ApiResponse:
+    def __init__(self, status_code: int, text: str, headers: dict):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+
+
+
+# asyncio twin of ApiHandler. requests are multiplexed over one pooled aiohttp client with keep-alive connections,
+# and headers are sent per request, so any number of calls can be in flight on one event loop.
+# the scheduler, response cache and request classification are shared with the blocking handler
+class AsyncApiHandler(ApiHandler):
+    def __init__(self, api_key: str, environment: str, scheduler: IgRateLimiter.RequestScheduler = None, max_retries: int = 3, response_cache: IgResponseCache.ResponseCache = None, base_url: str = None, connection_limit: int = 100, instrumentation: IgInstrumentation.Instrumentation = None, single_flight: IgSingleFlight.SingleFlight = None):
+        self.session = None
+        self.single_flight = single_flight
+        self.instrumentation = instrumentation
+        self.session_manager = None
+        self.connection_limit = connection_limit
+        self.response_cache = response_cache
+        if scheduler is None:
+            self.scheduler = IgRateLimiter.RequestScheduler()
+        else:
+            self.scheduler = scheduler
+        self.max_retries = max_retries
+        self.API_KEY = api_key
+        if base_url is not None:
+            self.base_url = base_url
+        elif str.lower(environment) == 'live':
+            self.base_url = 'https://api.ig.com/gateway/deal'
+        else:
+            self.base_url = 'https://demo-api.ig.com/gateway/deal'
+        self.headers = {
+            "X-IG-API-KEY": self.API_KEY,
+            'Content-Type': 'application/json',
+            'Accept': 'application/json; charset=UTF-8'
+        }
+
+    async def open(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit = self.connection_limit, keepalive_timeout = 60)
+            self.session = aiohttp.ClientSession(connector = connector)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # aiohttp only takes strings and numbers as query values
+    def query(self, params: dict):
+        params = super().query(params)
+        if params is None:
+            return None
+        return {key: str(value).lower() if isinstance(value, bool) else value for key, value in params.items()}
+
+    async def send(self, method: str, endpoint: str, version: str, params: dict, priority: int):
+        if method == 'GET' and self.single_flight is not None:
+            return await self.single_flight.do_async(self.single_flight.key(self.make_url(endpoint), version, params), lambda: self.dispatch(method, endpoint, version, params, priority))
+        return await self.dispatch(method, endpoint, version, params, priority)
+
+    async def dispatch(self, method: str, endpoint: str, version: str, params: dict, priority: int):
+        if method == 'GET' and self.response_cache is not None:
+            response = self.response_cache.get(endpoint, version, params)
+            if response is not None:
+                return response
+        budget, default_priority = self.classify(method, endpoint)
+        if priority is None:
+            priority = default_priority
+        session = await self.open()
+        manager = self.manager_for(method, endpoint)
+        reauthenticated = False
+        headers = dict(self.headers, VERSION = version)
+        if method == 'GET':
+            arguments = {'params': self.query(params)}
+        else:
+            arguments = {'data': json.dumps(params, default = str)}
+        if method == 'DELETE':
+            method = 'POST'
+            headers['_method'] = 'DELETE'
+        queue = 0
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            await self.scheduler.acquire_async(budget, priority)
+            sent = time.perf_counter()
+            queue += sent - queued
+            if manager is not None:
+                generation, credentials = manager.credentials
+                headers.update(credentials)
+            async with session.request(method, self.make_url(endpoint), headers = headers, **arguments) as raw:
+                received = time.perf_counter()
+                response = ApiResponse(raw.status, await raw.text(), raw.headers)
+                response_bytes = raw.content_length or len(response.text)
+            if response.status_code == 403 and any(error in response.text for error in THROTTLED_ERRORS):
+                self.scheduler.record_throttled(budget)
+                if attempt < self.max_retries:
+                    attempt += 1
+                    continue
+            # the manager logs in with blocking requests, so the renewal runs off the event loop
+            if response.status_code == 401 and manager is not None and not reauthenticated:
+                reauthenticated = True
+                if await asyncio.to_thread(manager.reauthenticate, response, generation) and method == 'GET':
+                    continue
+            break
+        response.endpoint = endpoint
+        response.version = version
+        if self.instrumentation is not None:
+            self.record_request(method, endpoint, version, budget, response.status_code, queue, received - sent, time.perf_counter() - received, len(arguments.get('data') or ''), response_bytes, attempt)
+        if self.response_cache is not None:
+            if method != 'GET':
+                self.response_cache.invalidate(endpoint)
+            elif response.status_code == 200:
+                self.response_cache.put(endpoint, version, params, response)
+        return response
+
+    async def post(self, endpoint: str, version: str, params: dict = None, priority: int = None):
+        return await self.send('POST', endpoint, version, params, priority)
+
+    async def get(self, endpoint: str, version: str, params: dict = None, priority: int = None):
+        return await self.send('GET', endpoint, version, params, priority)
+
+    async def put(self, endpoint: str, version: str, params: dict = None, priority: int = None):
+        return await self.send('PUT', endpoint, version, params, priority)
+
+    async def delete(self, endpoint: str, version: str, params: dict = None, priority: int = None):
+        return await self.send('DELETE', endpoint, version, params, priority)
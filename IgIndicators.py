@@ -0,0 +1,360 @@
+import math
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+import IgResample
+
+SIDES = ['mid', 'bid', 'ask']
+FIELDS = ['open', 'high', 'low', 'close']
+
+# the exponential smoothing below is worked out this many bars at a time with one matrix product
+SMOOTHING_BLOCK = 64
+
+# the columns of prices as returned by IGMarketData in any IgOutput backend: a DataFrame indexed by DateTime, a dict of
+# NumPy arrays or a pyarrow Table
+def as_columns(prices):
+    if isinstance(prices, pd.DataFrame):
+        columns = {name: prices[name].to_numpy(dtype = np.float64) for name in prices.columns}
+        columns['DateTime'] = prices.index.values
+        return columns
+    if isinstance(prices, dict):
+        return prices
+    return {name: prices.column(name).to_numpy() for name in prices.column_names}
+
+# the prices of bars with no price quoted carry the price of the bar before, both in batch and bar by bar
+def forward_fill(values: np.ndarray):
+    quoted = ~np.isnan(values)
+    if quoted.all():
+        return values
+    return values[np.maximum.accumulate(np.where(quoted, np.arange(len(values)), 0))]
+
+# the index of the first price quoted, len(values) when none is. the bars before it have no indicator values
+def first_quoted(values: np.ndarray):
+    quoted = np.flatnonzero(~np.isnan(values))
+    return quoted[0] if len(quoted) > 0 else len(values)
+
+# one price of every bar, such as the close of the mid price
+class Price:
+    def __init__(self, field: str = 'close', side: str = 'mid'):
+        if field not in FIELDS:
+            raise ValueError('field must be one of {fields}, not {field}'.format(fields = FIELDS, field = field))
+        if side not in SIDES:
+            raise ValueError('side must be one of {sides}, not {side}'.format(sides = SIDES, side = side))
+        self.field = field
+        self.side = side
+        self.last = math.nan
+
+    def array(self, columns: dict):
+        if self.side == 'mid':
+            values = (np.asarray(columns[self.field + '_bid'], dtype = np.float64) + np.asarray(columns[self.field + '_ask'], dtype = np.float64)) / 2
+        else:
+            values = np.asarray(columns[self.field + '_' + self.side], dtype = np.float64)
+        values = forward_fill(values)
+        if len(values) > 0:
+            self.last = values[-1]
+        return values
+
+    # the price of one bar, given as a dict of the bar's columns
+    def value(self, bar: dict):
+        if self.side == 'mid':
+            value = (bar[self.field + '_bid'] + bar[self.field + '_ask']) / 2
+        else:
+            value = bar[self.field + '_' + self.side]
+        if value is not None and not math.isnan(value):
+            self.last = value
+        return self.last
+
+# y[t] = y[t - 1] + alpha * (x[t] - y[t - 1]), starting from initial or else from x[0]. within each block of SMOOTHING_BLOCK
+# bars the smoothing is a product with a triangular matrix of the decay's powers, leaving a loop over the blocks only
+def smooth(values: np.ndarray, alpha: float, initial: float = None):
+    first = first_quoted(values)
+    if first > 0:
+        return np.concatenate([np.full(first, np.nan), smooth(values[first:], alpha, initial)])
+    if len(values) == 0:
+        return np.empty(0)
+    decay = 1 - alpha
+    block = SMOOTHING_BLOCK
+    powers = decay ** np.arange(block + 1)
+    lags = np.subtract.outer(np.arange(block), np.arange(block))
+    weights = np.where(lags >= 0, alpha * powers[np.clip(lags, 0, block)], 0)
+    padded = np.zeros(-(-len(values) // block) * block)
+    padded[:len(values)] = values
+    blocks = padded.reshape(-1, block) @ weights.T
+    carried = np.empty(len(blocks))
+    carry = values[0] if initial is None else initial
+    for i, last in enumerate(blocks[:, -1].tolist()):
+        carried[i] = carry
+        carry = last + powers[block] * carry
+    smoothed = blocks + np.outer(carried, powers[1:])
+    return smoothed.reshape(-1)[:len(values)]
+
+def sma(values: np.ndarray, period: int):
+    first = first_quoted(values)
+    sums = np.concatenate([[0], np.cumsum(values[first:])])
+    averages = np.full(len(values), np.nan)
+    if len(values) - first >= period:
+        averages[first + period - 1:] = (sums[period:] - sums[:-period]) / period
+    return averages
+
+def rolling_std(values: np.ndarray, period: int):
+    first = first_quoted(values)
+    deviations = np.full(len(values), np.nan)
+    if len(values) - first >= period:
+        deviations[first + period - 1:] = np.lib.stride_tricks.sliding_window_view(values[first:], period).std(axis = 1)
+    return deviations
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray):
+    previous = np.concatenate([[np.nan], close[:-1]])
+    return np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+
+
+
+# every indicator below works both ways: compute(columns) returns the indicator for every bar at once, vectorized, and
+# leaves the indicator's state at the last of those bars, so that update(bar) can go on from there bar by bar in constant
+# time as new bars come from the price cache or from polling. exponential averages start from their first input, as
+# pandas' ewm(adjust = False) does, so they settle over the first few periods
+
+class SMA:
+    def __init__(self, period: int, field: str = 'close', side: str = 'mid'):
+        self.period = period
+        self.price = Price(field, side)
+        self.window = []
+        self.next = 0
+        self.sum = 0.0
+
+    def compute(self, columns: dict):
+        values = self.price.array(columns)
+        self.window = values[max(first_quoted(values), len(values) - self.period):].tolist()
+        self.next = 0 if len(self.window) == self.period else len(self.window)
+        self.sum = math.fsum(self.window)
+        return sma(values, self.period)
+
+    def update(self, bar: dict):
+        value = self.price.value(bar)
+        if math.isnan(value):
+            return math.nan
+        if len(self.window) < self.period:
+            self.window.append(value)
+            self.sum += value
+            self.next = len(self.window) % self.period
+            return self.sum / self.period if len(self.window) == self.period else math.nan
+        self.sum += value - self.window[self.next]
+        self.window[self.next] = value
+        self.next = (self.next + 1) % self.period
+        if self.next == 0:
+            # summed again once per period, so the rounding of the running sum never builds up
+            self.sum = math.fsum(self.window)
+        return self.sum / self.period
+
+class EMA:
+    def __init__(self, period: int, field: str = 'close', side: str = 'mid'):
+        self.alpha = 2 / (period + 1)
+        self.price = Price(field, side)
+        self.value = None
+
+    def compute(self, columns: dict):
+        averages = smooth(self.price.array(columns), self.alpha)
+        self.value = averages[-1] if len(averages) > 0 and not math.isnan(averages[-1]) else None
+        return averages
+
+    def update(self, bar: dict):
+        price = self.price.value(bar)
+        if math.isnan(price):
+            return math.nan
+        self.value = price if self.value is None else self.value + self.alpha * (price - self.value)
+        return self.value
+
+# Wilder's average true range
+class ATR:
+    def __init__(self, period: int = 14, side: str = 'mid'):
+        self.alpha = 1 / period
+        self.high = Price('high', side)
+        self.low = Price('low', side)
+        self.close = Price('close', side)
+        self.previous_close = None
+        self.value = None
+
+    def compute(self, columns: dict):
+        close = self.close.array(columns)
+        ranges = true_range(self.high.array(columns), self.low.array(columns), close)
+        averages = smooth(ranges, self.alpha)
+        if len(close) > 0 and not math.isnan(averages[-1]):
+            self.previous_close = close[-1]
+            self.value = averages[-1]
+        return averages
+
+    def update(self, bar: dict):
+        high, low, close = self.high.value(bar), self.low.value(bar), self.close.value(bar)
+        if math.isnan(high) or math.isnan(low) or math.isnan(close):
+            return math.nan
+        if self.previous_close is None:
+            self.value = high - low
+        else:
+            true_range = max(high - low, abs(high - self.previous_close), abs(low - self.previous_close))
+            self.value += self.alpha * (true_range - self.value)
+        self.previous_close = close
+        return self.value
+
+# Wilder's relative strength index, NaN for the first bar, which has no change, and while prices have not moved at all
+class RSI:
+    def __init__(self, period: int = 14, field: str = 'close', side: str = 'mid'):
+        self.alpha = 1 / period
+        self.price = Price(field, side)
+        self.previous = None
+        self.gain = None
+        self.loss = None
+
+    def compute(self, columns: dict):
+        prices = self.price.array(columns)
+        index = np.full(len(prices), np.nan)
+        if len(prices) > 0 and not math.isnan(prices[-1]):
+            self.previous = prices[-1]
+        if len(prices) - first_quoted(prices) < 2:
+            return index
+        changes = np.diff(prices)
+        gains = smooth(np.maximum(changes, 0), self.alpha)
+        losses = smooth(np.maximum(-changes, 0), self.alpha)
+        self.gain, self.loss = gains[-1], losses[-1]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            index[1:] = 100 * gains / (gains + losses)
+        return index
+
+    def update(self, bar: dict):
+        price = self.price.value(bar)
+        if math.isnan(price):
+            return math.nan
+        previous, self.previous = self.previous, price
+        if previous is None:
+            return math.nan
+        change = price - previous
+        if self.gain is None:
+            self.gain, self.loss = max(change, 0), max(-change, 0)
+        else:
+            self.gain += self.alpha * (max(change, 0) - self.gain)
+            self.loss += self.alpha * (max(-change, 0) - self.loss)
+        total = self.gain + self.loss
+        return 100 * self.gain / total if total > 0 else math.nan
+
+# (middle, upper, lower) bands of width standard deviations (of the population) around the simple moving average
+class Bollinger:
+    def __init__(self, period: int = 20, width: float = 2, field: str = 'close', side: str = 'mid'):
+        self.period = period
+        self.width = width
+        self.average = SMA(period, field, side)
+        self.squares = 0.0
+
+    def bands(self, middle, deviation):
+        return middle, middle + self.width * deviation, middle - self.width * deviation
+
+    def compute(self, columns: dict):
+        middle = self.average.compute(columns)
+        deviation = rolling_std(self.average.price.array(columns), self.period)
+        self.squares = self.sum_of_squares()
+        return self.bands(middle, deviation)
+
+    # squared deviations of the window from its mean, worked out afresh
+    def sum_of_squares(self):
+        if len(self.average.window) == 0:
+            return 0.0
+        mean = self.average.sum / len(self.average.window)
+        return math.fsum((value - mean) ** 2 for value in self.average.window)
+
+    def update(self, bar: dict):
+        window = self.average.window
+        full = len(window) == self.period
+        removed = window[self.average.next] if full else None
+        previous_mean = self.average.sum / len(window) if len(window) > 0 else 0.0
+        middle = self.average.update(bar)
+        if math.isnan(self.average.price.last):
+            return math.nan, math.nan, math.nan
+        if not full or self.average.next == 0:
+            # while the window fills, and once a period after, the squares are summed again in full
+            self.squares = self.sum_of_squares()
+        else:
+            # the window's mean and squared deviations moved on by one value in and one value out
+            added = window[self.average.next - 1]
+            mean = self.average.sum / self.period
+            self.squares = max(0.0, self.squares + (added - removed) * (added - mean + removed - previous_mean))
+        return self.bands(middle, math.sqrt(self.squares / self.period) if len(window) == self.period else math.nan)
+
+# volume weighted average of the typical price (high + low + close) / 3, starting again with every session. sessions are
+# days starting at session_offset, as with IGMarketData. IG's volumes are counts of price changes, so bars without any
+# leave the average where it was, and it is NaN until the session's first change
+class VWAP:
+    def __init__(self, session_offset: timedelta = timedelta(0), side: str = 'mid'):
+        self.session_offset = session_offset
+        self.high = Price('high', side)
+        self.low = Price('low', side)
+        self.close = Price('close', side)
+        self.session = None
+        self.weighted = 0.0
+        self.volume = 0.0
+
+    def compute(self, columns: dict):
+        typical = (self.high.array(columns) + self.low.array(columns) + self.close.array(columns)) / 3
+        volume = np.where(np.isnan(typical), 0, np.nan_to_num(np.asarray(columns['volume'], dtype = np.float64)))
+        typical = np.nan_to_num(typical)
+        if len(typical) == 0:
+            return typical
+        sessions = IgResample.bar_starts(np.asarray(columns['DateTime'], dtype = 'datetime64[ns]').view('int64'), 'DAY', self.session_offset)
+        firsts = np.flatnonzero(np.concatenate([[True], sessions[1:] != sessions[:-1]]))
+        lengths = np.diff(np.append(firsts, len(typical)))
+        weighted = np.cumsum(typical * volume)
+        volumes = np.cumsum(volume)
+        # the running sums less what they held before each session started
+        weighted -= np.repeat(np.concatenate([[0], weighted[firsts[1:] - 1]]), lengths)
+        volumes -= np.repeat(np.concatenate([[0], volumes[firsts[1:] - 1]]), lengths)
+        self.session, self.weighted, self.volume = int(sessions[-1]), weighted[-1], volumes[-1]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.where(volumes > 0, weighted / volumes, np.nan)
+
+    def update(self, bar: dict):
+        typical = (self.high.value(bar) + self.low.value(bar) + self.close.value(bar)) / 3
+        volume = bar['volume'] if bar['volume'] is not None and not math.isnan(bar['volume']) and not math.isnan(typical) else 0.0
+        typical = 0.0 if math.isnan(typical) else typical
+        time = int(np.datetime64(bar['DateTime'], 'ns').view('int64'))
+        if self.session is None or not self.session <= time < self.session + IgResample.NANOSECONDS['DAY']:
+            self.session, self.weighted, self.volume = int(IgResample.bar_starts(np.array([time]), 'DAY', self.session_offset)[0]), 0.0, 0.0
+        self.weighted += typical * volume
+        self.volume += volume
+        return self.weighted / self.volume if self.volume > 0 else math.nan
+
+
+
+# a set of named indicators over one market's bars, e.g. IndicatorEngine({'ema20': EMA(20), 'atr': ATR(14)}). compute
+# returns every indicator for every bar, as a DataFrame for a DataFrame of prices and as a dict of arrays otherwise, with
+# indicators of several values (Bollinger) given a column per value. update and append then carry on bar by bar
+class IndicatorEngine:
+    def __init__(self, indicators: dict):
+        self.indicators = indicators
+
+    def columns(self, name: str, value):
+        if isinstance(self.indicators[name], Bollinger):
+            return {name + '.' + band: band_value for band, band_value in zip(['middle', 'upper', 'lower'], value)}
+        return {name: value}
+
+    def compute(self, prices):
+        columns = as_columns(prices)
+        computed = {}
+        for name, indicator in self.indicators.items():
+            computed.update(self.columns(name, indicator.compute(columns)))
+        if isinstance(prices, pd.DataFrame):
+            return pd.DataFrame(computed, index = prices.index)
+        return computed
+
+    # one new bar given as a dict of its columns, such as a row of a prices DataFrame with its DateTime added
+    def update(self, bar: dict):
+        updated = {}
+        for name, indicator in self.indicators.items():
+            updated.update(self.columns(name, indicator.update(bar)))
+        return updated
+
+    # new bars appended after those computed or updated before, in any IgOutput backend
+    def append(self, prices):
+        columns = as_columns(prices)
+        names = list(columns.keys())
+        rows = [self.update(dict(zip(names, bar))) for bar in zip(*[columns[name].tolist() if isinstance(columns[name], np.ndarray) else list(columns[name]) for name in names])]
+        appended = {name: np.array([row[name] for row in rows], dtype = np.float64) for name in (rows[0].keys() if len(rows) > 0 else [])}
+        if isinstance(prices, pd.DataFrame):
+            return pd.DataFrame(appended, index = prices.index)
+        return appended
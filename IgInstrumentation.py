@@ -0,0 +1,217 @@
+import bisect
+import logging
+import threading
+import functools
+import pandas as pd
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+# the phases of an api call: waiting for the rate limiter, sending the request until the response headers arrive (connecting
+# and the server's time included), reading the body, decoding the JSON, and building the DataFrame from it
+PHASES = ['queue', 'send', 'read', 'decode', 'build']
+SECONDS_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+BYTES_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+# path segments kept in endpoint labels. every other segment is an epic, a deal id, a date or the like, and is replaced by
+# * so that the number of label values stays small
+ENDPOINT_SEGMENTS = {'accounts', 'activity', 'clientsentiment', 'confirms', 'history', 'marketnavigation', 'markets', 'operations',
+                     'otc', 'positions', 'preferences', 'prices', 'refresh-token', 'session', 'sprintmarkets', 'transactions',
+                     'watchlists', 'workingorders', 'encryptionKey', 'application'}
+
+@functools.lru_cache(maxsize = 4096)
+def endpoint_label(endpoint: str):
+    path = endpoint.split('?')[0]
+    return '/'.join(segment if segment in ENDPOINT_SEGMENTS or segment == '' else '*' for segment in path.split('/'))
+
+
+
+# bucketed counts of observations, with cumulative counts for the exposition formats and quantiles estimated from the buckets
+class Histogram:
+    def __init__(self, buckets: list):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        counts = []
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    # the upper bound of the bucket holding the quantile, or the largest bucket bound when it falls in the overflow bucket
+    def quantile(self, q: float):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        for bound, total in zip(self.buckets, self.cumulative()):
+            if total >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+
+# collects the timings, sizes, retries and rate limit headroom of the calls made through an ApiHandler. recording is a dict
+# lookup and a bucket search under one lock, so it can stay on in production. listeners are called with a dict per event
+# ('request' once a response is in, 'decode' and 'build' as the platform processes it); a failing listener is logged and
+# counted in listener_failures. exposition() renders everything in the Prometheus text format, or OpenMetrics, for serve() or
+# any other exporter
+class Instrumentation:
+    def __init__(self, seconds_buckets: list = SECONDS_BUCKETS, bytes_buckets: list = BYTES_BUCKETS):
+        self.seconds_buckets = seconds_buckets
+        self.bytes_buckets = bytes_buckets
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.sizes = {}
+        self.requests = {}
+        self.retries = {}
+        self.headroom = {}
+        self.listeners = []
+        self.listener_failures = 0
+        self.server = None
+
+    def histogram(self, histograms: dict, key: tuple, buckets: list):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        return histogram
+
+    def notify(self, event: dict):
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception:
+                with self.lock:
+                    self.listener_failures += 1
+                logger.exception('instrumentation listener failed')
+
+    # one completed request. headroom maps each budget to the requests left in it after this request was let through
+    def record_request(self, method: str, endpoint: str, version: str, status: int, queue: float, send: float, read: float, request_bytes: int, response_bytes: int, retries: int, headroom: dict):
+        label = endpoint_label(endpoint)
+        with self.lock:
+            for phase, seconds in (('queue', queue), ('send', send), ('read', read)):
+                self.histogram(self.phases, (label, version, phase), self.seconds_buckets).observe(seconds)
+            self.histogram(self.sizes, (label, version, 'request'), self.bytes_buckets).observe(request_bytes)
+            self.histogram(self.sizes, (label, version, 'response'), self.bytes_buckets).observe(response_bytes)
+            key = (label, version, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if retries > 0:
+                self.retries[(label, version)] = self.retries.get((label, version), 0) + retries
+            self.headroom.update(headroom)
+        if len(self.listeners) > 0:
+            self.notify({'event': 'request', 'method': method, 'endpoint': label, 'version': version, 'status': status, 'queue': queue, 'send': send,
+                         'read': read, 'request_bytes': request_bytes, 'response_bytes': response_bytes, 'retries': retries, 'headroom': headroom})
+
+    def record_phase(self, endpoint: str, version: str, phase: str, seconds: float):
+        label = endpoint_label(endpoint)
+        with self.lock:
+            self.histogram(self.phases, (label, version, phase), self.seconds_buckets).observe(seconds)
+        if len(self.listeners) > 0:
+            self.notify({'event': phase, 'endpoint': label, 'version': version, phase: seconds})
+
+    # one row per endpoint, version and phase, with quantiles estimated from the histogram buckets
+    def summary(self):
+        with self.lock:
+            rows = [{'endpoint': endpoint,
+                     'version': version,
+                     'phase': phase,
+                     'count': histogram.count,
+                     'mean_ms': histogram.sum / histogram.count * 1000 if histogram.count else None,
+                     'p50_ms': histogram.quantile(0.5) * 1000 if histogram.count else None,
+                     'p99_ms': histogram.quantile(0.99) * 1000 if histogram.count else None} for (endpoint, version, phase), histogram in self.phases.items()]
+        summary = pd.DataFrame(rows, columns = ['endpoint', 'version', 'phase', 'count', 'mean_ms', 'p50_ms', 'p99_ms'])
+        summary['phase'] = pd.Categorical(summary['phase'], categories = PHASES, ordered = True)
+        return summary.sort_values(['endpoint', 'version', 'phase']).reset_index(drop = True)
+
+    def clear(self):
+        with self.lock:
+            self.phases = {}
+            self.sizes = {}
+            self.requests = {}
+            self.retries = {}
+            self.headroom = {}
+
+    def labels(self, **labels):
+        return ','.join('{name}="{value}"'.format(name = name, value = str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in labels.items())
+
+    def histogram_lines(self, name: str, histograms: dict, label_names: list):
+        lines = []
+        for key, histogram in histograms.items():
+            labels = dict(zip(label_names, key))
+            for bound, total in zip(histogram.buckets + ['+Inf'], histogram.cumulative()):
+                lines.append('{name}_bucket{{{labels}}} {total}'.format(name = name, labels = self.labels(**labels, le = bound), total = total))
+            lines.append('{name}_sum{{{labels}}} {sum}'.format(name = name, labels = self.labels(**labels), sum = histogram.sum))
+            lines.append('{name}_count{{{labels}}} {count}'.format(name = name, labels = self.labels(**labels), count = histogram.count))
+        return lines
+
+    def exposition(self, openmetrics: bool = False):
+        # OpenMetrics names a counter family without the _total its samples carry
+        counter = lambda name: name if openmetrics else name + '_total'
+        with self.lock:
+            lines = ['# HELP ig_api_phase_seconds Seconds spent in each phase of an IG API call',
+                     '# TYPE ig_api_phase_seconds histogram']
+            lines.extend(self.histogram_lines('ig_api_phase_seconds', self.phases, ['endpoint', 'version', 'phase']))
+            lines.extend(['# HELP ig_api_payload_bytes Size of IG API request and response bodies',
+                          '# TYPE ig_api_payload_bytes histogram'])
+            lines.extend(self.histogram_lines('ig_api_payload_bytes', self.sizes, ['endpoint', 'version', 'direction']))
+            lines.extend(['# HELP {name} IG API responses by status'.format(name = counter('ig_api_requests')),
+                          '# TYPE {name} counter'.format(name = counter('ig_api_requests'))])
+            lines.extend('ig_api_requests_total{{{labels}}} {count}'.format(labels = self.labels(endpoint = endpoint, version = version, method = method, status = status), count = count)
+                         for (endpoint, version, method, status), count in self.requests.items())
+            lines.extend(['# HELP {name} IG API requests repeated after being throttled'.format(name = counter('ig_api_retries')),
+                          '# TYPE {name} counter'.format(name = counter('ig_api_retries'))])
+            lines.extend('ig_api_retries_total{{{labels}}} {count}'.format(labels = self.labels(endpoint = endpoint, version = version), count = count)
+                         for (endpoint, version), count in self.retries.items())
+            lines.extend(['# HELP ig_api_rate_limit_headroom Requests left in each rate limit budget',
+                          '# TYPE ig_api_rate_limit_headroom gauge'])
+            lines.extend('ig_api_rate_limit_headroom{{{labels}}} {value}'.format(labels = self.labels(budget = budget), value = value)
+                         for budget, value in self.headroom.items())
+            lines.extend(['# HELP {name} Instrumentation listeners which raised'.format(name = counter('ig_instrumentation_listener_failures')),
+                          '# TYPE {name} counter'.format(name = counter('ig_instrumentation_listener_failures')),
+                          'ig_instrumentation_listener_failures_total {count}'.format(count = self.listener_failures)])
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    # serves exposition() at /metrics on a background thread, in OpenMetrics when the scraper asks for it. the metrics show
+    # the endpoints called, the account's activity and its rate limit headroom, so they are only served on this machine
+    # unless a wider host such as '0.0.0.0' is given
+    def serve(self, port: int = 9464, host: str = '127.0.0.1'):
+        instrumentation = self
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                openmetrics = 'application/openmetrics-text' in (self.headers.get('Accept') or '')
+                payload = instrumentation.exposition(openmetrics).encode()
+                self.send_response(200)
+                if openmetrics:
+                    self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+                else:
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return self.server.server_address[1]
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,172 @@
+import time
+import uuid
+import logging
+import threading
+import pandas as pd
+from collections import deque
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from requests import Session
+from requests.adapters import HTTPAdapter
+import IgRateLimiter
+import IgResponseCache
+import IgInstrumentation
+import IgSingleFlight
+from IGCustomPlatform import IGDealer, IGException
+
+logger = logging.getLogger(__name__)
+
+DIRECTIONS = ['BUY', 'SELL']
+ORDER_TYPES = ['MARKET', 'LIMIT', 'QUOTE']
+
+
+
+# the fixed part of an otc order for one epic, checked once when it is built so that sending an order only fills in the
+# direction, size and levels. min_size comes from the market's dealing rules when the template is made by LatencyDealer
+class OrderTemplate:
+    def __init__(self, epic: str, currencyCode: str, orderType: str = 'MARKET', expiry: str = '-', forceOpen: bool = True, guaranteedStop: bool = False, timeInForce: str = None, limitDistance: Decimal = None, stopDistance: Decimal = None, min_size: Decimal = None):
+        if orderType not in ORDER_TYPES:
+            raise ValueError('orderType must be one of {types}'.format(types = ORDER_TYPES))
+        if (limitDistance is not None or stopDistance is not None) and not forceOpen:
+            raise ValueError('IG requires forceOpen when a limit or stop is set')
+        if guaranteedStop and stopDistance is None:
+            raise ValueError('a guaranteed stop needs a stopDistance')
+        self.epic = epic
+        self.orderType = orderType
+        self.min_size = min_size
+        params = {'currencyCode': currencyCode,
+                  'epic': epic,
+                  'expiry': expiry,
+                  'forceOpen': forceOpen,
+                  'guaranteedStop': guaranteedStop,
+                  'orderType': orderType,
+                  'timeInForce': timeInForce,
+                  'limitDistance': limitDistance,
+                  'stopDistance': stopDistance,
+                  'trailingStop': False}
+        self.params = {key: value for key, value in params.items() if value is not None}
+
+    def order(self, direction: str, size: Decimal, level: Decimal = None, quoteId: str = None, dealReference: str = None):
+        if direction not in DIRECTIONS:
+            raise ValueError('direction must be BUY or SELL')
+        if size <= 0 or (self.min_size is not None and size < self.min_size):
+            raise ValueError('size {size} is below the minimum deal size for {epic}'.format(size = size, epic = self.epic))
+        if self.orderType != 'MARKET' and level is None:
+            raise ValueError('{orderType} orders need a level'.format(orderType = self.orderType))
+        if self.orderType == 'QUOTE' and quoteId is None:
+            raise ValueError('QUOTE orders need a quoteId')
+        order = dict(self.params, direction = direction, size = size, dealReference = dealReference or uuid.uuid4().hex[:30])
+        if level is not None and self.orderType != 'MARKET':
+            order['level'] = level
+        if quoteId is not None:
+            order['quoteId'] = quoteId
+        return order
+
+
+
+# IGDealer with a latency optimised path for opening positions. orders go out over a dedicated connection pool which can be
+# kept warm with periodic pings, are built from pre-validated templates, and return as soon as IG acknowledges them, with the
+# deal confirmation polled in the background and delivered through a future. each order's timings are recorded
+class LatencyDealer(IGDealer):
+    def __init__(self, session: Session = None, base_url: str = None, confirm_workers: int = 4, confirm_attempts: int = 20, confirm_interval: float = 0.05, scheduler: IgRateLimiter.RequestScheduler = None, response_cache: IgResponseCache.ResponseCache = None, instrumentation: IgInstrumentation.Instrumentation = None, single_flight: IgSingleFlight.SingleFlight = None):
+        super().__init__(session, base_url, None, scheduler, response_cache, instrumentation, single_flight)
+        self.dealing_session = Session()
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = confirm_workers + 2)
+        self.dealing_session.mount('https://', adapter)
+        self.dealing_session.mount('http://', adapter)
+        self.confirmations = ThreadPoolExecutor(max_workers = confirm_workers)
+        self.confirm_attempts = confirm_attempts
+        self.confirm_interval = confirm_interval
+        self.templates = {}
+        self.timings = deque(maxlen = 10000)
+        self.keep_alive_stop = None
+        self.keep_alive_failures = 0
+
+    # the main session's headers, with its current tokens, sent with each request over the dealing pool rather than copied
+    # onto the pool's session, which the keep alive thread uses at the same time
+    def dealing_headers(self):
+        return dict(self.session.headers)
+
+    def order_template(self, epic: str, currencyCode: str, orderType: str = 'MARKET', expiry: str = None, forceOpen: bool = True, guaranteedStop: bool = False, timeInForce: str = None, limitDistance: Decimal = None, stopDistance: Decimal = None):
+        response = self.api_handler.get(session = None, endpoint = '/markets', version = '2', params = {'epics': epic, 'filter': 'ALL'})
+        data = self.api_handler.decode(response)
+        if response.status_code != 200 or len(data['marketDetails']) == 0:
+            raise IGException(data)
+        details = data['marketDetails'][0]
+        instrument = details['instrument']
+        currencies = [currency['code'] for currency in instrument.get('currencies') or []]
+        if len(currencies) > 0 and currencyCode not in currencies:
+            raise ValueError('{epic} cannot be dealt in {currency}'.format(epic = epic, currency = currencyCode))
+        min_size = ((details.get('dealingRules') or {}).get('minDealSize') or {}).get('value')
+        template = OrderTemplate(epic, currencyCode, orderType, expiry or instrument.get('expiry', '-'), forceOpen, guaranteedStop, timeInForce, limitDistance, stopDistance, min_size)
+        self.templates[epic] = template
+        return template
+
+    # a cheap authenticated request over the dealing pool, so its connection is open before the next order needs it
+    def warm_up(self):
+        start = time.perf_counter()
+        self.api_handler.get(session = self.dealing_session, endpoint = '/session', version = '1', headers = self.dealing_headers())
+        return time.perf_counter() - start
+
+    # a failing ping is logged and counted in keep_alive_failures, and the pings go on
+    def start_keep_alive(self, interval: float = 15):
+        self.stop_keep_alive()
+        stop = threading.Event()
+        def keep_alive():
+            while not stop.wait(interval):
+                try:
+                    self.warm_up()
+                except Exception:
+                    self.keep_alive_failures += 1
+                    logger.exception('keep alive failed')
+        self.keep_alive_stop = stop
+        self.warm_up()
+        threading.Thread(target = keep_alive, daemon = True).start()
+
+    def stop_keep_alive(self):
+        if self.keep_alive_stop is not None:
+            self.keep_alive_stop.set()
+            self.keep_alive_stop = None
+
+    # sends an order built from a template and returns a future of its deal confirmation once IG has acknowledged it
+    def submit_order(self, template: OrderTemplate, direction: str, size: Decimal, level: Decimal = None, quoteId: str = None, dealReference: str = None):
+        timing = {'epic': template.epic, 'direction': direction, 'started': time.perf_counter()}
+        params = template.order(direction, size, level, quoteId, dealReference)
+        headers = self.dealing_headers()
+        timing['built'] = time.perf_counter()
+        response = self.api_handler.post(session = self.dealing_session, endpoint = '/positions/otc', version = '2', params = params, headers = headers)
+        timing['acknowledged'] = time.perf_counter()
+        deal = self.api_handler.decode(response)
+        if response.status_code != 200:
+            raise IGException(deal)
+        timing['dealReference'] = deal['dealReference']
+        return self.confirmations.submit(self.poll_confirmation, deal['dealReference'], timing)
+
+    def poll_confirmation(self, dealReference: str, timing: dict):
+        confirmation, attempt = self.confirm_deal(dealReference, self.confirm_attempts, self.confirm_interval, session = self.dealing_session, headers = self.dealing_headers())
+        timing['confirmed'] = time.perf_counter()
+        timing['confirm_attempts'] = attempt
+        timing['dealStatus'] = confirmation['dealStatus'][0]
+        self.timings.append(timing)
+        return confirmation
+
+    # one row per order with the time spent building it, waiting for IG's acknowledgement, and waiting for the confirmation
+    def order_latencies(self):
+        rows = [{'dealReference': timing['dealReference'],
+                 'epic': timing['epic'],
+                 'direction': timing['direction'],
+                 'dealStatus': timing['dealStatus'],
+                 'confirm_attempts': timing['confirm_attempts'],
+                 'build_ms': (timing['built'] - timing['started']) * 1000,
+                 'ack_ms': (timing['acknowledged'] - timing['built']) * 1000,
+                 'confirm_ms': (timing['confirmed'] - timing['acknowledged']) * 1000,
+                 'total_ms': (timing['confirmed'] - timing['started']) * 1000} for timing in list(self.timings)]
+        return pd.DataFrame(rows, columns = ['dealReference', 'epic', 'direction', 'dealStatus', 'confirm_attempts', 'build_ms', 'ack_ms', 'confirm_ms', 'total_ms'])
+
+    def latency_summary(self, percentiles: list = [0.5, 0.9, 0.99]):
+        return self.order_latencies()[['build_ms', 'ack_ms', 'confirm_ms', 'total_ms']].describe(percentiles = percentiles)
+
+    def close(self):
+        self.stop_keep_alive()
+        self.confirmations.shutdown(wait = True)
+        self.dealing_session.close()
@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import bisect
+import threading
+import pandas as pd
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from IGCustomPlatform import IGMarketData
+
+# the id given to the top of the market navigation tree, which IG serves from /marketnavigation rather than /marketnavigation/{nodeId}
+ROOT = 'ROOT'
+
+
+
+# walks the whole /marketnavigation tree over a pool of worker threads, keeping every node (with its parent and the time it was
+# last downloaded) and the markets listed under it. the result can be saved to disk, reloaded, and refreshed node by node
+class MarketNavigationCrawler:
+    def __init__(self, market_data: IGMarketData, max_workers: int = 8):
+        self.market_data = market_data
+        self.max_workers = max_workers
+        self.nodes = {}
+        self.children = {}
+        self.markets = {}
+        self.failures = {}
+        self.sessions = threading.local()
+
+    def download_node(self, nodeId: str):
+        if not hasattr(self.sessions, 'session'):
+            self.sessions.session = self.market_data.worker_session()
+        if nodeId == ROOT:
+            return self.market_data.market_navigation(session = self.sessions.session)
+        return self.market_data.market_node(nodeId, session = self.sessions.session)
+
+    # downloads the given nodes and everything below them, replacing what was held for them before.
+    # nodes below them which were crawled after fresh_after are kept as they are
+    def crawl(self, nodeIds: list = None, fresh_after: datetime = None):
+        if nodeIds is None:
+            nodeIds = [ROOT]
+            if ROOT not in self.nodes:
+                self.nodes[ROOT] = {'id': ROOT, 'name': ROOT, 'parentId': None, 'crawled': None}
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            pending = {executor.submit(self.download_node, nodeId): nodeId for nodeId in nodeIds}
+            while pending:
+                done, not_done = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    nodeId = pending.pop(future)
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        self.failures[nodeId] = str(e)
+                        continue
+                    self.failures.pop(nodeId, None)
+                    for childId in self.update_node(nodeId, data):
+                        crawled = self.nodes[childId]['crawled']
+                        if fresh_after is None or crawled is None or crawled < fresh_after:
+                            pending[executor.submit(self.download_node, childId)] = childId
+        return self
+
+    # stores a downloaded node and returns the ids of its children, dropping any children which are no longer listed
+    def update_node(self, nodeId: str, data: dict):
+        children = data['nodes'].to_dict('records')
+        childIds = [str(child['id']) for child in children]
+        for removedId in set(self.children.get(nodeId, [])) - set(childIds):
+            self.remove_subtree(removedId)
+        for child in children:
+            if str(child['id']) in self.nodes:
+                self.nodes[str(child['id'])]['name'] = child['name']
+            else:
+                self.nodes[str(child['id'])] = {'id': str(child['id']), 'name': child['name'], 'parentId': nodeId, 'crawled': None}
+        self.children[nodeId] = childIds
+        self.nodes[nodeId]['crawled'] = datetime.now()
+        markets = data['markets'].to_dict('records')
+        for market in markets:
+            market['nodeId'] = nodeId
+        self.markets[nodeId] = markets
+        return childIds
+
+    def remove_subtree(self, nodeId: str):
+        for childId in self.children.pop(nodeId, []):
+            self.remove_subtree(childId)
+        self.nodes.pop(nodeId, None)
+        self.markets.pop(nodeId, None)
+        self.failures.pop(nodeId, None)
+
+    # downloads again only the nodes last crawled longer than max_age ago (or never), plus any new nodes found below them
+    def refresh(self, max_age: timedelta = timedelta(days = 1)):
+        cutoff = datetime.now() - max_age
+        stale = [nodeId for nodeId, node in self.nodes.items() if node['crawled'] is None or node['crawled'] < cutoff]
+        stale_set = set(stale)
+        # a stale node below another stale node is downloaded again when its parent's children are crawled
+        stale = [nodeId for nodeId in stale if self.nodes[nodeId]['parentId'] not in stale_set]
+        if len(stale) > 0:
+            self.crawl(stale, fresh_after = cutoff)
+        return self
+
+    def nodes_frame(self):
+        return pd.DataFrame(list(self.nodes.values()), columns = ['id', 'name', 'parentId', 'crawled'])
+
+    # one row per epic, taken from the first node it is listed under
+    def markets_frame(self):
+        markets = pd.DataFrame([market for markets in self.markets.values() for market in markets])
+        if len(markets) == 0:
+            return pd.DataFrame(columns = ['epic', 'instrumentName', 'instrumentType', 'nodeId'])
+        return markets.drop_duplicates(subset = 'epic').reset_index(drop = True)
+
+    def index(self):
+        return MarketIndex(self.markets_frame())
+
+    def save(self, path: str):
+        nodes = [dict(node, crawled = None if node['crawled'] is None else node['crawled'].isoformat()) for node in self.nodes.values()]
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'nodes': nodes, 'markets': self.markets}, f, default = str)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str, market_data: IGMarketData, max_workers: int = 8):
+        crawler = cls(market_data, max_workers)
+        with open(path) as f:
+            snapshot = json.load(f)
+        for node in snapshot['nodes']:
+            if node['crawled'] is not None:
+                node['crawled'] = datetime.fromisoformat(node['crawled'])
+            crawler.nodes[node['id']] = node
+            if node['parentId'] is not None:
+                crawler.children.setdefault(node['parentId'], []).append(node['id'])
+        crawler.markets = snapshot['markets']
+        return crawler
+
+
+
+# in-memory index over a flat table of markets, for resolving symbols without calling IG. epics are looked up directly,
+# and search matches every word of the query as a prefix of a word in the instrument name or epic.
+# results are lists of market dicts rather than dataframes, to keep each lookup in the microsecond range
+class MarketIndex:
+    def __init__(self, markets: pd.DataFrame):
+        self.markets = markets.to_dict('records')
+        self.epics = {}
+        postings = {}
+        for position, market in enumerate(self.markets):
+            self.epics[market['epic']] = position
+            for token in self.tokens(str(market.get('instrumentName', '')) + ' ' + str(market['epic'])):
+                postings.setdefault(token, set()).add(position)
+        self.tokens_sorted = sorted(postings)
+        self.postings = [postings[token] for token in self.tokens_sorted]
+
+    def tokens(self, text: str):
+        return set(re.findall(r'[a-z0-9]+', text.lower()))
+
+    def lookup(self, epic: str):
+        position = self.epics.get(epic)
+        if position is None:
+            return None
+        return self.markets[position]
+
+    def prefix_matches(self, prefix: str):
+        first = bisect.bisect_left(self.tokens_sorted, prefix)
+        matches = set()
+        for position in range(first, len(self.tokens_sorted)):
+            if not self.tokens_sorted[position].startswith(prefix):
+                break
+            matches |= self.postings[position]
+        return matches
+
+    def search(self, query: str, instrumentType: str = None, limit: int = None):
+        matches = None
+        for token in sorted(self.tokens(query), key = len, reverse = True):
+            token_matches = self.prefix_matches(token)
+            matches = token_matches if matches is None else matches & token_matches
+            if len(matches) == 0:
+                break
+        if matches is None:
+            matches = range(len(self.markets))
+        results = []
+        for position in sorted(matches):
+            market = self.markets[position]
+            if instrumentType is None or market.get('instrumentType') == instrumentType:
+                results.append(market)
+                if limit is not None and len(results) == limit:
+                    break
+        return results
@@ -0,0 +1,495 @@
+'''
+A local stand-in for the IG REST gateway, so the platform can be exercised offline. It serves the endpoints the platform calls
+from an in-memory market universe with synthetic prices, and keeps positions, working orders, confirmations and watchlists in memory.
+It can also behave like a loaded gateway: with a response latency (per endpoint if need be), a cap on history page sizes,
+IG's per-minute trading and non-trading limits and weekly historical price allowance, and padded records for larger payloads.
+Logins give CST tokens (version 2) or OAuth tokens with a refresh token (version 3), which can be made to expire.
+
+    server = MockIGServer().start()
+    ig = IGDealer(base_url = server.base_url)
+    ...
+    server.stop()
+
+    slow = MockIGServer(state = MockIGState(latency = 0.05, endpoint_latency = {'/prices': 0.2}, non_trading_per_minute = 30))
+
+or run this file to serve on a fixed port, optionally with a latency in seconds: python IgMockServer.py [port] [latency]
+'''
+import re
+import sys
+import json
+import math
+import uuid
+import time
+import random
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+RESOLUTIONS = {'SECOND': 1, 'MINUTE': 60, 'MINUTE_2': 120, 'MINUTE_3': 180, 'MINUTE_5': 300, 'MINUTE_10': 600, 'MINUTE_15': 900,
+               'MINUTE_30': 1800, 'HOUR': 3600, 'HOUR_2': 7200, 'HOUR_3': 10800, 'HOUR_4': 14400, 'DAY': 86400, 'WEEK': 604800, 'MONTH': 2592000}
+INSTRUMENT_TYPES = ['INDICES', 'CURRENCIES', 'SHARES', 'COMMODITIES']
+
+# the only form IG takes dates in the /prices/{epic}/{resolution}/{start}/{end} path
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+
+# the state behind the mock gateway. every market has a deterministic synthetic price path, so repeated requests agree
+class MockIGState:
+    def __init__(self, num_markets: int = 200, history_size: int = 500, node_size: int = 20, latency: float = 0, jitter: float = 0, endpoint_latency: dict = None, max_page_size: int = None, trading_per_minute: int = None, non_trading_per_minute: int = None, historical_allowance: int = None, record_padding: int = 0, token_lifetime: float = None):
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.refresh_tokens = set()
+        self.token_lifetime = token_lifetime
+        self.logins = 0
+        self.markets = {}
+        for i in range(num_markets):
+            epic = 'CS.D.MOCK{i}.CFD.IP'.format(i = i)
+            self.markets[epic] = {'epic': epic,
+                                  'instrumentName': 'Mock Market {i}'.format(i = i),
+                                  'instrumentType': INSTRUMENT_TYPES[i % len(INSTRUMENT_TYPES)],
+                                  'expiry': '-',
+                                  'lotSize': 1,
+                                  'currency': 'GBP'}
+        self.nodes = {'': {'nodes': [{'id': str(number), 'name': instrumentType} for number, instrumentType in enumerate(INSTRUMENT_TYPES)], 'markets': None}}
+        for number, instrumentType in enumerate(INSTRUMENT_TYPES):
+            epics = [epic for epic, market in self.markets.items() if market['instrumentType'] == instrumentType]
+            children = []
+            for start in range(0, len(epics), node_size):
+                nodeId = '{number}{start:04d}'.format(number = number, start = start)
+                children.append({'id': nodeId, 'name': '{type} {start}'.format(type = instrumentType, start = start)})
+                self.nodes[nodeId] = {'nodes': None, 'markets': epics[start:start + node_size]}
+            self.nodes[str(number)] = {'nodes': children, 'markets': None}
+        self.history_size = history_size
+        self.positions = {}
+        self.working_orders = {}
+        self.confirms = {}
+        self.watchlists = {}
+        self.preferences = {'trailingStopsEnabled': False}
+        self.requests = 0
+        self.latency = latency
+        self.jitter = jitter
+        self.endpoint_latency = endpoint_latency or {}
+        self.max_page_size = max_page_size
+        self.limits = {'trading': trading_per_minute, 'non_trading': non_trading_per_minute}
+        self.windows = {'trading': deque(), 'non_trading': deque()}
+        self.historical_allowance = historical_allowance
+        self.remaining_allowance = historical_allowance
+        self.throttled = 0
+        self.padding = 'x' * record_padding if record_padding > 0 else None
+
+    # seconds to wait before answering a request, the longest matching path prefix in endpoint_latency taking precedence
+    def delay(self, path: str):
+        prefixes = [prefix for prefix in self.endpoint_latency if path.startswith(prefix)]
+        seconds = self.endpoint_latency[max(prefixes, key = len)] if prefixes else self.latency
+        if self.jitter > 0:
+            seconds += random.uniform(0, self.jitter)
+        return seconds
+
+    # IG counts dealing requests and all other requests in separate one minute windows. returns the error IG answers with
+    # once the request's window is full, or None when the request is allowed
+    def throttle(self, method: str, path: str):
+        if method != 'GET' and (path.startswith('/positions') or path.startswith('/workingorders')):
+            budget, error = 'trading', 'error.public-api.exceeded-account-trading-allowance'
+        else:
+            budget, error = 'non_trading', 'error.public-api.exceeded-account-allowance'
+        if self.limits[budget] is None:
+            return None
+        now = time.monotonic()
+        window = self.windows[budget]
+        while len(window) > 0 and window[0] <= now - 60:
+            window.popleft()
+        if len(window) >= self.limits[budget]:
+            self.throttled += 1
+            return error
+        window.append(now)
+        return None
+
+    def pad(self, record: dict):
+        if self.padding is not None:
+            record['padding'] = self.padding
+        return record
+
+    # a new token, valid for token_lifetime seconds when that is set
+    def token(self):
+        token = uuid.uuid4().hex
+        self.tokens[token] = None if self.token_lifetime is None else time.monotonic() + self.token_lifetime
+        return token
+
+    # the error for a request's tokens, CST or OAuth, or None when they are valid
+    def token_error(self, headers):
+        authorization = headers.get('Authorization') or ''
+        token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else headers.get('CST')
+        error = 'error.security.oauth-token-invalid' if authorization else 'error.security.client-token-invalid'
+        if token not in self.tokens:
+            return error
+        expiry = self.tokens[token]
+        if expiry is not None and expiry <= time.monotonic():
+            del self.tokens[token]
+            return error
+        return None
+
+    def oauth_token(self):
+        refresh_token = uuid.uuid4().hex
+        self.refresh_tokens.add(refresh_token)
+        return {'access_token': self.token(), 'refresh_token': refresh_token, 'scope': 'profile', 'token_type': 'Bearer',
+                'expires_in': str(int(self.token_lifetime or 60))}
+
+    def level(self, epic: str, seconds: float):
+        seed = sum(ord(character) for character in epic)
+        return round(100 + seed % 50 + 10 * math.sin(seconds / 3600 + seed) + 2 * math.sin(seconds / 300), 2)
+
+    def bar(self, epic: str, time: datetime, seconds: int):
+        start = time.timestamp()
+        levels = [self.level(epic, start + seconds * step / 4) for step in range(5)]
+        price = lambda level: {'bid': level, 'ask': round(level + 0.5, 2), 'lastTraded': None}
+        return self.pad({'snapshotTime': time.strftime('%Y/%m/%d %H:%M:%S'),
+                         'openPrice': price(levels[0]),
+                         'closePrice': price(levels[-1]),
+                         'highPrice': price(max(levels)),
+                         'lowPrice': price(min(levels)),
+                         'lastTradedVolume': int(start) % 97})
+
+    def bars(self, epic: str, resolution: str, start: datetime, end: datetime):
+        seconds = RESOLUTIONS[resolution]
+        time = datetime.fromtimestamp(math.ceil(start.timestamp() / seconds) * seconds)
+        bars = []
+        while time <= end:
+            bars.append(self.bar(epic, time, seconds))
+            time += timedelta(seconds = seconds)
+        return bars
+
+    def snapshot(self, epic: str):
+        bid = self.level(epic, datetime.now().timestamp())
+        return {'bid': bid, 'offer': round(bid + 0.5, 2), 'high': bid + 5, 'low': bid - 5, 'netChange': 0.1, 'percentageChange': 0.01,
+                'marketStatus': 'TRADEABLE', 'updateTime': datetime.now().strftime('%H:%M:%S'), 'delayTime': 0, 'scalingFactor': 1}
+
+    def navigation_market(self, epic: str):
+        market = dict(self.markets[epic])
+        market.update(self.snapshot(epic))
+        market.update({'otcTradeable': True, 'streamingPricesAvailable': False})
+        return self.pad(market)
+
+    def history(self, kind: str, number: int):
+        time = datetime(2024, 1, 1) + timedelta(hours = number)
+        epic = list(self.markets)[number % len(self.markets)]
+        if kind == 'activities':
+            return self.pad({'date': time.isoformat(), 'epic': epic, 'dealId': 'DIAAA{number:08d}'.format(number = number), 'channel': 'WEB',
+                    'type': 'POSITION', 'status': 'ACCEPTED', 'period': '-', 'description': 'Position opened', 'details': None})
+        return self.pad({'date': time.strftime('%d/%m/%y'), 'dateUtc': time.isoformat(), 'instrumentName': self.markets[epic]['instrumentName'],
+                'period': '-', 'profitAndLoss': 'E{pnl:.2f}'.format(pnl = (number % 13) - 6), 'transactionType': 'DEAL',
+                'reference': 'REF{number:08d}'.format(number = number), 'openLevel': '100', 'closeLevel': '101', 'size': '+1', 'currency': 'GBP', 'cashTransaction': False})
+
+    def deal(self, status: str, epic: str, direction: str, size: float, level: float, affected: list, reason: str = 'SUCCESS', dealStatus: str = 'ACCEPTED'):
+        dealReference = uuid.uuid4().hex[:15].upper()
+        dealId = affected[0]['dealId'] if affected else 'DIAAA' + uuid.uuid4().hex[:10].upper()
+        self.confirms[dealReference] = {'date': datetime.now().isoformat(), 'dealId': dealId, 'dealReference': dealReference, 'dealStatus': dealStatus,
+                                        'direction': direction, 'epic': epic, 'expiry': '-', 'guaranteedStop': False, 'level': level, 'limitDistance': None,
+                                        'limitLevel': None, 'profit': None, 'profitCurrency': None, 'reason': reason, 'size': size, 'status': status,
+                                        'stopDistance': None, 'stopLevel': None, 'trailingStop': False, 'affectedDeals': affected}
+        return dealReference
+
+
+
+class MockIGRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('DELETE' if self.headers.get('_method') == 'DELETE' else 'POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def reply(self, status: int, body: dict, headers: dict = {}):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def dispatch(self, method: str):
+        state = self.server.state
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        if path.startswith(self.server.prefix):
+            path = path[len(self.server.prefix):]
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or 'null') if length > 0 else None
+        with state.lock:
+            state.requests += 1
+        if path == '/session' and method == 'POST':
+            with state.lock:
+                state.logins += 1
+                if self.headers.get('VERSION') == '3':
+                    return self.reply(200, {'clientId': 'MOCK', 'accountId': 'MOCK01', 'timezoneOffset': 0, 'lightstreamerEndpoint': None, 'oauthToken': state.oauth_token()})
+                token = state.token()
+            return self.reply(200, {'accountType': 'CFD', 'currentAccountId': 'MOCK01', 'lightstreamerEndpoint': None},
+                              {'CST': token, 'X-SECURITY-TOKEN': token})
+        if path == '/session/refresh-token' and method == 'POST':
+            with state.lock:
+                if (body or {}).get('refresh_token') not in state.refresh_tokens:
+                    return self.reply(401, {'errorCode': 'error.security.invalid-refresh-token'})
+                state.refresh_tokens.discard(body['refresh_token'])
+                return self.reply(200, state.oauth_token())
+        with state.lock:
+            error = state.token_error(self.headers)
+        if error is not None:
+            return self.reply(401, {'errorCode': error})
+        delay = state.delay(path)
+        if delay > 0:
+            time.sleep(delay)
+        with state.lock:
+            error = state.throttle(method, path)
+        if error is not None:
+            return self.reply(403, {'errorCode': error})
+        for pattern, route in self.server.routes:
+            match = re.fullmatch(pattern, method + ' ' + path)
+            if match:
+                with state.lock:
+                    status, response = route(state, query, body or {}, *match.groups())
+                return self.reply(status, response)
+        self.reply(404, {'errorCode': 'error.mock.unknown-endpoint'})
+
+
+
+def session_details(state, query, body):
+    return 200, {'clientId': 'MOCK', 'accountId': 'MOCK01', 'currency': 'GBP', 'locale': 'en_GB'}
+
+def prices_daterange(state, query, body, epic, resolution, start, end):
+    if epic not in state.markets:
+        return 404, {'errorCode': 'error.error.price-history.io-error'}
+    try:
+        start, end = datetime.strptime(start, DATE_FORMAT), datetime.strptime(end, DATE_FORMAT)
+    except ValueError:
+        return 400, {'errorCode': 'error.malformed.date'}
+    prices = state.bars(epic, resolution, start, end)
+    if state.historical_allowance is None:
+        allowance = {'remainingAllowance': 10000, 'totalAllowance': 10000, 'allowanceExpiry': 604800}
+    elif state.remaining_allowance < len(prices):
+        return 403, {'errorCode': 'error.public-api.exceeded-account-historical-data-allowance'}
+    else:
+        state.remaining_allowance -= len(prices)
+        allowance = {'remainingAllowance': state.remaining_allowance, 'totalAllowance': state.historical_allowance, 'allowanceExpiry': 604800}
+    return 200, {'prices': prices, 'instrumentType': state.markets[epic]['instrumentType'], 'allowance': allowance}
+
+def prices_numpoints(state, query, body, epic, resolution, numpoints):
+    seconds = RESOLUTIONS[resolution]
+    end = datetime.fromtimestamp(math.floor(datetime.now().timestamp() / seconds) * seconds)
+    return prices_daterange(state, query, body, epic, resolution, (end - timedelta(seconds = seconds * (int(numpoints) - 1))).strftime(DATE_FORMAT), end.strftime(DATE_FORMAT))
+
+def markets(state, query, body):
+    if 'searchTerm' in query:
+        term = query['searchTerm'].lower()
+        return 200, {'markets': [state.navigation_market(epic) for epic, market in state.markets.items() if term in market['instrumentName'].lower() or term in epic.lower()]}
+    details = []
+    for epic in query.get('epics', '').split(','):
+        if epic in state.markets:
+            if query.get('filter') == 'SNAPSHOT_ONLY':
+                details.append({'instrument': {'epic': epic}, 'snapshot': state.snapshot(epic)})
+            else:
+                details.append({'instrument': dict(state.markets[epic], currencies = [{'code': state.markets[epic]['currency'], 'isDefault': True}]), 'dealingRules': {'minDealSize': {'unit': 'POINTS', 'value': 0.5}}, 'snapshot': state.snapshot(epic)})
+    return 200, {'marketDetails': details}
+
+def navigation(state, query, body, nodeId = ''):
+    if nodeId not in state.nodes:
+        return 404, {'errorCode': 'error.mock.unknown-node'}
+    node = state.nodes[nodeId]
+    markets = None if node['markets'] is None else [state.navigation_market(epic) for epic in node['markets']]
+    return 200, {'nodes': node['nodes'], 'markets': markets}
+
+def accounts(state, query, body):
+    return 200, {'accounts': [{'accountId': 'MOCK01', 'accountName': 'Mock CFD', 'accountType': 'CFD', 'currency': 'GBP', 'preferred': True, 'status': 'ENABLED',
+                               'balance': {'balance': 10000.0, 'deposit': 500.0, 'profitLoss': 12.5, 'available': 9500.0}}]}
+
+def preferences(state, query, body):
+    return 200, dict(state.preferences)
+
+def update_preferences(state, query, body):
+    state.preferences['trailingStopsEnabled'] = body.get('trailingStopsEnabled') in (True, 'true')
+    return 200, {'status': 'SUCCESS'}
+
+def history(kind):
+    def route(state, query, body):
+        pageSize = int(query.get('pageSize', 50)) or state.history_size
+        if state.max_page_size is not None:
+            pageSize = min(pageSize, state.max_page_size)
+        totalPages = math.ceil(state.history_size / pageSize)
+        pageNumber = int(query.get('pageNumber', 1))
+        records = [state.history(kind, number) for number in range((pageNumber - 1) * pageSize, min(pageNumber * pageSize, state.history_size))]
+        return 200, {kind: records, 'metadata': {'pageData': {'pageNumber': pageNumber, 'pageSize': pageSize, 'totalPages': totalPages}, 'size': len(records)}}
+    return route
+
+def list_positions(state, query, body):
+    return 200, {'positions': [{'position': state.pad(dict(position)), 'market': state.navigation_market(position['epic'])} for position in state.positions.values()]}
+
+def open_position(state, query, body):
+    epic = body.get('epic')
+    if epic not in state.markets:
+        return 200, {'dealReference': state.deal('OPEN', epic, body.get('direction'), body.get('size'), None, [], 'UNKNOWN', 'REJECTED')}
+    snapshot = state.snapshot(epic)
+    level = snapshot['offer'] if body.get('direction') == 'BUY' else snapshot['bid']
+    dealReference = state.deal('OPEN', epic, body.get('direction'), float(body.get('size') or 0), level, [])
+    dealId = state.confirms[dealReference]['dealId']
+    state.confirms[dealReference]['affectedDeals'] = [{'dealId': dealId, 'status': 'OPENED'}]
+    state.positions[dealId] = {'dealId': dealId, 'dealReference': dealReference, 'epic': epic, 'direction': body.get('direction'), 'size': float(body.get('size') or 0),
+                               'level': level, 'currency': body.get('currencyCode') or 'GBP', 'contractSize': 1, 'createdDateUTC': datetime.now().isoformat(),
+                               'limitLevel': body.get('limitLevel'), 'stopLevel': body.get('stopLevel'), 'controlledRisk': False}
+    return 200, {'dealReference': dealReference}
+
+def close_position(state, query, body):
+    position = state.positions.get(body.get('dealId'))
+    if position is None:
+        return 200, {'dealReference': state.deal('FULLY_CLOSED', body.get('epic'), body.get('direction'), body.get('size'), None, [], 'POSITION_NOT_FOUND', 'REJECTED')}
+    size = min(float(body.get('size') or position['size']), position['size'])
+    snapshot = state.snapshot(position['epic'])
+    level = snapshot['bid'] if position['direction'] == 'BUY' else snapshot['offer']
+    position['size'] = round(position['size'] - size, 8)
+    status = 'FULLY_CLOSED' if position['size'] == 0 else 'PARTIALLY_CLOSED'
+    if status == 'FULLY_CLOSED':
+        del state.positions[position['dealId']]
+    return 200, {'dealReference': state.deal(status, position['epic'], body.get('direction'), size, level, [{'dealId': position['dealId'], 'status': status}])}
+
+def update_position(state, query, body, dealId):
+    position = state.positions.get(dealId)
+    if position is None:
+        return 404, {'errorCode': 'error.position.notfound'}
+    position['limitLevel'] = body.get('limitLevel')
+    position['stopLevel'] = body.get('stopLevel')
+    return 200, {'dealReference': state.deal('AMENDED', position['epic'], position['direction'], position['size'], position['level'], [{'dealId': dealId, 'status': 'AMENDED'}])}
+
+def list_working_orders(state, query, body):
+    return 200, {'workingOrders': [{'workingOrderData': dict(order), 'marketData': state.navigation_market(order['epic'])} for order in state.working_orders.values()]}
+
+def create_working_order(state, query, body):
+    dealReference = state.deal('OPEN', body.get('epic'), body.get('direction'), body.get('size'), body.get('level'), [])
+    dealId = state.confirms[dealReference]['dealId']
+    state.working_orders[dealId] = {'dealId': dealId, 'epic': body.get('epic'), 'direction': body.get('direction'), 'orderSize': body.get('size'),
+                                    'orderLevel': body.get('level'), 'orderType': body.get('type'), 'currencyCode': body.get('currencyCode'), 'timeInForce': body.get('timeInForce')}
+    return 200, {'dealReference': dealReference}
+
+def delete_working_order(state, query, body, dealId):
+    order = state.working_orders.pop(dealId, None)
+    if order is None:
+        return 404, {'errorCode': 'error.order.notfound'}
+    return 200, {'dealReference': state.deal('DELETED', order['epic'], order['direction'], order['orderSize'], order['orderLevel'], [{'dealId': dealId, 'status': 'DELETED'}])}
+
+def confirm(state, query, body, dealReference):
+    if dealReference not in state.confirms:
+        return 404, {'errorCode': 'error.confirms.deal-not-found'}
+    return 200, state.confirms[dealReference]
+
+def list_watchlists(state, query, body):
+    return 200, {'watchlists': [{'id': watchlistId, 'name': watchlist['name'], 'editable': True, 'deleteable': True, 'defaultSystemWatchlist': False}
+                                for watchlistId, watchlist in state.watchlists.items()]}
+
+def create_watchlist(state, query, body):
+    watchlistId = str(len(state.watchlists) + 1000)
+    state.watchlists[watchlistId] = {'name': body.get('name'), 'epics': list(body.get('epics') or [])}
+    return 200, {'watchlistId': watchlistId, 'status': 'SUCCESS'}
+
+def get_watchlist(state, query, body, watchlistId):
+    if watchlistId not in state.watchlists:
+        return 404, {'errorCode': 'error.watchlists.notfound'}
+    return 200, {'markets': [state.navigation_market(epic) for epic in state.watchlists[watchlistId]['epics'] if epic in state.markets]}
+
+def add_to_watchlist(state, query, body, watchlistId):
+    if watchlistId not in state.watchlists:
+        return 404, {'errorCode': 'error.watchlists.notfound'}
+    state.watchlists[watchlistId]['epics'].append(body.get('epic'))
+    return 200, {'status': 'SUCCESS'}
+
+def remove_from_watchlist(state, query, body, watchlistId, epic):
+    if watchlistId not in state.watchlists or epic not in state.watchlists[watchlistId]['epics']:
+        return 404, {'errorCode': 'error.watchlists.notfound'}
+    state.watchlists[watchlistId]['epics'].remove(epic)
+    return 200, {'status': 'SUCCESS'}
+
+def delete_watchlist(state, query, body, watchlistId):
+    if state.watchlists.pop(watchlistId, None) is None:
+        return 404, {'errorCode': 'error.watchlists.notfound'}
+    return 200, {'status': 'SUCCESS'}
+
+ROUTES = [(r'GET /session', session_details),
+          (r'GET /prices/([^/]+)/([A-Z_0-9]+)/([^/]+)/([^/]+)', prices_daterange),
+          (r'GET /prices/([^/]+)/([A-Z_0-9]+)/(\d+)', prices_numpoints),
+          (r'GET /markets', markets),
+          (r'GET /marketnavigation', navigation),
+          (r'GET /marketnavigation/([^/]+)', navigation),
+          (r'GET /accounts', accounts),
+          (r'GET /accounts/preferences', preferences),
+          (r'PUT /accounts/preferences', update_preferences),
+          (r'GET /history/activity', history('activities')),
+          (r'GET /history/transactions', history('transactions')),
+          (r'GET /positions', list_positions),
+          (r'POST /positions/otc', open_position),
+          (r'DELETE /positions/otc', close_position),
+          (r'PUT /positions/otc/([^/]+)', update_position),
+          (r'GET /workingorders', list_working_orders),
+          (r'POST /workingorders/otc', create_working_order),
+          (r'DELETE /workingorders/otc/([^/]+)', delete_working_order),
+          (r'GET /confirms/([^/]+)', confirm),
+          (r'GET /watchlists', list_watchlists),
+          (r'POST /watchlists', create_watchlist),
+          (r'GET /watchlists/([^/]+)', get_watchlist),
+          (r'PUT /watchlists/([^/]+)', add_to_watchlist),
+          (r'DELETE /watchlists/([^/]+)/([^/]+)', remove_from_watchlist),
+          (r'DELETE /watchlists/([^/]+)', delete_watchlist)]
+
+
+
+# serves the mock gateway on a background thread. port 0 picks a free port; base_url is what to give IGREST or AsyncIGREST
+class MockIGServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, state: MockIGState = None):
+        self.server = ThreadingHTTPServer((host, port), MockIGRequestHandler)
+        self.server.daemon_threads = True
+        self.server.state = state if state is not None else MockIGState()
+        self.server.routes = ROUTES
+        self.server.prefix = '/gateway/deal'
+        self.thread = None
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{host}:{port}/gateway/deal'.format(host = host, port = port)
+
+    def start(self):
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exception):
+        self.stop()
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    server = MockIGServer(port = port, state = MockIGState(latency = latency))
+    print('serving the mock IG gateway at', server.base_url)
+    server.server.serve_forever()
@@ -0,0 +1,162 @@
+import json
+import numpy as np
+import pandas as pd
+import IgPriceDecoder
+from IgPriceCache import PRICE_COLUMNS, FRAME_COLUMNS, FRAME_ORDER, prices_frame, volume_column
+
+# pyarrow is only needed for the arrow backend
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+BACKENDS = ['pandas', 'arrow', 'numpy']
+
+# with categorical = True, a string column is made categorical when it holds at most this many distinct values per row
+CATEGORICAL_RATIO = 0.5
+
+# yields the (column, value) pairs of a record, nested objects flattened into dotted column names as pd.json_normalize names them
+def flatten(record: dict, prefix: str = ''):
+    for key, value in record.items():
+        if isinstance(value, dict):
+            yield from flatten(value, prefix + key + '.')
+        else:
+            yield prefix + key, value
+
+# the records' values column by column, None where a record lacks the column, with the columns in the order they first appear
+def columns_of(records: list):
+    columns = {}
+    for row, record in enumerate(records):
+        for name, value in flatten(record):
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [None] * len(records)
+            column[row] = value
+    return columns
+
+
+
+# the container the market and account data methods return their tables in. 'pandas' returns DataFrames, 'arrow' pyarrow
+# Tables and 'numpy' a dict of one NumPy array per column. prices are decoded straight into a float block whose columns the
+# arrow and numpy backends hand out without copying, and records are gathered column by column and typed once per column,
+# so neither backend builds a pandas object on the way. float32 halves the size of the price and numeric columns, and
+# categorical, True or a list of columns, dictionary encodes string columns (numpy has no categorical type, so there they
+# become fixed width string arrays instead). the pandas backend without either option returns exactly what it always has
+class OutputBackend:
+    def __init__(self, backend: str = 'pandas', float32: bool = False, categorical = False):
+        if backend not in BACKENDS:
+            raise ValueError('backend must be one of {backends}, not {backend}'.format(backends = BACKENDS, backend = backend))
+        if backend == 'arrow' and pa is None:
+            raise ImportError('the arrow backend needs pyarrow installed')
+        self.backend = backend
+        self.float32 = float32
+        self.categorical = categorical
+        self.dtype = np.float32 if float32 else np.float64
+        self.native = backend == 'pandas' and not float32 and not categorical
+
+    def prices(self, prices: list):
+        return self.prices_from_arrays(*IgPriceDecoder.decode_prices(prices, self.dtype))
+
+    # times and values as IgPriceDecoder.decode_prices and PriceCache.load_arrays return them
+    def prices_from_arrays(self, times: np.ndarray, values: np.ndarray):
+        values = values.astype(self.dtype, copy = False)
+        if self.backend == 'pandas':
+            return prices_frame(times, values)
+        # one transposing copy leaves every price column contiguous. volume is int64 unless a bar lacks it, as with records
+        columns = {'DateTime': times}
+        columns.update(zip(FRAME_COLUMNS, np.ascontiguousarray(values[:, FRAME_ORDER].T)))
+        columns['volume'] = volume_column(columns['volume'])
+        if self.backend == 'numpy':
+            return columns
+        return pa.table({name: pa.array(column) for name, column in columns.items()})
+
+    # prices of many epics, given as a dict of epic to the prices this backend returned for it. pandas indexes them by
+    # (epic, DateTime), the other backends add an epic column
+    def concat_prices(self, prices: dict):
+        epics = list(prices.keys())
+        if self.backend == 'pandas':
+            if len(epics) == 0:
+                empty = self.prices_from_arrays(np.empty(0, dtype = 'datetime64[ns]'), np.empty((0, len(PRICE_COLUMNS)), dtype = self.dtype))
+                return empty.set_index(pd.MultiIndex.from_arrays([[], empty.index], names = ['epic', 'DateTime']))
+            return pd.concat(list(prices.values()), keys = epics, names = ['epic', 'DateTime'])
+        if len(epics) == 0:
+            tables = [self.prices_from_arrays(np.empty(0, dtype = 'datetime64[ns]'), np.empty((0, len(PRICE_COLUMNS)), dtype = self.dtype))]
+        else:
+            tables = list(prices.values())
+        lengths = [len(table['DateTime']) for table in tables]
+        codes = np.repeat(np.arange(len(epics), dtype = np.int32), lengths)
+        if self.backend == 'numpy':
+            columns = {'epic': np.array(epics, dtype = str if self.categorical else object)[codes]}
+            columns.update((name, np.concatenate([table[name] for table in tables])) for name in tables[0])
+            return columns
+        if self.categorical:
+            epic = pa.DictionaryArray.from_arrays(pa.array(codes), pa.array(epics, type = pa.string()))
+        else:
+            epic = pa.array(np.array(epics, dtype = object)[codes], type = pa.string())
+        return pa.concat_tables(tables).add_column(0, 'epic', epic)
+
+    def is_categorical(self, name: str, values: list):
+        if isinstance(self.categorical, bool):
+            return self.categorical and len(values) > 1 and len(set(values)) <= len(values) * CATEGORICAL_RATIO
+        return name in self.categorical
+
+    # one column of records typed by the values it holds: booleans, int64 (float when a record lacks the value), floats, strings,
+    # and anything else (lists, mixed types) as objects, or for arrow as JSON text
+    def column(self, name: str, values: list):
+        kinds = {type(value) for value in values if value is not None}
+        missing = len(kinds) == 0 or any(value is None for value in values)
+        if self.backend == 'arrow':
+            if len(kinds) == 0:
+                return pa.nulls(len(values))
+            if kinds == {bool}:
+                return pa.array(values, type = pa.bool_())
+            if kinds == {int}:
+                return pa.array(values, type = pa.int64())
+            if kinds <= {int, float}:
+                return pa.array(values, type = pa.float32() if self.float32 else pa.float64())
+            if kinds == {str}:
+                array = pa.array(values, type = pa.string())
+                return array.dictionary_encode() if self.is_categorical(name, values) else array
+            return pa.array([None if value is None else json.dumps(value) for value in values], type = pa.string())
+        if kinds == {bool} and not missing:
+            return np.array(values, dtype = bool)
+        if kinds == {int} and not missing:
+            return np.array(values, dtype = np.int64)
+        if len(kinds) > 0 and kinds <= {int, float}:
+            return np.array([np.nan if value is None else value for value in values], dtype = self.dtype)
+        if kinds == {str} and self.is_categorical(name, values):
+            if self.backend == 'pandas':
+                return pd.Categorical(values)
+            if not missing:
+                return np.array(values, dtype = str)
+        # filled one by one, as numpy would otherwise take lists of equal length for a further dimension
+        array = np.empty(len(values), dtype = object)
+        for row, value in enumerate(values):
+            array[row] = value
+        return array
+
+    # a table of JSON records, such as the markets of a search or the positions of an account. with normalize, the native pandas
+    # backend builds it with pd.json_normalize, otherwise with pd.DataFrame, which keeps nested objects as they are. rename maps
+    # flattened column names to the names returned
+    def records(self, records: list, normalize: bool = True, rename: dict = None):
+        if self.native:
+            table = pd.json_normalize(records) if normalize else pd.DataFrame(records)
+            return table if rename is None else table.rename(columns = rename)
+        columns = {rename.get(name, name) if rename else name: self.column(name, values) for name, values in columns_of(records).items()}
+        if self.backend == 'pandas':
+            return pd.DataFrame(columns, index = pd.RangeIndex(len(records)), copy = False)
+        if self.backend == 'numpy':
+            return columns
+        return pa.table(columns) if len(columns) > 0 else pa.table({})
+
+PANDAS = OutputBackend()
+
+# the pandas DataFrame of a table returned by any backend, for code which works on frames whatever the backend its caller chose
+def to_pandas(table):
+    if isinstance(table, pd.DataFrame):
+        return table
+    if isinstance(table, dict):
+        return pd.DataFrame(table)
+    if pa is not None and isinstance(table, pa.Table):
+        return table.to_pandas()
+    raise ValueError('expected a table returned by an output backend, got {kind}'.format(kind = type(table).__name__))
@@ -0,0 +1,320 @@
+import logging
+import threading
+import pandas as pd
+import IgOutput
+from datetime import datetime
+from IGCustomPlatform import IGDealer
+
+logger = logging.getLogger(__name__)
+
+# the fields of a position or working order which reconciliation compares with the server
+POSITION_FIELDS = ['epic', 'direction', 'size', 'level', 'currency', 'contractSize', 'limitLevel', 'stopLevel']
+ORDER_FIELDS = ['epic', 'direction', 'size', 'level', 'limitDistance', 'stopDistance']
+
+# deal statuses, from a confirmation or its affected deals, by what they do to the deal
+OPENED = ['OPEN', 'OPENED']
+CLOSED = ['CLOSED', 'FULLY_CLOSED', 'DELETED']
+
+def value(record: dict, key: str):
+    item = record.get(key)
+    if isinstance(item, float) and item != item:
+        return None
+    return item
+
+def signed(direction: str, size: float):
+    return size if direction == 'BUY' else -size
+
+
+
+# local copy of the open positions and working orders of an IGDealer's account. it is seeded from list_positions and
+# list_working_orders, follows the deals the dealer makes through its deal listeners, and is put right by reconcile, which
+# diffs the local book against the server and can run periodically in the background. lookups by dealId and epic, and the
+# net exposure per epic and per currency, are kept up to date as deals change and never call the API
+class PositionBook:
+    def __init__(self, dealer: IGDealer, seed: bool = True):
+        self.dealer = dealer
+        self.lock = threading.RLock()
+        self.positions = {}
+        self.orders = {}
+        self.positions_by_epic = {}
+        self.orders_by_epic = {}
+        self.net_size = {}
+        self.currency_exposure = {}
+        self.instruments = {}
+        self.confirmations = 0
+        self.touched = {}
+        self.reconciliations = 0
+        self.corrections = 0
+        self.reconcile_failures = 0
+        self.reconciled = None
+        self.reconcile_stop = None
+        dealer.deal_listeners.append(self.apply_confirmation)
+        if seed:
+            self.reconcile()
+
+    def position_records(self, markets: pd.DataFrame, positions: pd.DataFrame):
+        records = {}
+        for market, position in zip(markets.to_dict('records'), positions.to_dict('records')):
+            record = {'dealId': position['dealId'],
+                      'epic': market['epic'],
+                      'expiry': value(market, 'expiry'),
+                      'instrumentName': value(market, 'instrumentName'),
+                      'direction': position['direction'],
+                      'size': float(position['size']),
+                      'level': value(position, 'level'),
+                      'currency': value(position, 'currency'),
+                      'contractSize': value(position, 'contractSize') or 1,
+                      'limitLevel': value(position, 'limitLevel'),
+                      'stopLevel': value(position, 'stopLevel'),
+                      'createdDateUTC': value(position, 'createdDateUTC')}
+            records[record['dealId']] = record
+        return records
+
+    def order_records(self, marketData: pd.DataFrame, orders: pd.DataFrame):
+        records = {}
+        for market, order in zip(marketData.to_dict('records'), orders.to_dict('records')):
+            record = {'dealId': order['dealId'],
+                      'epic': market['epic'],
+                      'expiry': value(market, 'expiry'),
+                      'instrumentName': value(market, 'instrumentName'),
+                      'direction': order['direction'],
+                      'size': value(order, 'orderSize'),
+                      'level': value(order, 'orderLevel'),
+                      'orderType': value(order, 'orderType'),
+                      'currency': value(order, 'currencyCode'),
+                      'timeInForce': value(order, 'timeInForce'),
+                      'goodTillDate': value(order, 'goodTillDate'),
+                      'limitDistance': value(order, 'limitDistance'),
+                      'stopDistance': value(order, 'stopDistance')}
+            records[record['dealId']] = record
+        return records
+
+    def add_position(self, record: dict):
+        self.remove_position(record['dealId'])
+        epic = record['epic']
+        self.positions[record['dealId']] = record
+        self.positions_by_epic.setdefault(epic, set()).add(record['dealId'])
+        if record['currency'] is not None:
+            self.instruments[epic] = (record['currency'], record['contractSize'])
+        size = signed(record['direction'], record['size'])
+        self.net_size[epic] = self.net_size.get(epic, 0) + size
+        if record['level'] is not None:
+            self.currency_exposure[record['currency']] = round(self.currency_exposure.get(record['currency'], 0) + size * record['contractSize'] * record['level'], 8)
+
+    def remove_position(self, dealId: str):
+        record = self.positions.pop(dealId, None)
+        if record is None:
+            return None
+        epic = record['epic']
+        self.positions_by_epic[epic].discard(dealId)
+        if len(self.positions_by_epic[epic]) == 0:
+            del self.positions_by_epic[epic]
+        size = signed(record['direction'], record['size'])
+        self.net_size[epic] -= size
+        if epic not in self.positions_by_epic:
+            del self.net_size[epic]
+        if record['level'] is not None:
+            self.currency_exposure[record['currency']] = round(self.currency_exposure[record['currency']] - size * record['contractSize'] * record['level'], 8)
+        return record
+
+    def add_order(self, record: dict):
+        self.remove_order(record['dealId'])
+        self.orders[record['dealId']] = record
+        self.orders_by_epic.setdefault(record['epic'], set()).add(record['dealId'])
+
+    def remove_order(self, dealId: str):
+        record = self.orders.pop(dealId, None)
+        if record is None:
+            return None
+        self.orders_by_epic[record['epic']].discard(dealId)
+        if len(self.orders_by_epic[record['epic']]) == 0:
+            del self.orders_by_epic[record['epic']]
+        return record
+
+    # deal listener for the dealer. a confirmation can affect several deals (opening against an opposite position closes it),
+    # so each affected deal is applied on its own. whatever a confirmation does not say, such as the currency of a new
+    # position in an epic the book has not seen yet, is filled in by the next reconcile
+    def apply_confirmation(self, kind: str, confirmation):
+        if isinstance(confirmation, pd.DataFrame):
+            confirmation = confirmation.iloc[0].to_dict()
+        if confirmation.get('dealStatus') != 'ACCEPTED' or kind not in ['position', 'workingorder']:
+            return
+        affected = value(confirmation, 'affectedDeals')
+        if not isinstance(affected, list) or len(affected) == 0:
+            affected = [{'dealId': confirmation['dealId'], 'status': confirmation['status']}]
+        with self.lock:
+            self.confirmations += 1
+            for deal in affected:
+                self.touched[deal['dealId']] = self.confirmations
+                if kind == 'position':
+                    self.apply_position_change(deal['dealId'], deal['status'], confirmation)
+                else:
+                    self.apply_order_change(deal['dealId'], deal['status'], confirmation)
+
+    def apply_position_change(self, dealId: str, status: str, confirmation: dict):
+        if status in CLOSED:
+            self.remove_position(dealId)
+            return
+        record = self.positions.get(dealId)
+        if status in OPENED and record is None:
+            epic = confirmation['epic']
+            currency, contractSize = self.instruments.get(epic, (None, 1))
+            record = {'dealId': dealId,
+                      'epic': epic,
+                      'expiry': value(confirmation, 'expiry'),
+                      'instrumentName': None,
+                      'direction': confirmation['direction'],
+                      'size': float(confirmation['size']),
+                      'level': value(confirmation, 'level'),
+                      'currency': currency,
+                      'contractSize': contractSize,
+                      'limitLevel': value(confirmation, 'limitLevel'),
+                      'stopLevel': value(confirmation, 'stopLevel'),
+                      'createdDateUTC': value(confirmation, 'date')}
+        elif status == 'PARTIALLY_CLOSED' and record is not None:
+            record = dict(record, size = round(record['size'] - float(confirmation['size']), 8))
+        elif status == 'AMENDED' and record is not None:
+            record = dict(record, limitLevel = value(confirmation, 'limitLevel'), stopLevel = value(confirmation, 'stopLevel'))
+        else:
+            return
+        self.add_position(record)
+
+    def apply_order_change(self, dealId: str, status: str, confirmation: dict):
+        if status in CLOSED:
+            self.remove_order(dealId)
+            return
+        record = self.orders.get(dealId)
+        if status in OPENED and record is None:
+            epic = confirmation['epic']
+            record = {'dealId': dealId,
+                      'epic': epic,
+                      'expiry': value(confirmation, 'expiry'),
+                      'instrumentName': None,
+                      'direction': confirmation['direction'],
+                      'size': value(confirmation, 'size'),
+                      'level': value(confirmation, 'level'),
+                      'orderType': None,
+                      'currency': self.instruments.get(epic, (None, 1))[0],
+                      'timeInForce': None,
+                      'goodTillDate': None,
+                      'limitDistance': value(confirmation, 'limitDistance'),
+                      'stopDistance': value(confirmation, 'stopDistance')}
+        elif status == 'AMENDED' and record is not None:
+            record = dict(record, level = value(confirmation, 'level'), limitDistance = value(confirmation, 'limitDistance'), stopDistance = value(confirmation, 'stopDistance'))
+        else:
+            return
+        self.add_order(record)
+
+    # downloads the positions and working orders and applies only the deals which differ from the local book: deals missing
+    # locally are added, deals gone from the server removed, and deals whose compared fields differ replaced.
+    # returns one row per correction made. deals confirmed while the download was in flight are left as they are, since
+    # the server's answer may predate the confirmation
+    def reconcile(self, session = None):
+        with self.lock:
+            generation = self.confirmations
+        markets, positions = self.dealer.list_positions(session = session, output = IgOutput.PANDAS)
+        marketData, orders = self.dealer.list_working_orders(session = session, output = IgOutput.PANDAS)
+        server_positions = self.position_records(markets, positions)
+        server_orders = self.order_records(marketData, orders)
+        with self.lock:
+            skip = {dealId for dealId, touched in self.touched.items() if touched > generation}
+            self.touched = {dealId: self.touched[dealId] for dealId in skip}
+            changes = self.diff('position', self.positions, server_positions, POSITION_FIELDS, skip, self.add_position, self.remove_position)
+            changes.extend(self.diff('workingorder', self.orders, server_orders, ORDER_FIELDS, skip, self.add_order, self.remove_order))
+            self.reconciliations += 1
+            self.corrections += len(changes)
+            self.reconciled = datetime.now()
+        return pd.DataFrame(changes, columns = ['kind', 'dealId', 'epic', 'change'])
+
+    def diff(self, kind: str, local: dict, server: dict, fields: list, skip: set, add, remove):
+        changes = []
+        for dealId in [dealId for dealId in local if dealId not in server and dealId not in skip]:
+            changes.append((kind, dealId, remove(dealId)['epic'], 'removed'))
+        for dealId, record in server.items():
+            current = local.get(dealId)
+            if dealId in skip:
+                continue
+            elif current is None:
+                change = 'added'
+            elif any(current[field] != record[field] for field in fields):
+                change = 'changed'
+            elif current != record:
+                # same deal, only descriptive fields such as the currency or instrument name were unknown locally
+                local[dealId].update(record)
+                continue
+            else:
+                continue
+            add(record)
+            changes.append((kind, dealId, record['epic'], change))
+        return changes
+
+    # a failing reconciliation is logged and counted in reconcile_failures, and the next one is tried after interval
+    def start_reconciling(self, interval: float = 5):
+        self.stop_reconciling()
+        stop = threading.Event()
+        session = self.dealer.worker_session()
+        def reconcile():
+            while not stop.wait(interval):
+                try:
+                    session.headers.update(self.dealer.session.headers)
+                    self.reconcile(session = session)
+                except Exception:
+                    self.reconcile_failures += 1
+                    logger.exception('reconcile failed')
+        self.reconcile_stop = stop
+        threading.Thread(target = reconcile, daemon = True).start()
+
+    def stop_reconciling(self):
+        if self.reconcile_stop is not None:
+            self.reconcile_stop.set()
+            self.reconcile_stop = None
+
+    def close(self):
+        self.stop_reconciling()
+        if self.apply_confirmation in self.dealer.deal_listeners:
+            self.dealer.deal_listeners.remove(self.apply_confirmation)
+
+    def position(self, dealId: str):
+        with self.lock:
+            record = self.positions.get(dealId)
+            return None if record is None else dict(record)
+
+    def positions_for(self, epic: str):
+        with self.lock:
+            return [dict(self.positions[dealId]) for dealId in self.positions_by_epic.get(epic, [])]
+
+    def order(self, dealId: str):
+        with self.lock:
+            record = self.orders.get(dealId)
+            return None if record is None else dict(record)
+
+    def orders_for(self, epic: str):
+        with self.lock:
+            return [dict(self.orders[dealId]) for dealId in self.orders_by_epic.get(epic, [])]
+
+    # signed size held in an epic, positive when net long
+    def exposure(self, epic: str):
+        with self.lock:
+            return self.net_size.get(epic, 0)
+
+    # signed size times contract size times opening level, summed over the positions held in each currency
+    def exposure_by_currency(self):
+        with self.lock:
+            return dict(self.currency_exposure)
+
+    def positions_frame(self):
+        with self.lock:
+            return pd.DataFrame(list(self.positions.values()))
+
+    def orders_frame(self):
+        with self.lock:
+            return pd.DataFrame(list(self.orders.values()))
+
+    def exposure_frame(self):
+        with self.lock:
+            rows = [{'epic': epic,
+                     'currency': self.instruments.get(epic, (None, 1))[0],
+                     'net_size': self.net_size[epic],
+                     'positions': len(self.positions_by_epic[epic]),
+                     'working_orders': len(self.orders_by_epic.get(epic, []))} for epic in self.positions_by_epic]
+        return pd.DataFrame(rows, columns = ['epic', 'currency', 'net_size', 'positions', 'working_orders'])
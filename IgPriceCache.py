@@ -0,0 +1,176 @@
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+# price columns held for every (epic, resolution) pair, named as in IGMarketData.prices_as_dataframe
+PRICE_COLUMNS = ['open_bid', 'open_ask', 'high_bid', 'high_ask', 'low_bid', 'low_ask', 'close_bid', 'close_ask', 'volume']
+
+# the columns of the price tables handed to callers, in the order json_normalize put IG's prices in, the volume first and
+# then the prices in the order IG returns them, and where each column is in PRICE_COLUMNS
+FRAME_COLUMNS = ['volume', 'open_bid', 'open_ask', 'close_bid', 'close_ask', 'high_bid', 'high_ask', 'low_bid', 'low_ask']
+FRAME_ORDER = [PRICE_COLUMNS.index(column) for column in FRAME_COLUMNS]
+
+# length of one bar for each IG resolution. WEEK and MONTH use their longest possible length
+RESOLUTIONS = {'SECOND': timedelta(seconds = 1),
+               'MINUTE': timedelta(minutes = 1),
+               'MINUTE_2': timedelta(minutes = 2),
+               'MINUTE_3': timedelta(minutes = 3),
+               'MINUTE_5': timedelta(minutes = 5),
+               'MINUTE_10': timedelta(minutes = 10),
+               'MINUTE_15': timedelta(minutes = 15),
+               'MINUTE_30': timedelta(minutes = 30),
+               'HOUR': timedelta(hours = 1),
+               'HOUR_2': timedelta(hours = 2),
+               'HOUR_3': timedelta(hours = 3),
+               'HOUR_4': timedelta(hours = 4),
+               'DAY': timedelta(days = 1),
+               'WEEK': timedelta(days = 7),
+               'MONTH': timedelta(days = 31)}
+
+
+
+# on-disk columnar store of historical prices, one directory per (epic, resolution).
+# each directory holds the sorted bar times and values as .npy arrays (read back memory-mapped),
+# plus the list of time intervals which have already been downloaded in full
+class PriceCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        os.makedirs(self.path, exist_ok = True)
+
+    def key_path(self, epic: str, resolution: str):
+        return os.path.join(self.path, epic, resolution)
+
+    def lock(self, epic: str, resolution: str):
+        with self.locks_lock:
+            if (epic, resolution) not in self.locks:
+                self.locks[(epic, resolution)] = threading.RLock()
+            return self.locks[(epic, resolution)]
+
+    def intervals(self, epic: str, resolution: str):
+        intervals_file = os.path.join(self.key_path(epic, resolution), 'intervals.json')
+        if not os.path.exists(intervals_file):
+            return []
+        with open(intervals_file) as f:
+            return [(np.datetime64(start, 'ns'), np.datetime64(end, 'ns')) for start, end in json.load(f)]
+
+    def missing_intervals(self, epic: str, resolution: str, start_date: datetime, end_date: datetime):
+        start = np.datetime64(start_date, 'ns')
+        end = np.datetime64(end_date, 'ns')
+        missing = []
+        with self.lock(epic, resolution):
+            for held_start, held_end in self.intervals(epic, resolution):
+                if held_end < start:
+                    continue
+                if held_start > end:
+                    break
+                if held_start > start:
+                    missing.append((start, held_start))
+                start = max(start, held_end)
+        if start < end:
+            missing.append((start, end))
+        return [(pd.Timestamp(gap_start).to_pydatetime(), pd.Timestamp(gap_end).to_pydatetime()) for gap_start, gap_end in missing]
+
+    def store(self, epic: str, resolution: str, prices: pd.DataFrame, start_date: datetime = None, end_date: datetime = None):
+        times = prices.index.values.astype('datetime64[ns]')
+        values = prices.reindex(columns = PRICE_COLUMNS).to_numpy(dtype = np.float64)
+        self.store_arrays(epic, resolution, times, values, start_date, end_date)
+
+    # times are datetime64 bar times and values one row of PRICE_COLUMNS per bar, as IgPriceDecoder.decode_prices returns them
+    def store_arrays(self, epic: str, resolution: str, times: np.ndarray, values: np.ndarray, start_date: datetime = None, end_date: datetime = None):
+        times = times.astype('datetime64[ns]').view('int64')
+        values = values.astype(np.float64, copy = False)
+        with self.lock(epic, resolution):
+            held_times, held_values = self.read_arrays(epic, resolution)
+            if held_times is not None:
+                # newer downloads win over what is already held, as the last bar of an earlier download may have been incomplete
+                times = np.concatenate([times, held_times])
+                values = np.concatenate([values, held_values])
+                del held_times, held_values
+            times, first = np.unique(times, return_index = True)
+            values = values[first]
+            key_path = self.key_path(epic, resolution)
+            os.makedirs(key_path, exist_ok = True)
+            self.write_array(os.path.join(key_path, 'times.npy'), times)
+            self.write_array(os.path.join(key_path, 'values.npy'), values)
+            if start_date is not None and end_date is not None:
+                self.add_interval(epic, resolution, start_date, end_date)
+
+    # bounds are held to the whole second, as the gaps between them are downloaded by dates IG takes to the second
+    def add_interval(self, epic: str, resolution: str, start_date: datetime, end_date: datetime):
+        # the bar in progress is not complete, so it is not counted as held
+        end_date = min(end_date, datetime.now() - RESOLUTIONS.get(resolution, timedelta(0)))
+        start = np.datetime64(start_date, 's').astype('datetime64[ns]')
+        end = np.datetime64(end_date, 's').astype('datetime64[ns]')
+        if end <= start:
+            return
+        intervals = self.intervals(epic, resolution)
+        intervals.append((start, end))
+        intervals.sort()
+        merged = [intervals[0]]
+        for start, end in intervals[1:]:
+            if start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        intervals_file = os.path.join(self.key_path(epic, resolution), 'intervals.json')
+        with open(intervals_file + '.tmp', 'w') as f:
+            json.dump([[str(start), str(end)] for start, end in merged], f)
+        os.replace(intervals_file + '.tmp', intervals_file)
+
+    def read_arrays(self, epic: str, resolution: str):
+        key_path = self.key_path(epic, resolution)
+        if not os.path.exists(os.path.join(key_path, 'times.npy')):
+            return None, None
+        times = np.load(os.path.join(key_path, 'times.npy'), mmap_mode = 'r')
+        values = np.load(os.path.join(key_path, 'values.npy'), mmap_mode = 'r')
+        return times, values
+
+    def write_array(self, file: str, array: np.ndarray):
+        with open(file + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(file + '.tmp', file)
+
+    def load(self, epic: str, resolution: str, start_date: datetime = None, end_date: datetime = None):
+        times, values = self.load_arrays(epic, resolution, start_date, end_date)
+        return prices_frame(times, values)
+
+    # the datetime64 bar times and the values of the bars between start_date and end_date, copied out of the memory map
+    def load_arrays(self, epic: str, resolution: str, start_date: datetime = None, end_date: datetime = None):
+        with self.lock(epic, resolution):
+            times, values = self.read_arrays(epic, resolution)
+            if times is None:
+                times = np.empty(0, dtype = np.int64)
+                values = np.empty((0, len(PRICE_COLUMNS)), dtype = np.float64)
+            first = 0 if start_date is None else np.searchsorted(times, np.datetime64(start_date, 'ns').astype(np.int64), side = 'left')
+            last = len(times) if end_date is None else np.searchsorted(times, np.datetime64(end_date, 'ns').astype(np.int64), side = 'right')
+            return np.array(times[first:last]).view('datetime64[ns]'), np.array(values[first:last])
+
+    def clear(self, epic: str, resolution: str):
+        with self.lock(epic, resolution):
+            key_path = self.key_path(epic, resolution)
+            for file in ['times.npy', 'values.npy', 'intervals.json']:
+                if os.path.exists(os.path.join(key_path, file)):
+                    os.remove(os.path.join(key_path, file))
+
+# the DataFrame of the bar times and the values held in PRICE_COLUMNS, with the columns and types of the json_normalize frame
+# IGMarketData.prices_as_dataframe returned before the prices were decoded into arrays: FRAME_COLUMNS, and an int64 volume
+def prices_frame(times: np.ndarray, values: np.ndarray):
+    frame = pd.DataFrame(values[:, FRAME_ORDER[1:]], index = pd.DatetimeIndex(times, name = 'DateTime'), columns = FRAME_COLUMNS[1:], copy = False)
+    frame.insert(0, 'volume', volume_column(values[:, FRAME_ORDER[0]], nullable = True))
+    return frame
+
+# IG's volumes are whole numbers, held as floats with the prices. they are int64 again unless a bar lacks its volume, when they
+# are nullable Int64 with nullable, and floats otherwise. volumes which are not whole, as given to IgResample.resample_frame,
+# are left as they are
+def volume_column(volume: np.ndarray, nullable: bool = False):
+    missing = np.isnan(volume)
+    if not np.array_equal(volume[~missing], np.round(volume[~missing])):
+        return volume
+    if missing.any():
+        return pd.array(volume, dtype = 'Int64') if nullable else volume
+    return volume.astype(np.int64)
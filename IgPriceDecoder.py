@@ -0,0 +1,27 @@
+import numpy as np
+import IgPriceCache
+from IgPriceCache import PRICE_COLUMNS
+
+# decodes the 'prices' list of an IG /prices response in a single pass, straight into a preallocated float64 block
+# with one column per PRICE_COLUMNS entry and a datetime64 index. the lastTraded prices are never read.
+# snapshot times come as 'yyyy/MM/dd HH:mm:ss' (or ISO format from v3), so they only need '/' swapped for numpy to parse them.
+# dtype can be np.float32 to halve the size of the block
+def decode_prices(prices: list, dtype: type = np.float64):
+    times = [None] * len(prices)
+    def rows():
+        for i, price in enumerate(prices):
+            times[i] = price['snapshotTime'].replace('/', '-')
+            open_price = price['openPrice']
+            high_price = price['highPrice']
+            low_price = price['lowPrice']
+            close_price = price['closePrice']
+            yield (open_price['bid'], open_price['ask'],
+                   high_price['bid'], high_price['ask'],
+                   low_price['bid'], low_price['ask'],
+                   close_price['bid'], close_price['ask'],
+                   price['lastTradedVolume'])
+    values = np.fromiter(rows(), dtype = np.dtype((dtype, len(PRICE_COLUMNS))), count = len(prices))
+    return np.array(times, dtype = 'datetime64[ns]'), values
+
+def prices_frame(prices: list):
+    return IgPriceCache.prices_frame(*decode_prices(prices))
@@ -0,0 +1,244 @@
+import time
+import asyncio
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from requests import RequestException
+from IGCustomPlatform import IGMarketData, IGException
+from IgPortfolio import PositionBook
+
+logger = logging.getLogger(__name__)
+
+# IG's market statuses, held in the quote table as their index here. statuses IG adds later are appended as they are met
+STATUSES = ['TRADEABLE', 'CLOSED', 'EDITS_ONLY', 'OFFLINE', 'ON_AUCTION', 'ON_AUCTION_NO_EDITS', 'SUSPENDED']
+
+
+
+# polls the snapshots of a set of epics through /markets, in requests of up to chunk_size epics, as a stand in for IG's
+# streaming prices. epics are polled every fast_interval seconds while they have moved within the last hot_for seconds or
+# are held in the given PositionBook, and every slow_interval seconds otherwise, so quiet markets cost few requests.
+# the latest bid, offer and status of every epic are held in one array per field, each snapshot is compared with them in a
+# single vectorized pass, and only the epics which changed are passed on: to every listener in listeners, called with one
+# dict per change, and to every stream() being iterated. failed polls and listeners are logged and counted in status().
+# snapshots are always fetched from IG, past any response cache or single flight the platform's api handler has, as either
+# would hand out prices from an earlier request
+class QuotePoller:
+    def __init__(self, market: IGMarketData, epics: list, fast_interval: float = 1, slow_interval: float = 10, hot_for: float = 30, positions: PositionBook = None, chunk_size: int = 50, max_workers: int = 4):
+        self.market = market
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.hot_for = hot_for
+        self.positions = positions
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.statuses = list(STATUSES)
+        self.epics = []
+        self.rows = {}
+        self.bid = np.empty(0)
+        self.offer = np.empty(0)
+        self.market_status = np.empty(0, dtype = np.int16)
+        self.update_time = np.empty(0, dtype = object)
+        self.moved_at = np.empty(0)
+        self.due = np.empty(0)
+        self.requests = 0
+        self.polled = 0
+        self.changes = 0
+        self.failures = 0
+        self.listener_failures = 0
+        self.executor = None
+        self.sessions = threading.local()
+        self.stop_polling = None
+        self.add(epics)
+
+    def add(self, epics: list):
+        with self.lock:
+            epics = [epic for epic in dict.fromkeys(epics) if epic not in self.rows]
+            for epic in epics:
+                if epic in self.epics:
+                    # polled before and removed since, so its row is taken up again
+                    self.rows[epic] = self.epics.index(epic)
+                    self.due[self.rows[epic]] = 0
+                    continue
+                self.rows[epic] = len(self.epics)
+                self.epics.append(epic)
+            added = len(self.epics) - len(self.bid)
+            self.bid = np.append(self.bid, np.full(added, np.nan))
+            self.offer = np.append(self.offer, np.full(added, np.nan))
+            self.market_status = np.append(self.market_status, np.full(added, -1, dtype = np.int16))
+            self.update_time = np.append(self.update_time, np.full(added, None, dtype = object))
+            self.moved_at = np.append(self.moved_at, np.full(added, -np.inf))
+            self.due = np.append(self.due, np.zeros(added))
+
+    # the epic keeps its row, so it is not polled again but can be added back
+    def remove(self, epic: str):
+        with self.lock:
+            row = self.rows.pop(epic, None)
+            if row is not None:
+                self.due[row] = np.inf
+
+    def status_code(self, status: str):
+        if status not in self.statuses:
+            self.statuses.append(status)
+        return self.statuses.index(status)
+
+    def held(self, epics: list):
+        if self.positions is None:
+            return np.zeros(len(epics), dtype = bool)
+        return np.array([self.positions.exposure(epic) != 0 for epic in epics], dtype = bool)
+
+    def worker_session(self):
+        if not hasattr(self.sessions, 'session'):
+            self.sessions.session = self.market.worker_session()
+        # the platform's tokens may have been renewed since the worker session was made
+        self.sessions.session.headers.update(self.market.session.headers)
+        return self.sessions.session
+
+    # (epic, snapshot) pairs of one request. epics IG does not know are left out of its answer
+    def fetch(self, chunk: list):
+        details = self.market.market_details(','.join(chunk), 'SNAPSHOT_ONLY', session = self.worker_session(), cache = False)['marketDetails']
+        return [(detail['instrument']['epic'], detail['snapshot']) for detail in details]
+
+    # polls the epics which are due, returns the changes found and passes them on to the listeners
+    def poll(self):
+        now = time.monotonic()
+        with self.lock:
+            epics = [self.epics[row] for row in np.flatnonzero(self.due <= now) if self.epics[row] in self.rows]
+        if len(epics) == 0:
+            return []
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers = self.max_workers)
+        chunks = [epics[start:start + self.chunk_size] for start in range(0, len(epics), self.chunk_size)]
+        snapshots = []
+        failed = set()
+        # requests counts the requests IG answered, including with an error, but not those which never reached it
+        for chunk, future in [(chunk, self.executor.submit(self.fetch, chunk)) for chunk in chunks]:
+            try:
+                snapshots.extend(future.result())
+                self.requests += 1
+            except (IGException, KeyError):
+                logger.exception('quote poll failed')
+                self.requests += 1
+                self.failures += 1
+                failed.update(chunk)
+            except RequestException:
+                logger.exception('quote poll failed')
+                self.failures += 1
+                failed.update(chunk)
+        updates = self.apply(snapshots, now)
+        answered = set(epic for epic, snapshot in snapshots)
+        with self.lock:
+            # failed epics are tried again on the fast cadence, and epics IG left out of its answer on the slow one
+            for epic in epics:
+                if epic in self.rows and epic not in answered:
+                    self.due[self.rows[epic]] = now + (self.fast_interval if epic in failed else self.slow_interval)
+        for update in updates:
+            self.notify(update)
+        return updates
+
+    def apply(self, snapshots: list, now: float):
+        with self.lock:
+            snapshots = [(epic, snapshot) for epic, snapshot in snapshots if epic in self.rows]
+            rows = np.array([self.rows[epic] for epic, snapshot in snapshots], dtype = np.int64)
+            bid = np.array([snapshot.get('bid') for epic, snapshot in snapshots], dtype = np.float64)
+            offer = np.array([snapshot.get('offer') for epic, snapshot in snapshots], dtype = np.float64)
+            status = np.array([self.status_code(snapshot.get('marketStatus')) for epic, snapshot in snapshots], dtype = np.int16)
+            # NaN is never equal to itself, so a price missing before and after does not count as a change
+            moved = ~((self.bid[rows] == bid) | (np.isnan(self.bid[rows]) & np.isnan(bid)))
+            moved |= ~((self.offer[rows] == offer) | (np.isnan(self.offer[rows]) & np.isnan(offer)))
+            changed = moved | (self.market_status[rows] != status)
+            # the first snapshot of an epic is passed on, but only later moves put it on the fast cadence
+            moved &= self.market_status[rows] >= 0
+            self.bid[rows] = bid
+            self.offer[rows] = offer
+            self.market_status[rows] = status
+            self.moved_at[rows[moved]] = now
+            for row, (epic, snapshot) in zip(rows, snapshots):
+                self.update_time[row] = snapshot.get('updateTime')
+            hot = (now - self.moved_at[rows] < self.hot_for) | self.held([epic for epic, snapshot in snapshots])
+            self.due[rows] = now + np.where(hot, self.fast_interval, self.slow_interval)
+            self.polled += len(rows)
+            self.changes += int(changed.sum())
+            return [{'epic': snapshots[i][0],
+                     'bid': snapshots[i][1].get('bid'),
+                     'offer': snapshots[i][1].get('offer'),
+                     'marketStatus': snapshots[i][1].get('marketStatus'),
+                     'updateTime': snapshots[i][1].get('updateTime')} for i in np.flatnonzero(changed)]
+
+    def notify(self, update: dict):
+        for listener in list(self.listeners):
+            try:
+                listener(update)
+            except Exception:
+                self.listener_failures += 1
+                logger.exception('quote listener failed')
+
+    # seconds until the next epic is due
+    def due_in(self):
+        with self.lock:
+            due = self.due[[row for row in self.rows.values()]]
+        return max(0, due.min() - time.monotonic()) if len(due) > 0 else self.slow_interval
+
+    def start(self):
+        self.stop()
+        stop = threading.Event()
+        def poll():
+            while not stop.is_set():
+                try:
+                    self.poll()
+                    delay = min(self.due_in(), self.fast_interval)
+                except Exception:
+                    # the epics of a failed pass stay due, so the next one waits rather than failing in a loop
+                    self.failures += 1
+                    logger.exception('quote poll failed')
+                    delay = self.fast_interval
+                stop.wait(delay)
+        self.stop_polling = stop
+        threading.Thread(target = poll, daemon = True).start()
+        return self
+
+    def stop(self):
+        if self.stop_polling is not None:
+            self.stop_polling.set()
+            self.stop_polling = None
+
+    def close(self):
+        self.stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait = False)
+            self.executor = None
+
+    # the changes as they are found, for 'async for update in poller.stream():' in a running event loop. start() polls
+    async def stream(self):
+        loop = asyncio.get_running_loop()
+        updates = asyncio.Queue()
+        listener = lambda update: loop.call_soon_threadsafe(updates.put_nowait, update)
+        self.listeners.append(listener)
+        try:
+            while True:
+                yield await updates.get()
+        finally:
+            self.listeners.remove(listener)
+
+    # the latest quote of every epic polled, indexed by epic
+    def quotes(self):
+        with self.lock:
+            rows = list(self.rows.values())
+            now = time.monotonic()
+            return pd.DataFrame({'bid': self.bid[rows],
+                                 'offer': self.offer[rows],
+                                 'marketStatus': [self.statuses[code] if code >= 0 else None for code in self.market_status[rows]],
+                                 'updateTime': self.update_time[rows],
+                                 'seconds_since_change': now - self.moved_at[rows],
+                                 'due_in': np.maximum(self.due[rows] - now, 0)}, index = pd.Index(list(self.rows.keys()), name = 'epic'))
+
+    def status(self):
+        return {'epics': len(self.rows),
+                'requests': self.requests,
+                'polled': self.polled,
+                'changes': self.changes,
+                'failures': self.failures,
+                'listener_failures': self.listener_failures}
@@ -0,0 +1,175 @@
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+
+# request priorities, lowest first. dealing calls jump ahead of queued account and data calls
+DEALING = 0
+ACCOUNT = 1
+DATA = 2
+
+
+# raised when IG has reported that the weekly historical price data allowance is used up
+class AllowanceExceeded(Exception):
+    pass
+
+# token bucket allowing a given number of requests per minute, with bursts of up to the bucket capacity.
+# IG allows 30 non-trading requests per minute per account, so that is the default
+class TokenBucket:
+    def __init__(self, requests_per_minute: int = 30, capacity: int = None):
+        self.rate = requests_per_minute / 60
+        if capacity is None:
+            self.capacity = requests_per_minute
+        else:
+            self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # takes a token if one is available and returns 0, otherwise returns the number of seconds until one will be
+    def try_acquire(self):
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        wait = self.try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    # empties the bucket, for when IG has throttled a request the bucket allowed
+    def drain(self):
+        with self.lock:
+            self.tokens = 0
+            self.updated = time.monotonic()
+
+    def available(self):
+        with self.lock:
+            self.refill()
+            return self.tokens
+
+
+
+# schedules requests against IG's separate allowances. trading and non-trading requests each have their own
+# per-minute token bucket, and historical price requests are non-trading requests which also count against the weekly
+# price data allowance. callers are queued by priority until their bucket has a token, rather than being sent to fail
+class RequestScheduler:
+    def __init__(self, trading_per_minute: int = 100, non_trading_per_minute: int = 30):
+        self.buckets = {'trading': TokenBucket(trading_per_minute),
+                        'non_trading': TokenBucket(non_trading_per_minute)}
+        self.waiting = {budget: [] for budget in self.buckets}
+        self.async_waiting = {budget: [] for budget in self.buckets}
+        self.sent = {'trading': 0, 'non_trading': 0, 'historical': 0}
+        self.throttled = {budget: 0 for budget in self.buckets}
+        self.historical_allowance = None
+        self.historical_allowance_time = None
+        self.condition = threading.Condition()
+        self.tickets = itertools.count()
+
+    def acquire(self, budget: str, priority: int = DATA):
+        if budget == 'historical':
+            self.check_historical_allowance()
+            with self.condition:
+                self.sent['historical'] += 1
+            budget = 'non_trading'
+        ticket = (priority, next(self.tickets))
+        with self.condition:
+            heapq.heappush(self.waiting[budget], ticket)
+            try:
+                while True:
+                    if self.waiting[budget][0] == ticket:
+                        wait = self.buckets[budget].try_acquire()
+                        if wait == 0:
+                            heapq.heappop(self.waiting[budget])
+                            self.sent[budget] += 1
+                            self.condition.notify_all()
+                            return
+                        self.condition.wait(wait)
+                    else:
+                        self.condition.wait()
+            except BaseException:
+                if ticket in self.waiting[budget]:
+                    self.waiting[budget].remove(ticket)
+                    heapq.heapify(self.waiting[budget])
+                    self.condition.notify_all()
+                raise
+
+    # the asyncio version of acquire, drawing on the same buckets. coroutines queue by priority separately from threads,
+    # and only the coroutine at the head of the queue sleeps until a token is due; it wakes the next one once it has its token,
+    # or the one it overtakes when it arrives with a higher priority
+    async def acquire_async(self, budget: str, priority: int = DATA):
+        if budget == 'historical':
+            self.check_historical_allowance()
+            with self.condition:
+                self.sent['historical'] += 1
+            budget = 'non_trading'
+        waiting = self.async_waiting[budget]
+        loop = asyncio.get_running_loop()
+        ticket = [priority, next(self.tickets), loop.create_future()]
+        head = waiting[0] if len(waiting) > 0 else None
+        heapq.heappush(waiting, ticket)
+        # a coroutine which overtakes the head wakes it, so that only one of them goes on waiting for a token
+        if head is not None and waiting[0] is ticket and not head[2].done():
+            head[2].set_result(None)
+        try:
+            while True:
+                if waiting[0] is ticket:
+                    wait = self.buckets[budget].try_acquire()
+                    if wait == 0:
+                        break
+                    await asyncio.wait([ticket[2]], timeout = wait)
+                else:
+                    await ticket[2]
+                if ticket[2].done():
+                    ticket[2] = loop.create_future()
+            with self.condition:
+                self.sent[budget] += 1
+        finally:
+            waiting.remove(ticket)
+            heapq.heapify(waiting)
+            if len(waiting) > 0 and not waiting[0][2].done():
+                waiting[0][2].set_result(None)
+
+    # called when IG rejects a request for exceeding an allowance, so that queued requests wait for the bucket to refill
+    def record_throttled(self, budget: str):
+        if budget == 'historical':
+            budget = 'non_trading'
+        self.throttled[budget] += 1
+        self.buckets[budget].drain()
+
+    # takes the allowance block returned with historical prices
+    def record_allowance(self, allowance: dict):
+        self.historical_allowance = dict(allowance)
+        self.historical_allowance_time = time.monotonic()
+
+    def check_historical_allowance(self):
+        if self.historical_allowance is None or self.historical_allowance.get('remainingAllowance', 1) > 0:
+            return
+        expires_in = self.historical_allowance.get('allowanceExpiry', 0) - (time.monotonic() - self.historical_allowance_time)
+        if expires_in > 0:
+            raise AllowanceExceeded('historical price data allowance used up, resets in {seconds:.0f} seconds'.format(seconds = expires_in))
+        self.historical_allowance = None
+
+    def usage(self):
+        usage = {}
+        with self.condition:
+            for budget, bucket in self.buckets.items():
+                usage[budget] = {'requests_per_minute': bucket.rate * 60,
+                                 'capacity': bucket.capacity,
+                                 'available': bucket.available(),
+                                 'waiting': len(self.waiting[budget]) + len(self.async_waiting[budget]),
+                                 'sent': self.sent[budget],
+                                 'throttled': self.throttled[budget]}
+        usage['historical'] = {'sent': self.sent['historical'],
+                               'allowance': self.historical_allowance}
+        return usage
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from IgPriceCache import PriceCache, PRICE_COLUMNS, RESOLUTIONS, prices_frame
+
+# how each price column of the finer bars is combined into a coarser bar. open and close take the first and last price
+# quoted within the bar, so a bar whose first bid is missing opens at the next bid quoted, as it would on IG's side
+AGGREGATIONS = {column: column.split('_')[0] for column in PRICE_COLUMNS if column != 'volume'}
+AGGREGATIONS['volume'] = 'sum'
+
+# IG labels every bar with the time it starts. weeks start on Monday, and 1970-01-05 is the first Monday of the epoch
+NANOSECONDS = {resolution: int(length.total_seconds()) * 1000000000 for resolution, length in RESOLUTIONS.items()}
+MONDAY = 4 * NANOSECONDS['DAY']
+
+# the start of the bar of the given resolution each time (int64 nanoseconds) falls in. bars are aligned to the epoch shifted
+# by offset, so an offset of 22 hours starts daily bars at 22:00, and 4 hour bars at 22:00, 02:00, 06:00 and so on
+def bar_starts(times: np.ndarray, resolution: str, offset: timedelta = timedelta(0)):
+    offset = int(offset.total_seconds() * 1000000000)
+    if resolution == 'MONTH':
+        months = (times - offset).view('datetime64[ns]').astype('datetime64[M]')
+        return months.astype('datetime64[ns]').view('int64') + offset
+    length = NANOSECONDS[resolution]
+    origin = offset + (MONDAY if resolution == 'WEEK' else 0)
+    return (times - origin) // length * length + origin
+
+def next_bar_start(start: int, resolution: str, offset: timedelta = timedelta(0)):
+    if resolution == 'MONTH':
+        month = np.datetime64(start - int(offset.total_seconds() * 1000000000), 'ns').astype('datetime64[M]') + 1
+        return int(month.astype('datetime64[ns]').view('int64')) + int(offset.total_seconds() * 1000000000)
+    return start + NANOSECONDS[resolution]
+
+# whether bars of the finer resolution fit whole into bars of the coarser one. days, weeks and months are made of any
+# intraday resolution or of days, as long as both are built with the same offset
+def derivable(finer: str, coarser: str):
+    if finer in ['WEEK', 'MONTH'] or finer == coarser:
+        return False
+    if coarser in ['WEEK', 'MONTH']:
+        return NANOSECONDS['DAY'] % NANOSECONDS[finer] == 0
+    return NANOSECONDS[coarser] % NANOSECONDS[finer] == 0 and NANOSECONDS[finer] < NANOSECONDS[coarser]
+
+# the resolutions a resolution can be derived from, coarsest first, as fewer bars are faster to read and combine
+def sources(resolution: str):
+    return sorted([finer for finer in RESOLUTIONS if derivable(finer, resolution)], key = lambda finer: -NANOSECONDS[finer])
+
+# combines the sorted bars given as the (times, values) pair of IgPriceDecoder.decode_prices and PriceCache.load_arrays into
+# bars of the given resolution. only bars which some finer bar falls in are returned, so hours and days the market was
+# closed stay missing as they are in IG's own prices. the rows are worked through in chunks of whole bars of about
+# CHUNK_ROWS rows, each copied column by column into a buffer small enough to stay in the CPU cache, where every column is
+# reduced with one reduceat
+CHUNK_ROWS = 16384
+
+def resample(times: np.ndarray, values: np.ndarray, resolution: str, offset: timedelta = timedelta(0)):
+    times = np.asarray(times, dtype = 'datetime64[ns]').view('int64')
+    if len(times) == 0:
+        return times.view('datetime64[ns]').copy(), np.empty((0, len(PRICE_COLUMNS)), dtype = values.dtype)
+    bars = bar_starts(times, resolution, offset)
+    firsts = np.flatnonzero(np.concatenate([[True], bars[1:] != bars[:-1]]))
+    bounds = np.append(firsts, len(times))
+    resampled = np.empty((len(firsts), len(PRICE_COLUMNS)), dtype = values.dtype)
+    buffer = np.empty((len(PRICE_COLUMNS), CHUNK_ROWS), dtype = values.dtype)
+    first_bar = 0
+    while first_bar < len(firsts):
+        last_bar = max(first_bar + 1, np.searchsorted(bounds, bounds[first_bar] + CHUNK_ROWS, side = 'right') - 1)
+        start, end = bounds[first_bar], bounds[last_bar]
+        if end - start > buffer.shape[1]:
+            buffer = np.empty((len(PRICE_COLUMNS), end - start), dtype = values.dtype)
+        chunk = buffer[:, :end - start]
+        chunk[...] = values[start:end].T
+        resampled[first_bar:last_bar] = aggregate(chunk, bounds[first_bar:last_bar + 1] - start).T
+        first_bar = last_bar
+    return bars[firsts].view('datetime64[ns]'), resampled
+
+# the bars made of one chunk of columns, given the rows at which each bar starts and, last, the length of the chunk
+def aggregate(chunk: np.ndarray, bounds: np.ndarray):
+    firsts = bounds[:-1]
+    rows = np.arange(chunk.shape[1])
+    aggregated = np.empty((len(PRICE_COLUMNS), len(firsts)), dtype = chunk.dtype)
+    for i, column in enumerate(PRICE_COLUMNS):
+        prices = chunk[i]
+        aggregation = AGGREGATIONS[column]
+        if aggregation == 'open':
+            aggregated[i] = prices[firsts]
+            missing = np.flatnonzero(np.isnan(aggregated[i]))
+            if len(missing) > 0:
+                # the next price quoted, which stands for the bar when it is quoted before the bar ends
+                quoted = np.minimum.accumulate(np.where(np.isnan(prices), len(rows), rows)[::-1])[::-1][firsts[missing]]
+                aggregated[i, missing] = np.where(quoted < bounds[missing + 1], prices[np.minimum(quoted, len(rows) - 1)], np.nan)
+        elif aggregation == 'close':
+            aggregated[i] = prices[bounds[1:] - 1]
+            missing = np.flatnonzero(np.isnan(aggregated[i]))
+            if len(missing) > 0:
+                # the last price quoted, which stands for the bar when it was quoted since the bar started
+                quoted = np.maximum.accumulate(np.where(np.isnan(prices), -1, rows))[bounds[missing + 1] - 1]
+                aggregated[i, missing] = np.where(quoted >= firsts[missing], prices[quoted], np.nan)
+        elif aggregation == 'high':
+            aggregated[i] = np.fmax.reduceat(prices, firsts)
+        elif aggregation == 'low':
+            aggregated[i] = np.fmin.reduceat(prices, firsts)
+        else:
+            aggregated[i] = np.add.reduceat(np.nan_to_num(prices), firsts)
+    return aggregated
+
+def resample_frame(prices: pd.DataFrame, resolution: str, offset: timedelta = timedelta(0)):
+    times, values = resample(prices.index.values, prices.reindex(columns = PRICE_COLUMNS).to_numpy(dtype = np.float64), resolution, offset)
+    return prices_frame(times, values)
+
+# the bars of the given resolution starting between start_date and end_date, derived from a finer resolution held in the
+# price cache for every bar they are made of, or None when no finer resolution is held for the whole range
+def derive(price_cache: PriceCache, epic: str, resolution: str, start_date: datetime, end_date: datetime, offset: timedelta = timedelta(0)):
+    if resolution not in RESOLUTIONS:
+        return None
+    start = np.datetime64(start_date, 'ns').view('int64')
+    first = int(bar_starts(np.array([start]), resolution, offset)[0])
+    if first < start:
+        first = next_bar_start(first, resolution, offset)
+    last = int(bar_starts(np.array([np.datetime64(end_date, 'ns').view('int64')]), resolution, offset)[0])
+    if last < first:
+        return None
+    end = next_bar_start(last, resolution, offset)
+    for source in sources(resolution):
+        source_start = pd.Timestamp(first).to_pydatetime()
+        source_end = pd.Timestamp(end - NANOSECONDS[source]).to_pydatetime()
+        if len(price_cache.missing_intervals(epic, source, source_start, source_end)) == 0:
+            return resample(*price_cache.load_arrays(epic, source, source_start, source_end), resolution, offset)
+    return None
@@ -0,0 +1,93 @@
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+
+# seconds to keep successful GET responses for, by endpoint. endpoints which match none of these are never cached
+DEFAULT_TTLS = [(r'^/accounts/preferences$', 3600),
+                (r'^/accounts$', 60),
+                (r'^/watchlists(/[^/]+)?$', 300),
+                (r'^/markets/[^/]+$', 300),
+                (r'^/markets$', 60)]
+
+# a mutating call invalidates every cached endpoint along its path (so PUT /watchlists/{id} drops /watchlists/{id} and /watchlists),
+# and additionally the endpoints listed here for the first part of its path. dealing changes the balance, positions and orders
+DEFAULT_INVALIDATES = {'/positions': ['/positions', '/workingorders', '/accounts'],
+                       '/workingorders': ['/positions', '/workingorders', '/accounts']}
+
+
+
+# LRU cache of GET responses with a time to live per endpoint, used by ApiHandler when one is given to it
+class ResponseCache:
+    def __init__(self, ttls: list = DEFAULT_TTLS, invalidates: dict = DEFAULT_INVALIDATES, max_entries: int = 1000):
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self.invalidates = invalidates
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def ttl(self, endpoint: str):
+        path = endpoint.split('?')[0]
+        for pattern, ttl in self.ttls:
+            if pattern.match(path):
+                return ttl
+        return None
+
+    def key(self, endpoint: str, version: str, params: dict):
+        return (endpoint, version, json.dumps(params, sort_keys = True, default = str))
+
+    def get(self, endpoint: str, version: str, params: dict = None):
+        if self.ttl(endpoint) is None:
+            return None
+        key = self.key(endpoint, version, params)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, endpoint: str, version: str, params: dict, response):
+        ttl = self.ttl(endpoint)
+        if ttl is None:
+            return
+        key = self.key(endpoint, version, params)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+    # drops the cached responses a mutating call to endpoint may have made out of date
+    def invalidate(self, endpoint: str):
+        parts = endpoint.split('?')[0].strip('/').split('/')
+        paths = set('/' + '/'.join(parts[:length]) for length in range(1, len(parts) + 1))
+        paths.update(self.invalidates.get('/' + parts[0], []))
+        with self.lock:
+            for key in [key for key in self.entries if key[0].split('?')[0] in paths]:
+                del self.entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups > 0 else 0,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
@@ -0,0 +1,318 @@
+import os
+import stat
+import socket
+import sys
+import asyncio
+import tempfile
+import threading
+import trading_ig_config
+import IgRateLimiter
+from multiprocessing.managers import BaseManager
+from requests import Session
+from requests.adapters import HTTPAdapter
+from IGCustomPlatform import IGREST, IGException
+from IgSessionManager import SessionManager, AUTH_ERRORS, TOKEN_HEADERS
+
+# the broker and its workers exchange pickles, so neither side may talk to a process of another user. the broker listens
+# on a Unix socket readable by this user only, in a directory only this user can enter, and both sides prove they hold
+# the broker's key: AUTHKEY_VARIABLE from the environment, else broker_authkey from trading_ig_config, else a random key
+# the first broker writes next to its socket. workers refuse a socket this user does not own
+SOCKET_NAME = 'ig_session_broker.sock'
+KEY_NAME = 'ig_session_broker.key'
+AUTHKEY_VARIABLE = 'IG_BROKER_AUTHKEY'
+
+# $XDG_RUNTIME_DIR, or else a directory of this user's in the temp directory
+def runtime_dir():
+    path = os.environ.get('XDG_RUNTIME_DIR')
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), 'ig-session-broker-{uid}'.format(uid = os.getuid()))
+        os.makedirs(path, mode = 0o700, exist_ok = True)
+    check_private(path)
+    return path
+
+def default_address():
+    return os.path.join(runtime_dir(), SOCKET_NAME)
+
+# a file or directory another user owns or can open could have been put there, or be read, by that user
+def check_private(path: str):
+    info = os.lstat(path)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(path + ' is not private to this user')
+
+def check_owned(address: str):
+    info = os.lstat(address)
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError('refusing ' + address + ', which is not a socket of this user')
+
+def broker_authkey(create: bool = False):
+    key = os.environ.get(AUTHKEY_VARIABLE) or getattr(trading_ig_config.api_config, 'broker_authkey', None)
+    if key:
+        return key.encode() if isinstance(key, str) else key
+    path = os.path.join(runtime_dir(), KEY_NAME)
+    if create:
+        try:
+            descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(descriptor, 'w') as f:
+                f.write(os.urandom(32).hex())
+        except FileExistsError:
+            pass
+    check_private(path)
+    with open(path) as f:
+        return f.read().strip().encode()
+
+
+
+# the daemon side of the broker. holds one login per IG account, kept fresh by a SessionManager, and one RequestScheduler
+# per account, so every worker process drawing on an account queues against the same per-minute allowances instead of
+# each keeping a budget of its own. accounts maps a name to an api_config from trading_ig_config, or anything with the
+# same fields. an account logs in the first time a worker asks for it
+class SessionBroker:
+    def __init__(self, accounts: dict = None, base_url: str = None, trading_per_minute: int = 100, non_trading_per_minute: int = 30):
+        if accounts is None:
+            accounts = {'default': trading_ig_config.api_config()}
+        self.configs = dict(accounts)
+        self.base_url = base_url
+        self.trading_per_minute = trading_per_minute
+        self.non_trading_per_minute = non_trading_per_minute
+        self.lock = threading.Lock()
+        self.logging_in = {name: threading.Lock() for name in self.configs}
+        self.platforms = {}
+        self.managers = {}
+        self.lent = {name: 0 for name in self.configs}
+
+    def accounts(self):
+        return list(self.configs)
+
+    # an account logs in under a lock of its own, so a slow or failing login holds up no other account, and its manager is
+    # only published once the login succeeded. a failed login is tried again by the next caller
+    def open(self, account: str):
+        if account not in self.configs:
+            raise KeyError('unknown account ' + account)
+        if account in self.managers:
+            return self.managers[account]
+        with self.logging_in[account]:
+            if account not in self.managers:
+                config = self.configs[account]
+                gateway = 'https://api.ig.com/gateway/deal' if str.lower(config.acc_type) == 'live' else 'https://demo-api.ig.com/gateway/deal'
+                # the broker's own logins count against the account's allowances like the workers' requests
+                platform = IGREST(base_url = self.base_url or gateway, scheduler = IgRateLimiter.RequestScheduler(self.trading_per_minute, self.non_trading_per_minute))
+                platform.config = config
+                platform.api_handler.API_KEY = config.api_key
+                platform.session.headers.update({'X-IG-API-KEY': config.api_key})
+                manager = SessionManager(platform)
+                if not manager.renew():
+                    platform.session.close()
+                    raise IGException('could not log in to account ' + account)
+                with self.lock:
+                    self.platforms[account] = platform
+                    self.managers[account] = manager.start()
+            return self.managers[account]
+
+    def scheduler(self, account: str):
+        self.open(account)
+        return self.platforms[account].api_handler.scheduler
+
+    # what a worker needs to address IG as the account: the API key and the gateway the broker logged in to
+    def describe(self, account: str):
+        self.open(account)
+        handler = self.platforms[account].api_handler
+        return {'api_key': handler.API_KEY,
+                'base_url': handler.base_url}
+
+    # waits for a token from the account's allowance like RequestScheduler.acquire, then lends the account's current tokens
+    def acquire(self, account: str, budget: str, priority: int = IgRateLimiter.DATA):
+        self.scheduler(account).acquire(budget, priority)
+        with self.lock:
+            self.lent[account] += 1
+        return self.managers[account].credentials
+
+    def credentials(self, account: str):
+        return self.open(account).credentials
+
+    # called with the text of a 401 a worker got and the generation of the tokens it sent, as SessionManager.reauthenticate
+    def reauthenticate(self, account: str, text: str, generation: int):
+        if not any(error in text for error in AUTH_ERRORS):
+            return False
+        return self.open(account).renew(generation)
+
+    def record_throttled(self, account: str, budget: str):
+        self.scheduler(account).record_throttled(budget)
+
+    def record_allowance(self, account: str, allowance: dict):
+        self.scheduler(account).record_allowance(allowance)
+
+    def available(self, account: str, budget: str):
+        return self.scheduler(account).buckets[budget].available()
+
+    def historical_allowance(self, account: str):
+        return self.scheduler(account).historical_allowance
+
+    def usage(self, account: str):
+        return self.scheduler(account).usage()
+
+    def status(self, account: str):
+        status = self.open(account).status()
+        status['lent'] = self.lent[account]
+        return status
+
+    def close(self):
+        with self.lock:
+            for manager in self.managers.values():
+                manager.stop()
+            for platform in self.platforms.values():
+                platform.session.close()
+
+
+
+# the broker process serves a single SessionBroker, made by open_broker when the process starts
+class BrokerManager(BaseManager):
+    pass
+
+BROKER = None
+
+def open_broker(accounts: dict = None, base_url: str = None, trading_per_minute: int = 100, non_trading_per_minute: int = 30):
+    global BROKER
+    BROKER = SessionBroker(accounts, base_url, trading_per_minute, non_trading_per_minute)
+
+def broker():
+    return BROKER
+
+BrokerManager.register('broker', callable = broker)
+
+# opens the broker in the child process start() makes, which binds the socket after, so the socket is made readable by
+# this user only from the start
+def open_private_broker(*arguments):
+    os.umask(0o177)
+    open_broker(*arguments)
+
+# a socket file left behind by a broker which has exited is removed, one a broker is still listening on is left alone
+def remove_stale_socket(address: str):
+    if not isinstance(address, str) or not os.path.lexists(address):
+        return
+    check_owned(address)
+    with socket.socket(socket.AF_UNIX) as probe:
+        try:
+            probe.connect(address)
+        except ConnectionRefusedError:
+            os.remove(address)
+            return
+    raise OSError('a session broker is already listening on ' + address)
+
+# runs the broker in this process until it is killed, for running it as a daemon of its own. address defaults to
+# default_address() and authkey to broker_authkey()
+def serve(accounts: dict = None, address: str = None, authkey: bytes = None, base_url: str = None, trading_per_minute: int = 100, non_trading_per_minute: int = 30):
+    address = address or default_address()
+    remove_stale_socket(address)
+    open_broker(accounts, base_url, trading_per_minute, non_trading_per_minute)
+    mask = os.umask(0o177)
+    try:
+        server = BrokerManager(address = address, authkey = authkey or broker_authkey(create = True)).get_server()
+    finally:
+        os.umask(mask)
+    os.chmod(address, 0o600)
+    server.serve_forever()
+
+# runs the broker in a child process of this one, which is shut down with the returned manager's shutdown()
+def start(accounts: dict = None, address: str = None, authkey: bytes = None, base_url: str = None, trading_per_minute: int = 100, non_trading_per_minute: int = 30):
+    address = address or default_address()
+    remove_stale_socket(address)
+    manager = BrokerManager(address = address, authkey = authkey or broker_authkey(create = True))
+    manager.start(open_private_broker, (accounts, base_url, trading_per_minute, non_trading_per_minute))
+    os.chmod(address, 0o600)
+    return manager
+
+
+
+# the worker side of the broker, attached to platforms in place of their own scheduler and session manager. each request
+# first takes a token from the account's shared allowance in the broker, which lends the account's tokens with it, so the
+# worker never logs in itself; a 401 has the broker renew the login once for all workers. connections cannot be handed
+# between processes, so each worker process keeps one keep-alive pool in session, sized for pool_size concurrent
+# requests, and the platforms it makes through platform() share it rather than opening pools of their own
+class BrokerClient:
+    def __init__(self, account: str = 'default', address: str = None, authkey: bytes = None, pool_size: int = 10):
+        self.account = account
+        address = address or default_address()
+        check_owned(address)
+        manager = BrokerManager(address = address, authkey = authkey or broker_authkey())
+        manager.connect()
+        self.broker = manager.broker()
+        self.description = self.broker.describe(account)
+        self.latest = None
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.buckets = {budget: RemoteBucket(self, budget) for budget in ['trading', 'non_trading']}
+
+    # a platform of the given IGREST class on the shared connection pool, ready to use without create_session
+    def platform(self, platform_class: type = IGREST, **kwargs):
+        return self.attach(platform_class(session = self.session, base_url = self.description['base_url'], **kwargs))
+
+    # for platforms made elsewhere, including the async ones
+    def attach(self, platform):
+        handler = platform.api_handler
+        handler.scheduler = self
+        handler.session_manager = self
+        handler.API_KEY = self.description['api_key']
+        handler.base_url = self.description['base_url']
+        platform.config.api_key = self.description['api_key']
+        # worker sessions copy the platform's headers, so the lent tokens are kept on it too
+        headers = handler.headers if hasattr(handler, 'headers') else platform.session.headers
+        for name in TOKEN_HEADERS:
+            headers.pop(name, None)
+        headers.update(dict(self.credentials[1], **{'X-IG-API-KEY': self.description['api_key']}))
+        return platform
+
+    def acquire(self, budget: str, priority: int = IgRateLimiter.DATA):
+        self.latest = self.broker.acquire(self.account, budget, priority)
+
+    async def acquire_async(self, budget: str, priority: int = IgRateLimiter.DATA):
+        await asyncio.to_thread(self.acquire, budget, priority)
+
+    # the tokens lent with the latest acquire. any thread's will do, as all of them are the account's newest
+    @property
+    def credentials(self):
+        if self.latest is None:
+            self.latest = self.broker.credentials(self.account)
+        return self.latest
+
+    def reauthenticate(self, response, generation: int):
+        renewed = self.broker.reauthenticate(self.account, response.text, generation)
+        self.latest = None
+        return renewed
+
+    def record_throttled(self, budget: str):
+        self.broker.record_throttled(self.account, budget)
+
+    def record_allowance(self, allowance: dict):
+        self.broker.record_allowance(self.account, allowance)
+
+    @property
+    def historical_allowance(self):
+        return self.broker.historical_allowance(self.account)
+
+    def usage(self):
+        return self.broker.usage(self.account)
+
+    def status(self):
+        return self.broker.status(self.account)
+
+    def close(self):
+        self.session.close()
+
+# stands in for a TokenBucket of the broker's scheduler where the api handlers read its tokens
+class RemoteBucket:
+    def __init__(self, client: BrokerClient, budget: str):
+        self.client = client
+        self.budget = budget
+
+    @property
+    def tokens(self):
+        return self.client.broker.available(self.client.account, self.budget)
+
+
+
+if __name__ == '__main__':
+    address = sys.argv[1] if len(sys.argv) > 1 else default_address()
+    print('IG session broker listening on', address)
+    serve(address = address)
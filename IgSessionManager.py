@@ -0,0 +1,194 @@
+import time
+import logging
+import threading
+from datetime import timedelta
+from requests import RequestException
+from IGCustomPlatform import IGREST, IGException
+
+# the errors IG answers with when the tokens a request carried are missing, invalid or have expired
+AUTH_ERRORS = ['error.security.client-token-invalid',
+               'error.security.client-token-missing',
+               'error.security.account-token-invalid',
+               'error.security.account-token-missing',
+               'error.security.oauth-token-invalid']
+TOKEN_HEADERS = ['CST', 'X-SECURITY-TOKEN', 'Authorization', 'IG-ACCOUNT-ID']
+
+logger = logging.getLogger(__name__)
+
+
+
+# keeps the tokens of one IG login fresh for every platform attached to it. the api handlers send the manager's current
+# tokens with each request, so a renewal reaches every thread and worker session at once, and a GET which fails because its
+# tokens expired is sent again once with the renewed ones. renewals are single flight: callers report the generation of
+# the tokens that failed, and only the first of them logs in again, the rest waiting for and then reusing its tokens.
+# CST logins (version 2) are renewed by logging in again once they are max_age old. OAuth logins (version 3) are renewed
+# through /session/refresh-token refresh_margin before the access token expires, falling back to a new login.
+# start() renews in the background ahead of time, so callers seldom wait on a renewal at all. failed renewals are logged
+# and counted in status(). platform can be sync or async: renewals run on the renewal thread and on whichever thread saw
+# its tokens fail, so an async platform is logged in through a blocking IGREST twin sharing its config, gateway and rate limits
+class SessionManager:
+    def __init__(self, platform, oauth: bool = False, max_age: timedelta = timedelta(hours = 5), refresh_margin: timedelta = timedelta(seconds = 15), check_interval: float = 60):
+        self.platform = platform if isinstance(platform, IGREST) else self.login_platform(platform)
+        self.platforms = []
+        self.oauth = oauth
+        self.max_age = max_age.total_seconds()
+        self.refresh_margin = refresh_margin.total_seconds()
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.credentials = (0, {})
+        self.logged_in = None
+        self.renewed = None
+        self.expires = None
+        self.refresh_token = None
+        self.account_id = None
+        self.logins = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.refresh_failures = 0
+        self.stop_renewing = None
+        self.attach(platform)
+
+    def login_platform(self, platform):
+        handler = platform.api_handler
+        twin = IGREST(base_url = handler.base_url, scheduler = handler.scheduler, instrumentation = handler.instrumentation)
+        twin.config = platform.config
+        twin.api_handler.API_KEY = handler.API_KEY
+        twin.session.headers.update({'X-IG-API-KEY': handler.API_KEY})
+        return twin
+
+    # platforms logged in to the same account can share the manager, and with it one set of tokens
+    def attach(self, platform):
+        platform.api_handler.session_manager = self
+        self.platforms.append(platform)
+        if len(self.credentials[1]) > 0:
+            self.install_headers(platform, self.credentials[1])
+
+    def install_headers(self, platform, headers: dict):
+        # async platforms keep their headers on the handler rather than on a requests session
+        targets = [platform.api_handler.headers] if hasattr(platform.api_handler, 'headers') else [platform.session.headers]
+        for target in targets:
+            for name in TOKEN_HEADERS:
+                target.pop(name, None)
+            target.update(headers)
+
+    def install(self, headers: dict):
+        self.credentials = (self.credentials[0] + 1, headers)
+        self.renewed = time.monotonic()
+        for platform in self.platforms:
+            self.install_headers(platform, headers)
+
+    def login_session(self):
+        session = self.platform.worker_session()
+        for name in TOKEN_HEADERS:
+            session.headers.pop(name, None)
+        return session
+
+    def login(self):
+        config = self.platform.config
+        params = {'identifier': config.username,
+                  'password': config.password}
+        version = '3' if self.oauth else '2'
+        session = self.login_session()
+        try:
+            response = self.platform.api_handler.post(session = session, endpoint = '/session', version = version, params = params)
+        finally:
+            session.close()
+        if response.status_code != 200:
+            raise IGException(response.text)
+        if self.oauth:
+            data = self.platform.api_handler.decode(response)
+            self.account_id = data['accountId']
+            self.install_oauth(data['oauthToken'])
+        else:
+            self.expires = None
+            self.install({'CST': response.headers['CST'], 'X-SECURITY-TOKEN': response.headers['X-SECURITY-TOKEN']})
+        self.logins += 1
+        self.logged_in = time.monotonic()
+
+    def install_oauth(self, token: dict):
+        self.refresh_token = token['refresh_token']
+        self.expires = time.monotonic() + int(token['expires_in'])
+        self.install({'Authorization': '{type} {token}'.format(type = token.get('token_type', 'Bearer'), token = token['access_token']),
+                      'IG-ACCOUNT-ID': self.account_id})
+
+    def refresh(self):
+        session = self.login_session()
+        try:
+            response = self.platform.api_handler.post(session = session, endpoint = '/session/refresh-token', version = '1', params = {'refresh_token': self.refresh_token})
+        finally:
+            session.close()
+        if response.status_code != 200:
+            raise IGException(response.text)
+        self.install_oauth(self.platform.api_handler.decode(response))
+        self.refreshes += 1
+
+    # renews the tokens unless the ones of the given generation have already been replaced. returns whether fresh tokens are in place
+    def renew(self, generation: int = None):
+        with self.lock:
+            if generation is not None and generation != self.credentials[0]:
+                return True
+            try:
+                if self.oauth and self.refresh_token is not None:
+                    try:
+                        self.refresh()
+                        return True
+                    except (IGException, RequestException, KeyError):
+                        self.refresh_failures += 1
+                        logger.warning('token refresh failed, logging in again', exc_info = True)
+                self.login()
+                return True
+            except (IGException, RequestException, KeyError):
+                self.failures += 1
+                logger.exception('session renewal failed')
+                return False
+
+    # called by the api handlers with a 401 response and the generation of the tokens it was sent with
+    def reauthenticate(self, response, generation: int):
+        if not any(error in response.text for error in AUTH_ERRORS):
+            return False
+        return self.renew(generation)
+
+    def age(self):
+        if self.logged_in is None:
+            return None
+        return timedelta(seconds = time.monotonic() - self.renewed)
+
+    # seconds until the tokens should be renewed, 0 when they are due
+    def due_in(self):
+        if self.renewed is None:
+            return 0
+        if self.expires is not None:
+            return max(0, self.expires - self.refresh_margin - time.monotonic())
+        return max(0, self.renewed + self.max_age - time.monotonic())
+
+    def start(self):
+        self.stop()
+        if self.renewed is None:
+            self.renew()
+        stop = threading.Event()
+        def renew():
+            delay = min(max(self.due_in(), 1), self.check_interval)
+            while not stop.wait(delay):
+                if self.due_in() == 0 and not self.renew(self.credentials[0]):
+                    delay = self.check_interval
+                else:
+                    delay = min(max(self.due_in(), 1), self.check_interval)
+        self.stop_renewing = stop
+        threading.Thread(target = renew, daemon = True).start()
+        return self
+
+    def stop(self):
+        if self.stop_renewing is not None:
+            self.stop_renewing.set()
+            self.stop_renewing = None
+
+    def status(self):
+        age = self.age()
+        return {'generation': self.credentials[0],
+                'oauth': self.oauth,
+                'age_seconds': None if age is None else age.total_seconds(),
+                'due_in_seconds': self.due_in(),
+                'logins': self.logins,
+                'refreshes': self.refreshes,
+                'refresh_failures': self.refresh_failures,
+                'failures': self.failures}
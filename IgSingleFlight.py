@@ -0,0 +1,173 @@
+import json
+import asyncio
+import threading
+import numpy as np
+import pandas as pd
+
+# coalesces identical GETs made while one of them is in flight, used by ApiHandler and AsyncApiHandler when one is given
+# to them. the first caller of a (url, version, params) key sends the request and the callers arriving before its answer
+# wait for it instead of sending their own, so n strategy threads asking for the same prices cost one request and one
+# token from the rate limit. the waiters get one copy of the response, which then also parses its JSON once for all of them.
+# by default every caller still builds tables of its own, so what a call returns does not depend on whether it happened
+# to be coalesced. share_frames opts in to building each table once, every caller getting a shallow copy: DataFrames rely
+# on pandas' copy on write, so a caller modifying its copy copies the data first, arrow tables are immutable already, and
+# numpy arrays are handed out read-only, so a caller of fetch_historical_arrays or of the numpy output which modifies them
+# must copy them first. the response is shared by callers of one account, so a SingleFlight should not be shared by
+# handlers logged in to different accounts
+class SingleFlight:
+    def __init__(self, share_frames: bool = False):
+        self.share_frames = share_frames
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.async_calls = {}
+        self.sent = 0
+        self.coalesced = 0
+
+    def key(self, url: str, version: str, params: dict):
+        return (url, version, json.dumps(params, sort_keys = True, default = str))
+
+    def join(self, calls: dict, key: tuple, make):
+        with self.lock:
+            call = calls.get(key)
+            if call is None:
+                call = calls[key] = make()
+                self.sent += 1
+                return call, True
+            call.waiters += 1
+            self.coalesced += 1
+            return call, False
+
+    # the result of function, called by the first caller of key and awaited by those arriving while it runs
+    def do(self, key: tuple, function):
+        call, leader = self.join(self.calls, key, Call)
+        if not leader:
+            call.done.wait()
+            return call.outcome()
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self.finish(self.calls, key, call)
+            call.done.set()
+        return call.result
+
+    # the asyncio version of do, for coroutine functions. coroutines only coalesce with coroutines on the same event loop
+    async def do_async(self, key: tuple, function):
+        loop = asyncio.get_running_loop()
+        call, leader = self.join(self.async_calls, (id(loop),) + key, lambda: AsyncCall(loop))
+        if not leader:
+            await asyncio.shield(call.done)
+            return call.outcome()
+        try:
+            call.result = await function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self.finish(self.async_calls, (id(loop),) + key, call)
+            call.done.set_result(None)
+        return call.result
+
+    # once the call is out of the table no one else can join it, so whether its response is shared is known. the callers
+    # share a copy of it, as the response itself may be held by a ResponseCache and handed to later callers
+    def finish(self, calls: dict, key: tuple, call):
+        with self.lock:
+            del calls[key]
+        if call.waiters > 0 and call.error is None and call.result is not None:
+            call.result = copy_response(call.result)
+            call.result.shared = SharedResponse(self.share_frames)
+
+    def stats(self):
+        with self.lock:
+            requested = self.sent + self.coalesced
+            return {'sent': self.sent,
+                    'coalesced': self.coalesced,
+                    'coalesced_rate': self.coalesced / requested if requested > 0 else 0,
+                    'in_flight': len(self.calls) + len(self.async_calls)}
+
+# a copy of a response sharing its body, headers and request. copy.copy would pickle a requests Response, which keeps
+# only its own fields and drops the endpoint and version the handlers set on it
+def copy_response(response):
+    duplicate = object.__new__(type(response))
+    duplicate.__dict__.update(response.__dict__)
+    return duplicate
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class AsyncCall(Call):
+    def __init__(self, loop):
+        super().__init__()
+        self.done = loop.create_future()
+
+
+
+# the work done once for all the callers given one coalesced response: its decoded JSON, and the tables the platform built
+# from it. callers build their tables in the same order, so the n-th table a caller builds from the response is the n-th
+# every other caller builds. callers are told apart by thread, or by task when they are coroutines
+class SharedResponse:
+    def __init__(self, share_frames: bool = False):
+        self.share_frames = share_frames
+        self.lock = threading.Lock()
+        self.data = None
+        self.decoded = False
+        self.frames = {}
+        self.builds = {}
+
+    # every caller gets its own copy of the top level, as the platform replaces keys of the decoded body with tables
+    def decode(self, parse):
+        with self.lock:
+            if not self.decoded:
+                self.data = parse()
+                self.decoded = True
+        return dict(self.data) if isinstance(self.data, dict) else self.data
+
+    def build(self, function, make):
+        if not self.share_frames:
+            return make()
+        with self.lock:
+            caller = caller_id()
+            number = self.builds.get(caller, 0)
+            self.builds[caller] = number + 1
+            if (number, function) not in self.frames:
+                self.frames[(number, function)] = freeze(make())
+            return share(self.frames[(number, function)])
+
+def caller_id():
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
+
+# the shared copy of a table, made read-only where it would otherwise be modified in place
+def freeze(result):
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+    elif isinstance(result, (dict, tuple, list)):
+        for value in (result.values() if isinstance(result, dict) else result):
+            freeze(value)
+    return result
+
+# what one caller is handed of a shared table
+def share(result):
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.copy(deep = False)
+    if isinstance(result, np.ndarray):
+        return result.view()
+    if isinstance(result, dict):
+        return {key: share(value) for key, value in result.items()}
+    if isinstance(result, (tuple, list)):
+        return type(result)(share(value) for value in result)
+    return result
@@ -0,0 +1,387 @@
+import os
+import json
+import mmap
+import uuid
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from IgOutput import CATEGORICAL_RATIO
+
+# missing values of the int64 encoded columns. it is the integer pandas keeps NaT as, so timestamps need no conversion
+MISSING = np.iinfo(np.int64).min
+
+# the most decimal places a float column is held to as fixed point before it is kept as float64 instead
+MAX_SCALE = 8
+
+# every array in a part's data file starts at a multiple of ALIGNMENT bytes, so it can be viewed in place
+ALIGNMENT = 64
+
+# the columns each export is sorted by, and the epic column, for the tables IGAccountData and IGDealer return
+POSITION_DATE = 'createdDateUTC'
+ACTIVITY_DATE = 'date'
+TRANSACTION_DATE = 'dateUtc'
+EPIC = 'epic'
+
+
+
+# a snapshot is a directory of parts, one per export. each part is a data file holding the arrays of its columns back to
+# back, read memory-mapped, and a .json file giving where each array is and how every column is encoded:
+#   category   dictionary codes (int8 to int32, -1 for missing) with the dictionary in the meta. epics, directions and
+#              any other column repeating its values, so loading never parses their strings again
+#   timestamp  int64 nanoseconds, from datetime columns and from string columns holding ISO 8601 dates
+#   decimal    fixed point int64 with the number of decimal places in the meta, from Decimals, numeric strings such as
+#              IG's sizes and levels in the history, and floats which round trip exactly at up to MAX_SCALE places
+#   string     utf-8 bytes and int64 offsets, for columns of mostly distinct strings such as deal ids
+#   json       as string, for the dicts and lists of unnormalized history records
+#   int, float and bool columns are kept as they are
+# rows are sorted by the part's date column, and the meta holds the part's first and last date, so a date range is found
+# by skipping parts and then by binary search within them, and an epic filter skips parts whose dictionary lacks the epics
+def export(frame: pd.DataFrame, path: str, date_column: str = None, epic_column: str = EPIC):
+    if len(frame) == 0:
+        return None
+    if date_column is not None and date_column not in frame.columns:
+        raise ValueError('no date column ' + date_column)
+    columns = [encoding(name, frame[name], name == epic_column) for name in frame.columns]
+    meta = {'rows': len(frame),
+            'date_column': date_column,
+            'epic_column': epic_column if epic_column in frame.columns else None,
+            'date_range': None,
+            'columns': columns}
+    if date_column is not None:
+        dates = columns[list(frame.columns).index(date_column)]
+        if dates['encoding'] != 'timestamp':
+            raise ValueError(date_column + ' does not hold dates')
+        order = np.argsort(dates['arrays']['values'], kind = 'stable')
+        for column in columns:
+            column['arrays'] = reorder(column['arrays'], order)
+        held = dates['arrays']['values'][dates['arrays']['values'] != MISSING]
+        if len(held) > 0:
+            meta['date_range'] = [int(held[0]), int(held[-1])]
+    os.makedirs(path, exist_ok = True)
+    part = os.path.join(path, 'part-{time:%Y%m%dT%H%M%S%f}-{id}'.format(time = datetime.now(), id = uuid.uuid4().hex[:8]))
+    position = 0
+    with open(part + '.data.tmp', 'wb') as f:
+        for column in columns:
+            placed = {}
+            for name, array in column['arrays'].items():
+                array = np.ascontiguousarray(array)
+                f.write(b'\0' * (-position % ALIGNMENT))
+                position += -position % ALIGNMENT
+                placed[name] = [position, array.dtype.str, len(array)]
+                f.write(array.tobytes())
+                position += array.nbytes
+            column['arrays'] = placed
+    os.replace(part + '.data.tmp', part + '.data')
+    # a part is only seen by readers once its meta is in place
+    with open(part + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(part + '.json.tmp', part + '.json')
+    return part
+
+# the arrays of one column with its rows in the given order
+def reorder(arrays: dict, order: np.ndarray):
+    if 'offsets' not in arrays:
+        return {name: array[order] for name, array in arrays.items()}
+    offsets = arrays['offsets']
+    lengths = np.diff(offsets)[order]
+    starts = offsets[:-1][order]
+    reordered = {'offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)}
+    # the bytes of every row, gathered by one fancy index over the positions of all of them
+    positions = np.repeat(starts - reordered['offsets'][:-1], lengths) + np.arange(reordered['offsets'][-1])
+    reordered['bytes'] = arrays['bytes'][positions]
+    if 'missing' in arrays:
+        reordered['missing'] = arrays['missing'][order]
+    return reordered
+
+# how a column is held, as the meta describing it with its encoded arrays by name. the epic column is always dictionary
+# encoded, as selecting by epic reads its dictionary
+def encoding(name: str, series: pd.Series, epic: bool = False):
+    meta = {'name': name}
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        times = series.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype = 'datetime64[ns]').view(np.int64)
+        return dict(meta, encoding = 'timestamp', tz = str(series.dt.tz), arrays = {'values': times})
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return dict(meta, encoding = 'timestamp', arrays = {'values': series.to_numpy(dtype = 'datetime64[ns]').view(np.int64)})
+    if pd.api.types.is_bool_dtype(series.dtype) and not series.hasnans:
+        return dict(meta, encoding = 'bool', arrays = {'values': series.to_numpy(dtype = bool)})
+    if pd.api.types.is_integer_dtype(series.dtype) and not series.hasnans:
+        return dict(meta, encoding = 'int', arrays = {'values': series.to_numpy(dtype = np.int64)})
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return float_encoding(meta, series.to_numpy(dtype = np.float64))
+    values = series.to_numpy(dtype = object)
+    missing = pd.isna(values)
+    held = values[~missing]
+    strings = all(isinstance(value, str) for value in held)
+    if strings:
+        dates = iso_dates(values, missing)
+        if dates is not None:
+            return dict(meta, encoding = 'timestamp', arrays = {'values': dates})
+    if strings or all(isinstance(value, Decimal) for value in held):
+        decimals = decimal_encoding(meta, values, missing)
+        if decimals is not None:
+            return decimals
+    if all(isinstance(value, (str, bool, int, float)) for value in held):
+        codes, dictionary = pd.factorize(held)
+        if epic or len(dictionary) <= CATEGORICAL_RATIO * len(values):
+            encoded = np.full(len(values), -1, dtype = code_dtype(len(dictionary)))
+            encoded[~missing] = codes
+            return dict(meta, encoding = 'category', dictionary = [item(value) for value in dictionary], arrays = {'values': encoded})
+        if strings:
+            return string_encoding(dict(meta, encoding = 'string'), values, missing)
+    return string_encoding(dict(meta, encoding = 'json'), np.array([None if is_missing else json.dumps(value, default = str) for value, is_missing in zip(values, missing)], dtype = object), missing)
+
+def code_dtype(size: int):
+    for dtype in [np.int8, np.int16, np.int32]:
+        if size <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+# numpy scalars as the plain values json writes
+def item(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+def iso_dates(values: np.ndarray, missing: np.ndarray):
+    # IG's dates start yyyy-mm-dd, which also keeps numbers and other strings from being tried as dates
+    if missing.all() or not all(len(value) >= 10 and value[4] == '-' and value[7] == '-' for value in values[~missing]):
+        return None
+    dates = pd.to_datetime(pd.Series(values), format = 'ISO8601', errors = 'coerce')
+    if dates.isna().sum() != missing.sum():
+        return None
+    if isinstance(dates.dtype, pd.DatetimeTZDtype):
+        dates = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+    return dates.to_numpy(dtype = 'datetime64[ns]').view(np.int64)
+
+def float_encoding(meta: dict, values: np.ndarray):
+    missing = np.isnan(values)
+    held = values[~missing]
+    for scale in range(MAX_SCALE + 1):
+        scaled = np.round(held * 10 ** scale)
+        if np.all(np.abs(scaled) < 2 ** 53) and np.array_equal(scaled / 10 ** scale, held):
+            fixed = np.full(len(values), MISSING, dtype = np.int64)
+            fixed[~missing] = scaled.astype(np.int64)
+            return dict(meta, encoding = 'decimal', scale = scale, arrays = {'values': fixed})
+    return dict(meta, encoding = 'float', arrays = {'values': values})
+
+# Decimals, or strings which all read as decimal numbers, as fixed point. None when some value is not a number
+def decimal_encoding(meta: dict, values: np.ndarray, missing: np.ndarray):
+    try:
+        decimals = [Decimal(value) for value in values[~missing]]
+    except InvalidOperation:
+        return None
+    if len(decimals) == 0 or not all(decimal.is_finite() for decimal in decimals):
+        return None
+    scale = max(0, max(-decimal.as_tuple().exponent for decimal in decimals))
+    fixed = [int(decimal.scaleb(scale)) for decimal in decimals]
+    if scale > 18 or max(abs(value) for value in fixed) >= 2 ** 63:
+        return None
+    encoded = np.full(len(values), MISSING, dtype = np.int64)
+    encoded[~missing] = fixed
+    return dict(meta, encoding = 'decimal', scale = scale, arrays = {'values': encoded})
+
+# ascii columns, which deal ids and references are, are sliced out of one decoded string when read
+def string_encoding(meta: dict, values: np.ndarray, missing: np.ndarray):
+    encoded = [b'' if is_missing else value.encode('utf-8') for value, is_missing in zip(values, missing)]
+    offsets = np.zeros(len(values) + 1, dtype = np.int64)
+    np.cumsum([len(value) for value in encoded], out = offsets[1:])
+    data = b''.join(encoded)
+    arrays = {'offsets': offsets, 'bytes': np.frombuffer(data, dtype = np.uint8)}
+    if missing.any():
+        arrays['missing'] = missing.astype(bool)
+    return dict(meta, ascii = data.isascii(), arrays = arrays)
+
+
+
+# the tables IGDealer.list_positions and list_working_orders return come in pairs, one row per deal in each
+def export_positions(positions: tuple, path: str):
+    return export(side_by_side(positions[1], positions[0]), path, POSITION_DATE)
+
+def export_working_orders(orders: tuple, path: str):
+    return export(side_by_side(orders[1], orders[0]), path, POSITION_DATE)
+
+def export_account_history(history: pd.DataFrame, path: str):
+    return export(history, path, ACTIVITY_DATE)
+
+# IG's date column of transactions is dd/mm/yy, so they are ordered by dateUtc
+def export_transaction_history(history: pd.DataFrame, path: str):
+    return export(history, path, TRANSACTION_DATE)
+
+# columns both tables hold, such as the epic of a working order, are kept once
+def side_by_side(first: pd.DataFrame, second: pd.DataFrame):
+    frame = pd.concat([first.reset_index(drop = True), second.reset_index(drop = True)], axis = 1)
+    return frame.loc[:, ~frame.columns.duplicated()]
+
+
+
+# reads a snapshot written by export. opening reads only the meta of each part, and a part's data file is mapped the
+# first time a select needs it. select copies out only the rows passing its filters and decodes only those, each column
+# once across all parts. decimals gives decimal columns as Decimal objects rather than float64
+class Snapshot:
+    def __init__(self, path: str):
+        self.path = path
+        self.parts = []
+        self.maps = {}
+        for file in sorted(os.listdir(path)):
+            if file.startswith('part-') and file.endswith('.json'):
+                with open(os.path.join(path, file)) as f:
+                    self.parts.append((os.path.join(path, file[:-len('.json')]), json.load(f)))
+
+    def __len__(self):
+        return sum(meta['rows'] for part, meta in self.parts)
+
+    @property
+    def columns(self):
+        return list(dict.fromkeys(column['name'] for part, meta in self.parts for column in meta['columns']))
+
+    # the epics held, without reading any rows
+    def epics(self):
+        return sorted(set(epic for part, meta in self.parts for column in meta['columns'] if column['name'] == meta['epic_column'] for epic in column['dictionary']))
+
+    def array(self, part: str, column: dict, name: str):
+        if part not in self.maps:
+            with open(part + '.data', 'rb') as f:
+                self.maps[part] = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        offset, dtype, length = column['arrays'][name]
+        return np.frombuffer(self.maps[part], dtype = dtype, count = length, offset = offset)
+
+    # rows dated between start_date and end_date inclusive and, when epics are given, of those epics
+    def select(self, start_date: datetime = None, end_date: datetime = None, epics: list = None, columns: list = None, decimals: bool = False):
+        columns = self.columns if columns is None else list(columns)
+        start = None if start_date is None else nanoseconds(start_date)
+        end = None if end_date is None else nanoseconds(end_date)
+        epics = None if epics is None else set(epics)
+        pieces = {name: [] for name in columns}
+        for part, meta in self.parts:
+            rows = self.rows(part, meta, start, end, epics)
+            if rows is None:
+                continue
+            count = len(rows) if isinstance(rows, np.ndarray) else rows.stop - rows.start
+            held = {column['name']: column for column in meta['columns']}
+            for name in columns:
+                if name in held:
+                    column = held[name]
+                    pieces[name].append((column, {array: self.read(part, column, array, rows) for array in column['arrays']}, count))
+                else:
+                    pieces[name].append((None, None, count))
+        return pd.DataFrame({name: combine(values, decimals) for name, values in pieces.items()}, columns = columns)
+
+    # the rows of one part passing the filters, as a slice or an array of row numbers, or None when there are none
+    def rows(self, part: str, meta: dict, start: int, end: int, epics: set):
+        rows = slice(0, meta['rows'])
+        held = {column['name']: column for column in meta['columns']}
+        if start is not None or end is not None:
+            if meta['date_column'] is None:
+                raise ValueError('snapshot has no date column to select dates by')
+            date_range = meta['date_range']
+            if date_range is None or (start is not None and date_range[1] < start) or (end is not None and date_range[0] > end):
+                return None
+            dates = self.array(part, held[meta['date_column']], 'values')
+            # missing dates sort first and are never in a range
+            first = int(np.searchsorted(dates, MISSING, side = 'right'))
+            if start is not None:
+                first = max(first, int(np.searchsorted(dates, start, side = 'left')))
+            last = len(dates) if end is None else int(np.searchsorted(dates, end, side = 'right'))
+            if last <= first:
+                return None
+            rows = slice(first, last)
+        if epics is not None:
+            if meta['epic_column'] is None:
+                raise ValueError('snapshot has no epic column to select epics by')
+            column = held[meta['epic_column']]
+            wanted = [code for code, epic in enumerate(column['dictionary']) if epic in epics]
+            if len(wanted) == 0:
+                return None
+            rows = np.flatnonzero(np.isin(self.array(part, column, 'values')[rows], wanted)) + rows.start
+            if len(rows) == 0:
+                return None
+        return rows
+
+    # one array of a column at the given rows, copied out of the map. strings keep all their bytes and only the offsets
+    # of the rows, so each row is found in them when decoded
+    def read(self, part: str, column: dict, name: str, rows):
+        array = self.array(part, column, name)
+        if name == 'bytes':
+            return array
+        if name == 'offsets':
+            return np.stack([array[:-1][rows], array[1:][rows]])
+        return np.array(array[rows])
+
+    def close(self):
+        for part in list(self.maps):
+            self.maps.pop(part).close()
+
+# dates are held as UTC when they carry a timezone, and as they are when they do not
+def nanoseconds(date: datetime):
+    date = pd.Timestamp(date)
+    if date.tz is not None:
+        date = date.tz_convert('UTC').tz_localize(None)
+    return date.value
+
+def load(path: str, start_date: datetime = None, end_date: datetime = None, epics: list = None, columns: list = None, decimals: bool = False):
+    return Snapshot(path).select(start_date, end_date, epics, columns, decimals)
+
+# one column out of the (column meta, arrays, rows) pieces read from every part, the meta and arrays being None for parts
+# without the column. categoricals are combined as codes into one dictionary, the other columns are decoded piece by piece
+def combine(pieces: list, decimals: bool):
+    encodings = set(column['encoding'] for column, arrays, count in pieces if column is not None)
+    if len(encodings) == 0:
+        return np.full(sum(count for column, arrays, count in pieces), None, dtype = object)
+    if encodings == {'category'}:
+        dictionary = {}
+        codes = []
+        for column, arrays, count in pieces:
+            if column is None:
+                codes.append(np.full(count, -1, dtype = np.int32))
+                continue
+            # the last entry of the lookup takes the -1 of missing values to -1
+            lookup = np.array([dictionary.setdefault(value, len(dictionary)) for value in column['dictionary']] + [-1], dtype = np.int32)
+            codes.append(lookup[arrays['values']])
+        return pd.Categorical.from_codes(np.concatenate(codes), categories = pd.Index(list(dictionary), dtype = object), validate = False)
+    if encodings == {'timestamp'} and all(column is not None for column, arrays, count in pieces) and len(set(column.get('tz') for column, arrays, count in pieces)) == 1:
+        times = pd.DatetimeIndex(np.concatenate([arrays['values'] for column, arrays, count in pieces]).view('datetime64[ns]'))
+        return times.tz_localize('UTC').tz_convert(pieces[0][0]['tz']) if 'tz' in pieces[0][0] else times
+    decoded = [decode(column, arrays, count, decimals) for column, arrays, count in pieces]
+    held = [values.dtype for values, (column, arrays, count) in zip(decoded, pieces) if column is not None]
+    if all(dtype == np.float64 for dtype in held):
+        # parts without the column are NaN, as missing decimals and floats are
+        decoded = [np.full(count, np.nan) if column is None else values for values, (column, arrays, count) in zip(decoded, pieces)]
+    if all(values.dtype == decoded[0].dtype for values in decoded):
+        return np.concatenate(decoded)
+    return np.concatenate([values.astype(object) for values in decoded])
+
+def decode(column: dict, arrays: dict, count: int, decimals: bool):
+    if column is None:
+        return np.full(count, None, dtype = object)
+    kind = column['encoding']
+    if kind in ['string', 'json']:
+        values = np.empty(count, dtype = object)
+        if count > 0:
+            starts, ends = arrays['offsets']
+            low = int(starts.min())
+            text = arrays['bytes'][low:int(ends.max())].tobytes()
+            if column['ascii']:
+                text = text.decode('ascii')
+                values[:] = [text[start:end] for start, end in zip((starts - low).tolist(), (ends - low).tolist())]
+            else:
+                values[:] = [text[start:end].decode('utf-8') for start, end in zip((starts - low).tolist(), (ends - low).tolist())]
+        if kind == 'json':
+            values[:] = [json.loads(value) if len(value) > 0 else None for value in values]
+        if 'missing' in arrays:
+            values[arrays['missing']] = None
+        return values
+    values = arrays['values']
+    if kind == 'category':
+        return np.array(column['dictionary'] + [None], dtype = object)[values]
+    if kind == 'timestamp':
+        times = pd.DatetimeIndex(values.view('datetime64[ns]'))
+        return np.asarray(times.tz_localize('UTC').tz_convert(column['tz']) if 'tz' in column else times, dtype = object)
+    if kind == 'decimal':
+        missing = values == MISSING
+        if decimals:
+            converted = np.empty(len(values), dtype = object)
+            converted[:] = [None if is_missing else Decimal(value).scaleb(-column['scale']) for value, is_missing in zip(values.tolist(), missing)]
+            return converted
+        converted = values / 10 ** column['scale']
+        converted[missing] = np.nan
+        return converted
+    return values
@@ -0,0 +1,59 @@
+'''
+Times IgIndicators on a synthetic history of minute bars: computing each indicator over the whole history in one vectorized
+pass, which is what recomputing on every new bar costs per bar, against advancing the indicator's incremental state by one
+bar. The incremental values are checked against the batch ones for the bars appended.
+
+    python benchmarks/bench_indicators.py [bars] [appended]
+'''
+import os
+import sys
+import time
+import numpy as np
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import IgIndicators
+
+INDICATORS = {'sma_20': lambda: IgIndicators.SMA(20),
+              'ema_20': lambda: IgIndicators.EMA(20),
+              'atr_14': lambda: IgIndicators.ATR(14),
+              'rsi_14': lambda: IgIndicators.RSI(14),
+              'bollinger_20': lambda: IgIndicators.Bollinger(20),
+              'vwap': lambda: IgIndicators.VWAP(timedelta(hours = 22))}
+
+def make_bars(bars: int):
+    generator = np.random.default_rng(0)
+    mid = 7500 + generator.standard_normal(bars).cumsum()
+    columns = {'DateTime': np.datetime64('2020-01-01', 'ns') + np.arange(bars).astype('timedelta64[m]')}
+    for field, shift in [('open', 0), ('high', 2), ('low', -2), ('close', 0.5)]:
+        columns[field + '_bid'] = mid + shift - 0.5
+        columns[field + '_ask'] = mid + shift + 0.5
+    columns['volume'] = generator.integers(0, 100, bars).astype(np.float64)
+    return columns
+
+def head(columns: dict, bars: int):
+    return {name: values[:bars] for name, values in columns.items()}
+
+def bar(columns: dict, row: int):
+    return {name: values[row] for name, values in columns.items()}
+
+if __name__ == '__main__':
+    bars = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    appended = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    columns = make_bars(bars)
+    history = head(columns, bars - appended)
+    new_bars = [bar(columns, row) for row in range(bars - appended, bars)]
+    print('{:>14} {:>10} {:>16} {:>16} {:>10}'.format('indicator', 'bars', 'batch ms', 'update us/bar', 'speedup'))
+    for name, make in INDICATORS.items():
+        start = time.perf_counter()
+        expected = make().compute(columns)
+        batch = time.perf_counter() - start
+        indicator = make()
+        indicator.compute(history)
+        start = time.perf_counter()
+        updated = [indicator.update(new_bar) for new_bar in new_bars]
+        update = (time.perf_counter() - start) / appended
+        if isinstance(expected, tuple):
+            expected, updated = expected[0], [value[0] for value in updated]
+        np.testing.assert_allclose(updated, expected[-appended:], rtol = 1e-9, atol = 1e-7)
+        print('{:>14} {:>10} {:>16.1f} {:>16.2f} {:>9.0f}x'.format(name, bars, batch * 1000, update * 1000000, batch / update))
@@ -0,0 +1,140 @@
+'''
+Load test of IGMarketData, IGAccountData and IGDealer against the offline IG gateway in IgMockServer, so the platform's
+throughput can be measured without IG's demo servers. Every scenario calls one platform method repeatedly from a pool of
+threads and reports the calls and HTTP requests per second, the p50 and p99 latency of a call, and the cost of building the
+DataFrame, taken as the p50 of the platform call less the p50 of a bare ApiHandler request for the same endpoint.
+
+    python benchmarks/bench_platform.py [--calls 200] [--threads 4] [--latency 0] [--padding 0] [--only prices] [--json results.json]
+                                        [--output numpy] [--float32] [--categorical]
+
+--json also writes the results with the commit they were measured on, so runs can be compared commit over commit.
+--output, --float32 and --categorical choose the IgOutput backend the platform methods return their tables in.
+The client's rate limiter is opened up to 6000 requests a minute, so the numbers are those of the platform and not of IG's limits.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import IgMockServer
+import IgRateLimiter
+import IgOutput
+from IGCustomPlatform import IGMarketData, IGDealer
+
+START = datetime(2024, 1, 2)
+END = START + timedelta(hours = 8)
+
+def epic(call: int):
+    return 'CS.D.MOCK{number}.CFD.IP'.format(number = call % 100)
+
+def open_position(dealer: IGDealer, call: int, session):
+    return dealer.open_position('GBP', 'BUY', epic(call), None, 'MARKET', 1, '-', session = session)
+
+def raw_open_position(handler, call: int, session):
+    response = handler.post(session = session, endpoint = '/positions/otc', version = '2', params = {'currencyCode': 'GBP', 'direction': 'BUY', 'epic': epic(call), 'orderType': 'MARKET', 'size': 1, 'expiry': '-'})
+    return handler.get(session = session, endpoint = '/confirms/{reference}'.format(reference = json.loads(response.text)['dealReference']), version = '2')
+
+# (name, endpoint, platform call, bare request for the same endpoint or None, threads or None for --threads)
+SCENARIOS = [('prices_daterange', '/prices', lambda market, dealer, call, session: market.get_historical_data_daterange(epic(call), 'MINUTE', START, END, session = session),
+              lambda handler, call, session: handler.get(session = session, endpoint = '/prices/{epic}/MINUTE/{start}/{end}'.format(epic = epic(call), start = START, end = END), version = '2'), None),
+             ('prices_numpoints', '/prices', lambda market, dealer, call, session: market.get_historical_data_numpoints(epic(call), 'HOUR', 100, session = session),
+              lambda handler, call, session: handler.get(session = session, endpoint = '/prices/{epic}/HOUR/100'.format(epic = epic(call)), version = '2'), None),
+             ('market_node', '/marketnavigation', lambda market, dealer, call, session: market.market_node('1{start:04d}'.format(start = 0), session = session),
+              lambda handler, call, session: handler.get(session = session, endpoint = '/marketnavigation/10000', version = '1'), None),
+             ('search_markets', '/markets', lambda market, dealer, call, session: market.search_markets('mock market 1', session = session),
+              lambda handler, call, session: handler.get(session = session, endpoint = '/markets?searchTerm=mock market 1', version = '1'), None),
+             ('market_details_many', '/markets', lambda market, dealer, call, session: market.market_details_many([epic(number) for number in range(100)]),
+              None, 1),
+             ('list_accounts', '/accounts', lambda market, dealer, call, session: dealer.list_accounts(session = session),
+              lambda handler, call, session: handler.get(session = session, endpoint = '/accounts', version = '1'), None),
+             ('account_history', '/history/activity', lambda market, dealer, call, session: dealer.account_history(86400, 500, START, END, session = session),
+              lambda handler, call, session: handler.get(session = session, endpoint = '/history/activity', version = '2', params = {'from': START, 'to': END, 'maxSpanSeconds': 86400, 'pageSize': 500, 'pageNumber': 1}), None),
+             ('open_position', '/positions/otc', lambda market, dealer, call, session: open_position(dealer, call, session),
+              raw_open_position, None),
+             ('list_positions', '/positions', lambda market, dealer, call, session: dealer.list_positions(session = session),
+              lambda handler, call, session: handler.get(session = session, endpoint = '/positions', version = '2'), None)]
+
+def timed(function, calls: int, threads: int, worker_session):
+    sessions = threading.local()
+    def call(number: int):
+        if not hasattr(sessions, 'session'):
+            sessions.session = worker_session()
+        start = time.perf_counter()
+        function(number, sessions.session)
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = threads) as executor:
+        latencies = np.array(list(executor.map(call, range(calls))))
+    return latencies, time.perf_counter() - start
+
+def run(scenarios: list, calls: int, threads: int, state: IgMockServer.MockIGState, output: IgOutput.OutputBackend = None):
+    rows = []
+    with IgMockServer.MockIGServer(state = state) as server:
+        market = IGMarketData(base_url = server.base_url, output = output, scheduler = IgRateLimiter.RequestScheduler(6000, 6000))
+        dealer = IGDealer(base_url = server.base_url, output = output, scheduler = IgRateLimiter.RequestScheduler(6000, 6000))
+        for platform in [market, dealer]:
+            platform.create_session()
+        for name, endpoint, call, raw, scenario_threads in scenarios:
+            scenario_threads = scenario_threads or threads
+            scenario_calls = calls if scenario_threads > 1 else max(1, calls // 10)
+            requests = state.requests
+            latencies, seconds = timed(lambda number, session: call(market, dealer, number, session), scenario_calls, scenario_threads, market.worker_session)
+            requests = state.requests - requests
+            raw_p50 = None
+            if raw is not None:
+                raw_latencies = timed(lambda number, session: raw(market.api_handler, number, session), scenario_calls, scenario_threads, market.worker_session)[0]
+                raw_p50 = np.percentile(raw_latencies, 50) * 1000
+            p50 = np.percentile(latencies, 50) * 1000
+            rows.append({'scenario': name,
+                         'endpoint': endpoint,
+                         'threads': scenario_threads,
+                         'calls': scenario_calls,
+                         'requests': requests,
+                         'calls_per_second': scenario_calls / seconds,
+                         'requests_per_second': requests / seconds,
+                         'p50_ms': p50,
+                         'p99_ms': np.percentile(latencies, 99) * 1000,
+                         'raw_p50_ms': raw_p50,
+                         'frame_ms': None if raw_p50 is None else p50 - raw_p50})
+        dealer.close_all_positions()
+    return pd.DataFrame(rows)
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'load test the platform against the mock IG gateway')
+    parser.add_argument('--calls', type = int, default = 200, help = 'calls per scenario')
+    parser.add_argument('--threads', type = int, default = 4, help = 'threads calling concurrently')
+    parser.add_argument('--latency', type = float, default = 0, help = 'seconds the mock gateway waits before answering')
+    parser.add_argument('--jitter', type = float, default = 0, help = 'up to this many further seconds of random latency')
+    parser.add_argument('--padding', type = int, default = 0, help = 'characters of padding added to every record served')
+    parser.add_argument('--only', nargs = '*', help = 'run only the scenarios whose names start with these')
+    parser.add_argument('--json', help = 'also write the results to this file')
+    parser.add_argument('--output', choices = IgOutput.BACKENDS, default = 'pandas', help = 'container the platform returns its tables in')
+    parser.add_argument('--float32', action = 'store_true', help = 'return float32 prices and numbers')
+    parser.add_argument('--categorical', action = 'store_true', help = 'dictionary encode repetitive string columns')
+    arguments = parser.parse_args()
+    scenarios = [scenario for scenario in SCENARIOS if not arguments.only or any(scenario[0].startswith(prefix) for prefix in arguments.only)]
+    state = IgMockServer.MockIGState(latency = arguments.latency, jitter = arguments.jitter, record_padding = arguments.padding)
+    output = IgOutput.OutputBackend(arguments.output, arguments.float32, arguments.categorical)
+    results = run(scenarios, arguments.calls, arguments.threads, state, output)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20, 'display.float_format', '{:.2f}'.format):
+        print(results.to_string(index = False))
+    if arguments.json:
+        with open(arguments.json, 'w') as file:
+            json.dump({'commit': commit(),
+                       'date': datetime.now().isoformat(),
+                       'settings': vars(arguments),
+                       'results': results.replace({np.nan: None}).to_dict('records')}, file, indent = 2)
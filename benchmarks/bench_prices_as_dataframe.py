@@ -0,0 +1,70 @@
+'''
+Compares the single pass NumPy decoder behind IGMarketData.prices_as_dataframe with the pd.json_normalize path it replaced,
+on synthetic /prices payloads of the same shape IG returns.
+
+    python benchmarks/bench_prices_as_dataframe.py [numpoints ...]
+'''
+import os
+import sys
+import time
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import IgPriceDecoder
+
+def make_prices(numpoints: int):
+    start = datetime(2024, 1, 1)
+    prices = []
+    for i in range(numpoints):
+        level = 7500 + np.sin(i / 50) * 25
+        prices.append({'snapshotTime': (start + timedelta(minutes = i)).strftime('%Y/%m/%d %H:%M:%S'),
+                       'openPrice': {'bid': level, 'ask': level + 1, 'lastTraded': None},
+                       'closePrice': {'bid': level + 0.5, 'ask': level + 1.5, 'lastTraded': None},
+                       'highPrice': {'bid': level + 2, 'ask': level + 3, 'lastTraded': None},
+                       'lowPrice': {'bid': level - 2, 'ask': level - 1, 'lastTraded': None},
+                       'lastTradedVolume': i % 100})
+    # round trip through json so the payload holds the same python objects as a decoded response
+    return json.loads(json.dumps(prices))
+
+# the previous implementation of IGMarketData.prices_as_dataframe
+def json_normalize_frame(data: list):
+    df = pd.json_normalize(data)
+    df = df.set_index('snapshotTime')
+    df.index = pd.to_datetime(df.index)
+    df.index.name = "DateTime"
+    df.drop(columns = ['openPrice.lastTraded',
+                       'highPrice.lastTraded',
+                       'lowPrice.lastTraded',
+                       'closePrice.lastTraded'], inplace = True)
+    df.rename(columns = {'openPrice.ask': 'open_ask',
+                         'openPrice.bid': 'open_bid',
+                         'highPrice.ask': 'high_ask',
+                         'highPrice.bid': 'high_bid',
+                         'lowPrice.ask': 'low_ask',
+                         'lowPrice.bid': 'low_bid',
+                         'closePrice.ask': 'close_ask',
+                         'closePrice.bid': 'close_bid',
+                         'lastTradedVolume': 'volume'}, inplace = True)
+    return df
+
+def best_time(function, data: list, repeats: int = 7):
+    timings = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function(data)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] or [100, 1000, 10000, 100000]
+    print('{:>10} {:>16} {:>16} {:>10}'.format('numpoints', 'json_normalize ms', 'decoder ms', 'speedup'))
+    for size in sizes:
+        data = make_prices(size)
+        # the index type is left out, as pandas parses the times at a resolution of its choosing
+        pd.testing.assert_frame_equal(IgPriceDecoder.prices_frame(data), json_normalize_frame(data), check_index_type = False)
+        old = best_time(json_normalize_frame, data)
+        new = best_time(IgPriceDecoder.prices_frame, data)
+        print('{:>10} {:>16.2f} {:>16.2f} {:>9.1f}x'.format(size, old * 1000, new * 1000, old / new))
@@ -0,0 +1,59 @@
+'''
+Runs IgQuotePoller.QuotePoller against the mock server for a number of seconds, and a loop calling market_details_many for
+every epic each fast interval, as a client without change detection would, counting the requests each makes and the
+quotes each passes on.
+
+    python benchmarks/bench_quote_poller.py [epics] [seconds]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import IgRateLimiter
+from IGCustomPlatform import IGMarketData
+from IgMockServer import MockIGServer, MockIGState
+from IgQuotePoller import QuotePoller
+
+FAST_INTERVAL = 0.25
+SLOW_INTERVAL = 5
+HOT_FOR = 2
+
+def make_market(base_url: str):
+    market = IGMarketData(base_url = base_url, scheduler = IgRateLimiter.RequestScheduler(60000, 60000))
+    market.create_session()
+    return market
+
+def naive(market: IGMarketData, epics: list, seconds: float, state: MockIGState):
+    requests = state.requests
+    quotes = 0
+    cpu = time.process_time()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        started = time.monotonic()
+        quotes += len(market.market_details_many(epics, 'SNAPSHOT_ONLY'))
+        time.sleep(max(0, FAST_INTERVAL - (time.monotonic() - started)))
+    return state.requests - requests, quotes, time.process_time() - cpu
+
+def polled(market: IGMarketData, epics: list, seconds: float, state: MockIGState):
+    requests = state.requests
+    poller = QuotePoller(market, epics, FAST_INTERVAL, SLOW_INTERVAL, HOT_FOR)
+    quotes = []
+    poller.listeners.append(quotes.append)
+    cpu = time.process_time()
+    poller.start()
+    time.sleep(seconds)
+    poller.close()
+    return state.requests - requests, len(quotes), time.process_time() - cpu
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    epics = ['CS.D.MOCK{}.CFD.IP'.format(i) for i in range(count)]
+    state = MockIGState()
+    with MockIGServer(state = state) as server:
+        market = make_market(server.base_url)
+        print('{:>10} {:>8} {:>10} {:>10} {:>8}'.format('feed', 'epics', 'requests', 'quotes', 'cpu s'))
+        for name, run in [('naive', naive), ('poller', polled)]:
+            requests, quotes, cpu = run(market, epics, seconds, state)
+            print('{:>10} {:>8} {:>10} {:>10} {:>8.2f}'.format(name, count, requests, quotes, cpu))
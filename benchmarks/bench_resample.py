@@ -0,0 +1,55 @@
+'''
+Times IgResample.resample, which derives coarser bars from finer ones held in the price cache, against DataFrame.resample
+on synthetic minute bars with gaps and missing quotes, checking that both give the same bars.
+
+    python benchmarks/bench_resample.py [years ...]
+'''
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import IgResample
+from IgPriceCache import PRICE_COLUMNS
+
+# (IG resolution, pandas rule, offset)
+TARGETS = [('MINUTE_5', '5min', timedelta(0)),
+           ('HOUR', '1h', timedelta(0)),
+           ('HOUR_4', '4h', timedelta(hours = 22)),
+           ('DAY', '24h', timedelta(hours = 22))]
+
+def make_bars(years: int):
+    generator = np.random.default_rng(0)
+    minutes = years * 365 * 24 * 60
+    # about one minute in three has no bar, and one quote in a hundred is missing
+    held = np.sort(generator.choice(minutes, minutes * 2 // 3, replace = False))
+    times = np.datetime64('2020-01-01', 'ns') + held.astype('timedelta64[m]')
+    values = 7500 + generator.standard_normal((len(held), len(PRICE_COLUMNS))).cumsum(axis = 0)
+    values[generator.random(values.shape) < 0.01] = np.nan
+    return times, values
+
+def pandas_resample(prices: pd.DataFrame, rule: str, offset: timedelta):
+    aggregations = {column: {'open': 'first', 'close': 'last', 'high': 'max', 'low': 'min', 'sum': 'sum'}[aggregation] for column, aggregation in IgResample.AGGREGATIONS.items()}
+    bars = prices.resample(rule, offset = offset, label = 'left', closed = 'left')
+    resampled = bars.agg(aggregations)
+    return resampled[bars.size() > 0]
+
+if __name__ == '__main__':
+    years = [int(year) for year in sys.argv[1:]] or [1, 5]
+    print('{:>6} {:>10} {:>10} {:>12} {:>12} {:>9}'.format('years', 'bars', 'target', 'pandas ms', 'resample ms', 'speedup'))
+    for year in years:
+        times, values = make_bars(year)
+        prices = pd.DataFrame(values, index = pd.DatetimeIndex(times, name = 'DateTime'), columns = PRICE_COLUMNS)
+        for resolution, rule, offset in TARGETS:
+            start = time.perf_counter()
+            expected = pandas_resample(prices, rule, offset)
+            old = time.perf_counter() - start
+            start = time.perf_counter()
+            resampled = IgResample.resample(times, values, resolution, offset)
+            new = time.perf_counter() - start
+            np.testing.assert_array_equal(resampled[0], expected.index.values)
+            np.testing.assert_allclose(resampled[1], expected.to_numpy())
+            print('{:>6} {:>10} {:>10} {:>12.1f} {:>12.1f} {:>8.1f}x'.format(year, len(times), resolution, old * 1000, new * 1000, old / new))
@@ -0,0 +1,48 @@
+'''
+Runs rounds of strategy threads all asking the mock server for the same prices and market details at once, with and
+without an IgSingleFlight.SingleFlight on the api handler, counting the requests which reach the server and timing the
+rounds.
+
+    python benchmarks/bench_single_flight.py [threads] [rounds] [latency]
+'''
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import IgRateLimiter
+import IgSingleFlight
+from IGCustomPlatform import IGMarketData
+from IgMockServer import MockIGServer, MockIGState
+
+EPIC = 'CS.D.MOCK1.CFD.IP'
+
+def make_market(base_url: str, single_flight: IgSingleFlight.SingleFlight):
+    market = IGMarketData(base_url = base_url, scheduler = IgRateLimiter.RequestScheduler(60000, 60000), single_flight = single_flight)
+    market.create_session()
+    return market
+
+def strategy(market: IGMarketData):
+    session = market.worker_session()
+    prices = market.get_historical_data_numpoints(EPIC, 'MINUTE', 200, session = session)
+    details = market.market_details(EPIC, session = session)
+    return len(prices), details['marketDetails'][0]['snapshot']['bid']
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    state = MockIGState(latency = latency)
+    with MockIGServer(state = state) as server:
+        print('{:>14} {:>8} {:>8} {:>10} {:>12} {:>10}'.format('single flight', 'threads', 'rounds', 'requests', 'ms/round', 'coalesced'))
+        for single_flight in [None, IgSingleFlight.SingleFlight()]:
+            market = make_market(server.base_url, single_flight)
+            requests = state.requests
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers = threads) as executor:
+                for round in range(rounds):
+                    list(executor.map(strategy, [market] * threads))
+            elapsed = time.perf_counter() - start
+            coalesced = single_flight.stats()['coalesced'] if single_flight is not None else 0
+            print('{:>14} {:>8} {:>8} {:>10} {:>12.1f} {:>10}'.format('on' if single_flight is not None else 'off', threads, rounds, state.requests - requests, elapsed / rounds * 1000, coalesced))
@@ -0,0 +1,74 @@
+'''
+Times reloading a year of synthetic account activity saved by an end of day job, one export a day: from daily CSV files,
+parsing every date, epic and deal id again, against an IgSnapshot snapshot opened and read whole, for one month, and for
+one month of a few epics. The snapshot results are checked against the CSV ones.
+
+    python benchmarks/bench_snapshot.py [days] [activities_per_day]
+'''
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import IgSnapshot
+
+EPICS = ['CS.D.MOCK{i}.CFD.IP'.format(i = i) for i in range(200)]
+
+def make_day(day: int, activities: int):
+    generator = np.random.default_rng(day)
+    seconds = np.sort(generator.integers(0, 86400, activities))
+    return pd.DataFrame({'date': [(datetime(2024, 1, 1) + pd.Timedelta(days = day, seconds = int(second))).isoformat() for second in seconds],
+                         'epic': generator.choice(EPICS, activities),
+                         'dealId': ['DIAAA{day:04d}{number:06d}'.format(day = day, number = number) for number in range(activities)],
+                         'channel': generator.choice(['WEB', 'PUBLIC_WEB_API', 'MOBILE'], activities),
+                         'type': 'POSITION',
+                         'status': generator.choice(['ACCEPTED', 'REJECTED'], activities),
+                         'period': '-',
+                         'description': generator.choice(['Position opened', 'Position closed', 'Stop amended'], activities),
+                         'size': np.round(generator.uniform(0.5, 10, activities), 1),
+                         'level': np.round(7500 + generator.standard_normal(activities) * 50, 2)})
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+def read_csv(folder: str, files: list, start: datetime = None, end: datetime = None, epics: list = None):
+    history = pd.concat([pd.read_csv(os.path.join(folder, file), parse_dates = ['date']) for file in files], ignore_index = True)
+    if start is not None:
+        history = history[(history['date'] >= start) & (history['date'] <= end)]
+    if epics is not None:
+        history = history[history['epic'].isin(epics)]
+    return history.reset_index(drop = True)
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 250
+    activities = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    folder = tempfile.mkdtemp()
+    try:
+        files = []
+        for day in range(days):
+            history = make_day(day, activities)
+            files.append('{day:04d}.csv'.format(day = day))
+            history.to_csv(os.path.join(folder, files[-1]), index = False)
+            IgSnapshot.export_account_history(history, os.path.join(folder, 'snapshot'))
+        queries = [('all', None, None, None),
+                   ('one month', datetime(2024, 3, 1), datetime(2024, 3, 31, 23, 59, 59), None),
+                   ('month, 3 epics', datetime(2024, 3, 1), datetime(2024, 3, 31, 23, 59, 59), EPICS[:3])]
+        snapshot, opened = timed(lambda: IgSnapshot.Snapshot(os.path.join(folder, 'snapshot')))
+        print('{} activities in {} daily exports, snapshot opened in {:.1f} ms'.format(days * activities, days, opened * 1000))
+        print('{:>16} {:>10} {:>10} {:>14} {:>9}'.format('query', 'rows', 'csv ms', 'snapshot ms', 'speedup'))
+        for name, start, end, epics in queries:
+            expected, old = timed(lambda: read_csv(folder, files, start, end, epics))
+            selected, new = timed(lambda: snapshot.select(start, end, epics))
+            assert list(selected['dealId']) == list(expected['dealId'])
+            np.testing.assert_array_equal(selected['date'].to_numpy(), expected['date'].to_numpy())
+            np.testing.assert_allclose(selected['level'].to_numpy(), expected['level'].to_numpy())
+            print('{:>16} {:>10} {:>10.1f} {:>14.1f} {:>8.1f}x'.format(name, len(selected), old * 1000, new * 1000, old / new))
+    finally:
+        shutil.rmtree(folder)
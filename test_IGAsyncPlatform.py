@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import pytest
+from decimal import Decimal
+import IgRateLimiter
+from IgSessionManager import SessionManager
+from IGCustomPlatform import IGException
+from IGAsyncPlatform import AsyncIGMarketData, AsyncIGDealer
+from IgMockServer import MockIGServer, MockIGState
+
+EPIC = 'CS.D.MOCK1.CFD.IP'
+
+def unlimited():
+    return IgRateLimiter.RequestScheduler(60000, 60000)
+
+# answers the next `pending` requests after the login with IG's allowance error
+class ThrottlingState(MockIGState):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pending = 0
+
+    def throttle(self, method: str, path: str):
+        if self.pending > 0:
+            self.pending -= 1
+            return 'error.public-api.exceeded-account-allowance'
+        return None
+
+def test_login_sets_the_tokens_for_every_request():
+    async def run(base_url: str):
+        async with AsyncIGMarketData(base_url = base_url, scheduler = unlimited()) as market:
+            with pytest.raises(IGException):
+                await market.market_details(EPIC)
+            await market.create_session()
+            assert 'CST' in market.api_handler.headers and 'X-SECURITY-TOKEN' in market.api_handler.headers
+            return await market.market_details(EPIC)
+    state = MockIGState()
+    with MockIGServer(state = state) as server:
+        details = asyncio.run(run(server.base_url))
+    assert details['marketDetails'][0]['instrument']['epic'] == EPIC
+    assert state.logins == 1
+
+def test_gets_share_one_connection_pool():
+    epics = ['CS.D.MOCK{i}.CFD.IP'.format(i = i) for i in range(8)]
+    async def run(base_url: str):
+        async with AsyncIGMarketData(base_url = base_url, scheduler = unlimited()) as market:
+            await market.create_session()
+            prices = await asyncio.gather(*[market.get_historical_data_numpoints(epic, 'MINUTE', 20) for epic in epics])
+            details = await market.market_details_many(epics, chunk_size = 3)
+            found = await market.search_markets('Mock Market 1')
+            return prices, details, found
+    state = MockIGState(latency = 0.05)
+    with MockIGServer(state = state) as server:
+        prices, details, found = asyncio.run(run(server.base_url))
+    assert [len(frame) for frame in prices] == [20] * len(epics)
+    assert list(details.index) == epics
+    assert EPIC in list(found['epic'])
+
+def test_deal_is_confirmed_and_closed():
+    async def run(base_url: str):
+        async with AsyncIGDealer(base_url = base_url, scheduler = unlimited()) as dealer:
+            await dealer.create_session()
+            opened = await dealer.open_position('GBP', 'BUY', EPIC, None, 'MARKET', Decimal('1.5'), '-')
+            positions = await dealer.list_positions()
+            closed = await dealer.close_position(opened['dealId'][0], 'SELL', None, None, None, 'MARKET', Decimal('1.5'), None)
+            return opened, positions, closed, await dealer.list_positions()
+    with MockIGServer() as server:
+        opened, positions, closed, remaining = asyncio.run(run(server.base_url))
+    assert (opened['dealStatus'][0], opened['epic'][0], opened['direction'][0]) == ('ACCEPTED', EPIC, 'BUY')
+    assert list(positions[0]['epic']) == [EPIC] and len(positions[1]) == 1
+    assert (closed['dealStatus'][0], closed['dealId'][0]) == ('ACCEPTED', opened['dealId'][0])
+    assert len(remaining[1]) == 0
+
+def test_throttled_requests_are_sent_again():
+    async def run(base_url: str, state: ThrottlingState):
+        async with AsyncIGMarketData(base_url = base_url, scheduler = unlimited()) as market:
+            await market.create_session()
+            state.pending = 2
+            details = await market.market_details(EPIC)
+            return details, market.api_handler.budget_usage()['non_trading']['throttled']
+    state = ThrottlingState()
+    with MockIGServer(state = state) as server:
+        details, throttled = asyncio.run(run(server.base_url, state))
+    assert details['marketDetails'][0]['instrument']['epic'] == EPIC
+    assert throttled == 2
+
+# the manager logs in with blocking requests, which run on a worker thread rather than the event loop
+def test_expired_tokens_are_renewed_off_the_event_loop():
+    renewed_on = []
+    async def run(base_url: str, state: MockIGState):
+        async with AsyncIGMarketData(base_url = base_url, scheduler = unlimited()) as market:
+            manager = SessionManager(market)
+            assert manager.renew()
+            reauthenticate = manager.reauthenticate
+            def recording(response, generation: int):
+                renewed_on.append(threading.get_ident())
+                return reauthenticate(response, generation)
+            manager.reauthenticate = recording
+            with state.lock:
+                state.tokens.clear()
+            logins = state.logins
+            details = await asyncio.gather(*[market.market_details('CS.D.MOCK{i}.CFD.IP'.format(i = i)) for i in range(6)])
+            return details, state.logins - logins, manager.status()['generation']
+    state = MockIGState()
+    with MockIGServer(state = state) as server:
+        details, logins, generation = asyncio.run(run(server.base_url, state))
+    assert len(details) == 6
+    assert (logins, generation) == (1, 2)
+    assert len(renewed_on) > 0 and threading.get_ident() not in renewed_on
+
+def test_waiting_coroutines_are_served_by_priority():
+    scheduler = IgRateLimiter.RequestScheduler(non_trading_per_minute = 600)
+    scheduler.buckets['non_trading'].drain()
+    order = []
+    async def acquire(name: str, priority: int):
+        await scheduler.acquire_async('non_trading', priority)
+        order.append(name)
+    async def run():
+        # the first coroutine is already waiting for the next token when the others arrive, and is overtaken by them
+        tasks = [asyncio.create_task(acquire('data0', IgRateLimiter.DATA))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(acquire(name, priority)) for name, priority in [('data1', IgRateLimiter.DATA), ('account', IgRateLimiter.ACCOUNT), ('dealing', IgRateLimiter.DEALING)]]
+        await asyncio.gather(*tasks)
+    asyncio.run(run())
+    assert order == ['dealing', 'account', 'data0', 'data1']
+    assert scheduler.usage()['non_trading']['sent'] == 4
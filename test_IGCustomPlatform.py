@@ -0,0 +1,63 @@
+from datetime import datetime
+import threading
+import pytest
+import IgOutput
+import IgRateLimiter
+from IGCustomPlatform import IGDealer
+from IgMockServer import MockIGServer, MockIGState
+
+EPIC = 'CS.D.MOCK1.CFD.IP'
+
+def dealer(server: MockIGServer, cls: type = IGDealer):
+    dealer = cls(base_url = server.base_url, scheduler = IgRateLimiter.RequestScheduler(60000, 60000))
+    dealer.create_session()
+    return dealer
+
+def order(epic: str, direction: str = 'BUY'):
+    return {'epic': epic, 'direction': direction, 'size': 1, 'orderType': 'MARKET', 'currencyCode': 'GBP', 'expiry': '-'}
+
+# fails on confirming the deals of one market, as an unforeseen error would
+class FailingDealer(IGDealer):
+    def confirm_deal(self, dealReference: str, *args, **kwargs):
+        if self.get_deal_confirmation(dealReference, session = kwargs.get('session'))['epic'][0] == 'CS.D.MOCK2.CFD.IP':
+            raise RuntimeError('confirmation went missing')
+        return super().confirm_deal(dealReference, *args, **kwargs)
+
+def test_an_order_failing_unexpectedly_is_recorded_in_its_row():
+    with MockIGServer() as server:
+        results = dealer(server, FailingDealer).submit_orders([order(EPIC), order('CS.D.MOCK2.CFD.IP'), order('CS.D.MOCK3.CFD.IP')])
+    assert list(results['epic']) == [EPIC, 'CS.D.MOCK2.CFD.IP', 'CS.D.MOCK3.CFD.IP']
+    assert list(results['dealStatus'].isna()) == [False, True, False] and (results['dealStatus'][[0, 2]] == 'ACCEPTED').all()
+    assert results['error'][1] == 'RuntimeError: confirmation went missing'
+    assert results['error'].isna()[[0, 2]].all()
+
+def test_positions_listed_with_any_backend_are_closed():
+    with MockIGServer() as server:
+        ig = dealer(server)
+        ig.submit_orders([order(EPIC), order('CS.D.MOCK2.CFD.IP', 'SELL')])
+        results = ig.close_all_positions(ig.list_positions(output = IgOutput.OutputBackend('numpy')))
+        remaining = ig.list_positions()
+    assert sorted(zip(results['epic'], results['direction'])) == [(EPIC, 'SELL'), ('CS.D.MOCK2.CFD.IP', 'BUY')]
+    assert list(results['dealStatus']) == ['ACCEPTED', 'ACCEPTED']
+    assert len(remaining[1]) == 0
+
+def test_positions_which_are_not_tables_are_refused():
+    with MockIGServer() as server:
+        ig = dealer(server)
+        with pytest.raises(ValueError):
+            ig.close_all_positions(([{'epic': EPIC}], [{'dealId': 'DIAAA001', 'direction': 'BUY', 'size': 1}]))
+
+def test_history_pages_are_downloaded_on_a_session_of_their_own():
+    with MockIGServer(state = MockIGState(history_size = 120)) as server:
+        ig = dealer(server)
+        workers = []
+        worker_session = ig.worker_session
+        def recording():
+            session = worker_session()
+            workers.append((session, threading.get_ident()))
+            return session
+        ig.worker_session = recording
+        pages = list(ig.iter_account_history(0, 50, datetime(2024, 1, 1), datetime(2024, 2, 1)))
+    assert [len(page) for page in pages] == [50, 50, 20]
+    assert list(pages[2]['dealId'])[-1] == 'DIAAA00000119'
+    assert len(workers) == 1 and workers[0][0] is not ig.session and workers[0][1] != threading.get_ident()
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+import IgPriceCache
+import IgIndicators
+
+# seven minute bars around a random walk, with the first bars and a few values missing
+def prices(count: int):
+    rng = np.random.default_rng(7)
+    mid = 7500 + rng.standard_normal(count).cumsum()
+    values = np.empty((count, len(IgPriceCache.PRICE_COLUMNS)))
+    for i, offset in enumerate([0, 3, -3, 0.5]):
+        values[:, 2 * i] = mid + offset - 0.5
+        values[:, 2 * i + 1] = mid + offset + 0.5
+    values[:, 8] = rng.integers(0, 50, count)
+    values[:2] = np.nan
+    values[rng.random(values.shape) < 0.01] = np.nan
+    times = np.datetime64('2024-01-02', 'ns') + np.arange(count).astype('timedelta64[m]') * 7
+    return pd.DataFrame(values, index = pd.DatetimeIndex(times, name = 'DateTime'), columns = IgPriceCache.PRICE_COLUMNS)
+
+def engine():
+    return IgIndicators.IndicatorEngine({'sma': IgIndicators.SMA(20),
+                                         'ema': IgIndicators.EMA(20),
+                                         'atr': IgIndicators.ATR(14),
+                                         'rsi': IgIndicators.RSI(14),
+                                         'bollinger': IgIndicators.Bollinger(20),
+                                         'vwap': IgIndicators.VWAP(timedelta(hours = 22)),
+                                         'ema_bid': IgIndicators.EMA(10, side = 'bid')})
+
+def assert_columns_close(computed: pd.DataFrame, expected: pd.DataFrame):
+    assert list(computed.columns) == list(expected.columns)
+    for column in expected.columns:
+        np.testing.assert_allclose(computed[column].values, expected[column].values, rtol = 1e-9, atol = 1e-7, err_msg = column)
+
+def test_appended_bars_continue_the_batch():
+    bars = prices(2000)
+    batch = engine().compute(bars)
+    indicators = engine()
+    assert_columns_close(indicators.compute(bars.iloc[:1500]), batch.iloc[:1500])
+    assert_columns_close(indicators.append(bars.iloc[1500:]), batch.iloc[1500:])
+
+def test_bar_by_bar_matches_the_batch():
+    bars = prices(500)
+    assert_columns_close(engine().append(bars), engine().compute(bars))
+
+def test_numpy_columns_match_the_frame():
+    bars = prices(300)
+    columns = {'DateTime': bars.index.values}
+    columns.update({name: bars[name].to_numpy() for name in bars.columns})
+    computed = engine().compute(columns)
+    expected = engine().compute(bars)
+    for name in expected.columns:
+        np.testing.assert_allclose(computed[name], expected[name].values, err_msg = name)
+
+def test_moving_averages_match_pandas():
+    bars = prices(500)
+    computed = engine().compute(bars)
+    close = ((bars.close_bid + bars.close_ask) / 2).ffill()
+    np.testing.assert_allclose(computed.ema.values, close.ewm(span = 20, adjust = False).mean().values)
+    np.testing.assert_allclose(computed.sma.values, close.rolling(20).mean().values)
+    np.testing.assert_allclose(computed['bollinger.upper'].values, (close.rolling(20).mean() + 2 * close.rolling(20).std(ddof = 0)).values)
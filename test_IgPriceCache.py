@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+import IgRateLimiter
+import IgPriceCache
+from IGCustomPlatform import IGMarketData
+from IgMockServer import MockIGServer, MockIGState
+
+EPIC = 'CS.D.MOCK1.CFD.IP'
+
+# count minute bars from start, each holding different whole numbers
+def minute_prices(start: datetime, count: int):
+    index = pd.DatetimeIndex(pd.date_range(start, periods = count, freq = 'min'), name = 'DateTime')
+    values = np.arange(count * len(IgPriceCache.PRICE_COLUMNS), dtype = np.float64).reshape(count, -1)
+    return pd.DataFrame(values, index = index, columns = IgPriceCache.PRICE_COLUMNS)
+
+def held_values(prices: pd.DataFrame):
+    return prices.reindex(columns = IgPriceCache.PRICE_COLUMNS).to_numpy(dtype = np.float64)
+
+def test_missing_intervals_are_the_gaps_around_held_ranges(tmp_path):
+    cache = IgPriceCache.PriceCache(str(tmp_path))
+    start = datetime(2024, 1, 2, 10)
+    cache.store(EPIC, 'MINUTE', minute_prices(start, 120), start, start + timedelta(hours = 2))
+    cache.store(EPIC, 'MINUTE', minute_prices(start + timedelta(hours = 3), 60), start + timedelta(hours = 3), start + timedelta(hours = 4))
+    assert cache.missing_intervals(EPIC, 'MINUTE', start + timedelta(minutes = 30), start + timedelta(minutes = 90)) == []
+    assert cache.missing_intervals(EPIC, 'MINUTE', start - timedelta(hours = 1), start + timedelta(hours = 5)) == [(start - timedelta(hours = 1), start),
+                                                                                                               (start + timedelta(hours = 2), start + timedelta(hours = 3)),
+                                                                                                               (start + timedelta(hours = 4), start + timedelta(hours = 5))]
+    assert cache.missing_intervals(EPIC, 'HOUR', start, start + timedelta(hours = 1)) == [(start, start + timedelta(hours = 1))]
+
+def test_adjacent_downloads_merge_into_one_interval(tmp_path):
+    cache = IgPriceCache.PriceCache(str(tmp_path))
+    start = datetime(2024, 1, 2, 10)
+    cache.store(EPIC, 'MINUTE', minute_prices(start, 60), start, start + timedelta(hours = 1))
+    cache.store(EPIC, 'MINUTE', minute_prices(start + timedelta(hours = 1), 60), start + timedelta(hours = 1), start + timedelta(hours = 2))
+    assert cache.intervals(EPIC, 'MINUTE') == [(np.datetime64(start, 'ns'), np.datetime64(start + timedelta(hours = 2), 'ns'))]
+
+def test_load_returns_the_held_bars_in_range(tmp_path):
+    cache = IgPriceCache.PriceCache(str(tmp_path))
+    start = datetime(2024, 1, 2, 10)
+    prices = minute_prices(start, 60)
+    cache.store(EPIC, 'MINUTE', prices, start, start + timedelta(hours = 1))
+    loaded = cache.load(EPIC, 'MINUTE', start + timedelta(minutes = 10), start + timedelta(minutes = 19))
+    assert list(loaded.index) == list(prices.index[10:20])
+    np.testing.assert_array_equal(held_values(loaded), held_values(prices.iloc[10:20]))
+    assert len(cache.load('CS.D.MOCK2.CFD.IP', 'MINUTE')) == 0
+
+def test_newer_downloads_replace_held_bars(tmp_path):
+    cache = IgPriceCache.PriceCache(str(tmp_path))
+    start = datetime(2024, 1, 2, 10)
+    cache.store(EPIC, 'MINUTE', minute_prices(start, 10), start, start + timedelta(minutes = 10))
+    newer = minute_prices(start + timedelta(minutes = 9), 5) + 1000
+    cache.store(EPIC, 'MINUTE', newer, start + timedelta(minutes = 9), start + timedelta(minutes = 14))
+    loaded = cache.load(EPIC, 'MINUTE')
+    assert len(loaded) == 14
+    np.testing.assert_array_equal(held_values(loaded)[9:], held_values(newer))
+
+def test_interval_bounds_are_held_to_the_whole_second(tmp_path):
+    cache = IgPriceCache.PriceCache(str(tmp_path))
+    start = datetime(2024, 1, 2, 10, 0, 0, 250000)
+    cache.store(EPIC, 'MINUTE', minute_prices(start.replace(microsecond = 0), 60), start, start + timedelta(minutes = 59, seconds = 30))
+    assert cache.intervals(EPIC, 'MINUTE') == [(np.datetime64('2024-01-02T10:00:00', 'ns'), np.datetime64('2024-01-02T10:59:30', 'ns'))]
+    now = datetime.now()
+    cache.store(EPIC, 'SECOND', minute_prices(now - timedelta(minutes = 5), 1), now - timedelta(minutes = 5), now)
+    held_end = cache.intervals(EPIC, 'SECOND')[0][1]
+    assert held_end == held_end.astype('datetime64[s]')
+
+def market_data(server: MockIGServer, path: str):
+    market = IGMarketData(base_url = server.base_url, price_cache = IgPriceCache.PriceCache(path), derive = False, scheduler = IgRateLimiter.RequestScheduler(60000, 60000))
+    market.create_session()
+    return market
+
+def test_held_ranges_are_not_downloaded_again(tmp_path):
+    state = MockIGState()
+    with MockIGServer(state = state) as server:
+        market = market_data(server, str(tmp_path))
+        start, end = datetime(2024, 1, 2, 10), datetime(2024, 1, 2, 12)
+        requests = state.requests
+        first = market.get_historical_data_daterange(EPIC, 'MINUTE', start, end)
+        assert state.requests - requests == 1
+        requests = state.requests
+        again = market.get_historical_data_daterange(EPIC, 'MINUTE', start + timedelta(minutes = 30), end - timedelta(minutes = 30))
+        assert state.requests == requests
+        pd.testing.assert_frame_equal(again, first.loc[start + timedelta(minutes = 30):end - timedelta(minutes = 30)])
+        wider = market.get_historical_data_daterange(EPIC, 'MINUTE', start - timedelta(hours = 1), end)
+        assert state.requests - requests == 1
+        assert len(wider) == len(first) + 60
+
+# the held range ends a bar before the time it was downloaded at, which is not a whole second, and the mock like IG only
+# takes dates to the second
+def test_a_range_held_up_to_now_can_be_extended(tmp_path):
+    state = MockIGState()
+    with MockIGServer(state = state) as server:
+        market = market_data(server, str(tmp_path))
+        start = datetime.now().replace(second = 0, microsecond = 0) - timedelta(hours = 2)
+        first = market.get_historical_data_daterange(EPIC, 'MINUTE', start, datetime.now())
+        requests = state.requests
+        extended = market.get_historical_data_daterange(EPIC, 'MINUTE', start, datetime.now() + timedelta(minutes = 1))
+        assert state.requests - requests == 1
+        assert len(extended) >= len(first)
+        assert list(extended.index[:len(first) - 1]) == list(first.index[:-1])
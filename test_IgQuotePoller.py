@@ -0,0 +1,71 @@
+import IgResponseCache
+import IgSingleFlight
+from IGCustomPlatform import IGMarketData
+from IgQuotePoller import QuotePoller
+from IgMockServer import MockIGServer, MockIGState
+
+EPICS = ['CS.D.MOCK1.CFD.IP', 'CS.D.MOCK2.CFD.IP']
+
+# a gateway whose prices move with every snapshot it gives
+class MovingState(MockIGState):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.moves = 0
+
+    def snapshot(self, epic: str):
+        snapshot = super().snapshot(epic)
+        self.moves += 1
+        snapshot['bid'] = 100 + self.moves
+        snapshot['offer'] = 101 + self.moves
+        return snapshot
+
+def market_data(server: MockIGServer, **kwargs):
+    market = IGMarketData(base_url = server.base_url, **kwargs)
+    market.create_session()
+    return market
+
+def poll_all(poller: QuotePoller):
+    poller.due[:] = 0
+    return poller.poll()
+
+def test_every_poll_reaches_ig_past_the_response_cache():
+    state = MovingState()
+    with MockIGServer(state = state) as server:
+        response_cache = IgResponseCache.ResponseCache()
+        single_flight = IgSingleFlight.SingleFlight()
+        market = market_data(server, response_cache = response_cache, single_flight = single_flight)
+        poller = QuotePoller(market, EPICS)
+        requests = state.requests
+        first = poll_all(poller)
+        second = poll_all(poller)
+        poller.close()
+        assert [update['epic'] for update in first] == EPICS
+        assert [update['epic'] for update in second] == EPICS
+        assert all(after['bid'] > before['bid'] for before, after in zip(first, second))
+        assert state.requests - requests == 2
+        assert poller.status()['requests'] == 2
+        assert response_cache.stats()['hits'] == 0
+        assert single_flight.stats()['sent'] == 0
+
+def test_unchanged_snapshots_are_not_passed_on():
+    state = MovingState()
+    with MockIGServer(state = state) as server:
+        poller = QuotePoller(market_data(server), EPICS)
+        updates = []
+        poller.listeners.append(updates.append)
+        poll_all(poller)
+        state.moves -= len(EPICS)
+        assert poll_all(poller) == []
+        poller.close()
+        assert [update['epic'] for update in updates] == EPICS
+        assert poller.status()['changes'] == len(EPICS)
+
+def test_requests_which_never_reached_ig_are_not_counted():
+    server = MockIGServer().start()
+    market = market_data(server)
+    server.stop()
+    poller = QuotePoller(market, EPICS)
+    assert poll_all(poller) == []
+    poller.close()
+    status = poller.status()
+    assert (status['requests'], status['failures']) == (0, 1)
@@ -0,0 +1,85 @@
+import json
+import time
+import threading
+import pytest
+from requests import Session, Response
+import IgRateLimiter
+from IgApiHandler import ApiHandler
+
+# a session answering every GET with the next of the given (status, body) replies, recording the urls asked for
+class ScriptedSession(Session):
+    def __init__(self, replies: list):
+        super().__init__()
+        self.replies = list(replies)
+        self.urls = []
+
+    def get(self, url: str, **kwargs):
+        self.urls.append(url)
+        status, body = self.replies.pop(0)
+        response = Response()
+        response.status_code = status
+        response.encoding = 'utf-8'
+        response._content = json.dumps(body).encode('utf-8')
+        return response
+
+THROTTLED = (403, {'errorCode': 'error.public-api.exceeded-account-allowance'})
+
+def handler(replies: list, max_retries: int = 3):
+    return ApiHandler(session = ScriptedSession(replies), api_key = 'KEY', environment = 'demo', scheduler = IgRateLimiter.RequestScheduler(60000, 60000), max_retries = max_retries)
+
+def test_scheduler_serves_dealing_before_queued_data():
+    scheduler = IgRateLimiter.RequestScheduler(non_trading_per_minute = 240)
+    scheduler.buckets['non_trading'].drain()
+    order = []
+    def acquire(name: str, priority: int):
+        scheduler.acquire('non_trading', priority)
+        order.append(name)
+    # each caller is started once the one before it is queued, so they queue in a known order
+    def queue(name: str, priority: int):
+        thread = threading.Thread(target = acquire, args = (name, priority))
+        queued = len(scheduler.waiting['non_trading'])
+        thread.start()
+        while len(scheduler.waiting['non_trading']) == queued:
+            time.sleep(0.001)
+        return thread
+    threads = [queue('data' + str(i), IgRateLimiter.DATA) for i in range(3)]
+    threads.append(queue('account', IgRateLimiter.ACCOUNT))
+    threads.append(queue('dealing', IgRateLimiter.DEALING))
+    for thread in threads:
+        thread.join()
+    assert order == ['dealing', 'account', 'data0', 'data1', 'data2']
+    assert scheduler.usage()['non_trading']['sent'] == 5
+
+def test_token_bucket_waits_for_a_token_once_empty():
+    bucket = IgRateLimiter.TokenBucket(requests_per_minute = 600, capacity = 2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert 0 < bucket.try_acquire() <= 0.1
+
+def test_throttled_request_is_sent_again():
+    api_handler = handler([THROTTLED, THROTTLED, (200, {'accounts': []})])
+    response = api_handler.get(session = None, endpoint = '/accounts', version = '1')
+    assert response.status_code == 200
+    assert len(api_handler.session.urls) == 3
+    assert api_handler.budget_usage()['non_trading']['throttled'] == 2
+
+def test_throttled_request_gives_up_after_max_retries():
+    api_handler = handler([THROTTLED] * 3, max_retries = 2)
+    response = api_handler.get(session = None, endpoint = '/accounts', version = '1')
+    assert response.status_code == 403
+    assert api_handler.session.replies == []
+    assert api_handler.budget_usage()['non_trading']['throttled'] == 3
+
+def test_other_errors_are_not_sent_again():
+    api_handler = handler([(403, {'errorCode': 'error.security.api-key-disabled'})])
+    assert api_handler.get(session = None, endpoint = '/accounts', version = '1').status_code == 403
+    assert api_handler.budget_usage()['non_trading']['throttled'] == 0
+
+def test_used_up_historical_allowance_is_refused_until_it_resets():
+    scheduler = IgRateLimiter.RequestScheduler()
+    scheduler.record_allowance({'remainingAllowance': 0, 'totalAllowance': 10000, 'allowanceExpiry': 3600})
+    with pytest.raises(IgRateLimiter.AllowanceExceeded):
+        scheduler.acquire('historical')
+    scheduler.record_allowance({'remainingAllowance': 0, 'totalAllowance': 10000, 'allowanceExpiry': 0})
+    scheduler.acquire('historical')
+    assert scheduler.usage()['historical']['sent'] == 1
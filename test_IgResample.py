@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+import IgPriceCache
+import IgResample
+
+EPIC = 'CS.D.MOCK1.CFD.IP'
+
+# count minute bars from start whose every column holds the bar's number
+def minute_bars(start: datetime, count: int):
+    times = np.datetime64(start, 'ns') + np.arange(count).astype('timedelta64[m]')
+    values = np.tile(np.arange(count, dtype = np.float64)[:, None], (1, len(IgPriceCache.PRICE_COLUMNS)))
+    return times, values
+
+def bar(values: np.ndarray):
+    return dict(zip(IgPriceCache.PRICE_COLUMNS, values))
+
+def test_resample_aggregates_each_bar():
+    times, values = minute_bars(datetime(2024, 1, 2, 10), 120)
+    hour_times, hour_values = IgResample.resample(times, values, 'HOUR')
+    assert list(hour_times) == [np.datetime64('2024-01-02T10:00', 'ns'), np.datetime64('2024-01-02T11:00', 'ns')]
+    first, second = bar(hour_values[0]), bar(hour_values[1])
+    assert (first['open_bid'], first['high_ask'], first['low_bid'], first['close_ask'], first['volume']) == (0, 59, 0, 59, sum(range(60)))
+    assert (second['open_bid'], second['close_bid'], second['volume']) == (60, 119, sum(range(60, 120)))
+
+def test_resample_skips_missing_values():
+    times, values = minute_bars(datetime(2024, 1, 2, 10), 60)
+    values[0, :] = np.nan
+    values[59, IgPriceCache.PRICE_COLUMNS.index('close_bid')] = np.nan
+    resampled = bar(IgResample.resample(times, values, 'HOUR')[1][0])
+    assert (resampled['open_bid'], resampled['close_bid'], resampled['low_ask'], resampled['volume']) == (1, 58, 1, sum(range(60)))
+
+def test_resample_starts_bars_at_the_session_offset():
+    times, values = minute_bars(datetime(2024, 1, 2, 21), 120)
+    day_times = IgResample.resample(times, values, 'DAY', timedelta(hours = 22))[0]
+    assert list(day_times) == [np.datetime64('2024-01-01T22:00', 'ns'), np.datetime64('2024-01-02T22:00', 'ns')]
+
+def test_derive_refuses_partially_held_bars(tmp_path):
+    cache = IgPriceCache.PriceCache(str(tmp_path))
+    start = datetime(2024, 1, 2, 10)
+    times, values = minute_bars(start, 90)
+    cache.store_arrays(EPIC, 'MINUTE', times, values, start, start + timedelta(minutes = 89))
+    # the 11:00 bar is only held up to 11:29
+    assert IgResample.derive(cache, EPIC, 'HOUR', start, start + timedelta(hours = 1)) is None
+    hour_times, hour_values = IgResample.derive(cache, EPIC, 'HOUR', start, start + timedelta(minutes = 30))
+    assert list(hour_times) == [np.datetime64(start, 'ns')]
+    derived = bar(hour_values[0])
+    assert (derived['open_bid'], derived['high_bid'], derived['low_bid'], derived['close_bid'], derived['volume']) == (0, 59, 0, 59, sum(range(60)))
+
+def test_derive_needs_a_finer_resolution(tmp_path):
+    cache = IgPriceCache.PriceCache(str(tmp_path))
+    start = datetime(2024, 1, 2)
+    times, values = minute_bars(start, 60)
+    cache.store_arrays(EPIC, 'HOUR', times[:1], values[:1], start, start + timedelta(hours = 1))
+    assert IgResample.derive(cache, EPIC, 'MINUTE', start, start + timedelta(minutes = 10)) is None
+    assert IgResample.derive(cache, EPIC, 'HOUR', start, start + timedelta(minutes = 30)) is None
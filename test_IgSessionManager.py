@@ -0,0 +1,55 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from IgSessionManager import SessionManager
+from IGCustomPlatform import IGMarketData
+from IgMockServer import MockIGServer, MockIGState
+
+# tokens are expired by hand, as tokens with a short lifetime could also expire again before the callers' retries arrive
+def expire_tokens(state: MockIGState):
+    with state.lock:
+        state.tokens.clear()
+
+def test_expired_tokens_are_renewed_once_for_concurrent_callers():
+    state = MockIGState()
+    with MockIGServer(state = state) as server:
+        market = IGMarketData(base_url = server.base_url)
+        manager = SessionManager(market)
+        assert manager.renew()
+        expire_tokens(state)
+        logins = state.logins
+        sessions = [market.worker_session() for i in range(8)]
+        barrier = threading.Barrier(len(sessions))
+        def call(session):
+            barrier.wait()
+            return market.api_handler.get(session = session, endpoint = '/accounts', version = '1').status_code
+        with ThreadPoolExecutor(max_workers = len(sessions)) as executor:
+            statuses = list(executor.map(call, sessions))
+        assert statuses == [200] * len(sessions)
+        assert state.logins - logins == 1
+        assert manager.status()['generation'] == 2
+
+def test_rejected_posts_are_not_sent_again():
+    state = MockIGState()
+    with MockIGServer(state = state) as server:
+        market = IGMarketData(base_url = server.base_url)
+        manager = SessionManager(market)
+        manager.renew()
+        expire_tokens(state)
+        requests = state.requests
+        response = market.api_handler.post(session = None, endpoint = '/workingorders/otc', version = '2', params = {'epic': 'CS.D.MOCK1.CFD.IP'})
+        assert response.status_code == 401
+        assert manager.status()['logins'] == 2
+        assert market.api_handler.get(session = None, endpoint = '/accounts', version = '1').status_code == 200
+        # the rejected post, the login, and the get
+        assert state.requests - requests == 3
+
+def test_oauth_tokens_are_refreshed_rather_than_logged_in_again():
+    state = MockIGState()
+    with MockIGServer(state = state) as server:
+        market = IGMarketData(base_url = server.base_url)
+        manager = SessionManager(market, oauth = True)
+        manager.renew()
+        expire_tokens(state)
+        assert market.api_handler.get(session = None, endpoint = '/accounts', version = '1').status_code == 200
+        status = manager.status()
+        assert (status['logins'], status['refreshes']) == (1, 1)
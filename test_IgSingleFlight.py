@@ -0,0 +1,56 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import IgSingleFlight
+from IGCustomPlatform import IGMarketData
+from IgMockServer import MockIGServer, MockIGState
+
+EPIC = 'CS.D.MOCK1.CFD.IP'
+
+def market_data(server: MockIGServer, single_flight: IgSingleFlight.SingleFlight):
+    market = IGMarketData(base_url = server.base_url, single_flight = single_flight)
+    market.create_session()
+    return market
+
+# the callers all start together, and the mock's latency keeps the first request in flight until the others have joined it
+def call_together(market: IGMarketData, epics: list, function):
+    barrier = threading.Barrier(len(epics))
+    def call(epic):
+        session = market.worker_session()
+        barrier.wait()
+        return function(epic, session)
+    with ThreadPoolExecutor(max_workers = len(epics)) as executor:
+        return list(executor.map(call, epics))
+
+def test_concurrent_gets_are_sent_once():
+    state = MockIGState(latency = 0.2)
+    with MockIGServer(state = state) as server:
+        single_flight = IgSingleFlight.SingleFlight()
+        market = market_data(server, single_flight)
+        requests = state.requests
+        epics = call_together(market, [EPIC] * 8, lambda epic, session: market.market_details(epic, session = session)['marketDetails'][0]['instrument']['epic'])
+        assert epics == [EPIC] * 8
+        assert state.requests - requests == 1
+        stats = single_flight.stats()
+        assert (stats['sent'], stats['coalesced'], stats['in_flight']) == (1, 7, 0)
+
+def test_coalesced_callers_get_frames_of_their_own():
+    state = MockIGState(latency = 0.2)
+    with MockIGServer(state = state) as server:
+        single_flight = IgSingleFlight.SingleFlight()
+        market = market_data(server, single_flight)
+        frames = call_together(market, [EPIC] * 4, lambda epic, session: market.get_historical_data_numpoints(epic, 'MINUTE', 10, session = session))
+        assert single_flight.stats()['coalesced'] == 3
+        frames[0].iloc[0, 0] = -1
+        assert all(frame.iloc[0, 0] != -1 for frame in frames[1:])
+
+def test_different_requests_are_not_coalesced():
+    state = MockIGState(latency = 0.1)
+    with MockIGServer(state = state) as server:
+        single_flight = IgSingleFlight.SingleFlight()
+        market = market_data(server, single_flight)
+        requests = state.requests
+        epics = ['CS.D.MOCK{i}.CFD.IP'.format(i = i) for i in range(4)]
+        details = call_together(market, epics, lambda epic, session: market.market_details(epic, session = session)['marketDetails'][0]['instrument']['epic'])
+        assert details == epics
+        assert state.requests - requests == 4
+        assert single_flight.stats()['coalesced'] == 0
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from decimal import Decimal
+from datetime import datetime
+import IgSnapshot
+
+def history():
+    return pd.DataFrame({'date': pd.to_datetime(['2024-01-03 09:00', '2024-01-01 10:00', '2024-01-02 11:00', None]),
+                         'epic': ['CS.D.MOCK1.CFD.IP', 'CS.D.MOCK2.CFD.IP', 'CS.D.MOCK1.CFD.IP', 'CS.D.MOCK3.CFD.IP'],
+                         'dealId': ['DIAAA001', 'DIAAA002', 'DIAAA003', 'DIAAA004'],
+                         'size': [Decimal('1.50'), Decimal('-2'), None, Decimal('0.125')],
+                         'level': [7501.3, 7499.85, np.nan, 7510.0],
+                         'description': ['Position opened', None, 'Position closed', 'Position opened']})
+
+def values(series: pd.Series):
+    return [None if pd.isna(value) else value for value in series]
+
+def test_round_trip_keeps_decimal_and_string_columns(tmp_path):
+    frame = history()
+    IgSnapshot.export(frame, str(tmp_path), 'date')
+    snapshot = IgSnapshot.Snapshot(str(tmp_path))
+    encodings = {column['name']: column['encoding'] for part, meta in snapshot.parts for column in meta['columns']}
+    assert (encodings['epic'], encodings['size'], encodings['dealId']) == ('category', 'decimal', 'string')
+    # rows come back sorted by date, with the undated row first
+    expected = frame.sort_values('date', na_position = 'first').reset_index(drop = True)
+    loaded = snapshot.select(decimals = True)
+    assert list(loaded.columns) == list(frame.columns)
+    assert values(loaded.dealId) == values(expected.dealId)
+    assert values(loaded.epic.astype(object)) == values(expected.epic)
+    assert values(loaded.description) == values(expected.description)
+    assert values(loaded['size']) == values(expected['size'])
+    assert values(loaded.level) == [Decimal('7510.00'), Decimal('7499.85'), None, Decimal('7501.30')]
+    assert (loaded.date.isna() == expected.date.isna()).all()
+    assert (loaded.date.dropna().values == expected.date.dropna().values).all()
+    floats = snapshot.select(columns = ['size', 'level'])
+    np.testing.assert_array_equal(floats['size'].values, [0.125, -2.0, np.nan, 1.5])
+    np.testing.assert_array_equal(floats.level.values, expected.level.values)
+    snapshot.close()
+
+def test_select_filters_dates_and_epics_across_parts(tmp_path):
+    frame = history()
+    IgSnapshot.export(frame.iloc[:2], str(tmp_path), 'date')
+    IgSnapshot.export(frame.iloc[2:], str(tmp_path), 'date')
+    selected = IgSnapshot.load(str(tmp_path), datetime(2024, 1, 1, 12), datetime(2024, 1, 3, 12), epics = ['CS.D.MOCK1.CFD.IP'], decimals = True)
+    # rows are sorted within each part, and the parts come in the order they were exported
+    assert values(selected.dealId) == ['DIAAA001', 'DIAAA003']
+    assert values(selected['size']) == [Decimal('1.50'), None]
+    assert len(IgSnapshot.load(str(tmp_path), epics = ['CS.D.MOCK9.CFD.IP'])) == 0
+    assert IgSnapshot.Snapshot(str(tmp_path)).epics() == ['CS.D.MOCK1.CFD.IP', 'CS.D.MOCK2.CFD.IP', 'CS.D.MOCK3.CFD.IP']